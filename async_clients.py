@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""
+async_clients.py
+
+asyncio counterparts of the outbound calls on the webhook hot path, for webhook_asgi.py:
+
+- geocode_async(): same cache key, provider order, request spacing and 429 cooldown as
+  geocoding.geocode() (the GeocodeProvider objects are shared, so sync threads and async
+  tasks in one process draw from one rate budget), over the Nominatim/ArcGIS HTTP APIs.
+- find_closest_dealer_async(): same pre-filter, route cache, OSRM table batching and
+  fallbacks as odoo_connector.find_closest_dealer(); only the HTTP calls are async.
+
+All calls go through one httpx.AsyncClient per process (open_client()/close_client()),
+so connections to OSRM and the geocoders are pooled and kept alive between requests.
+Requires httpx (pip install httpx).
+"""
+
+from __future__ import annotations
+
+import asyncio
+from typing import Dict, Optional
+
+try:
+    import httpx
+except ImportError:  # only the ASGI server needs it
+    httpx = None
+
+import geocoding
+import metrics
+import odoo_connector
+from geocoding import Coords, GeocodeProvider, _coords, canonical_key, geocode_query
+from odoo_connector import (
+    DEALER_LOCATIONS,
+    MAX_DEALER_DRIVE_HOURS,
+    OSRM_ROUTE_FALLBACK_MAX_CALLS,
+    OSRM_ROUTE_TIMEOUT_S,
+    OSRM_TABLE_BATCH,
+    OSRM_TABLE_SMALL_BATCH,
+    OSRM_TABLE_TIMEOUT_S,
+    _dealer_route_candidates,
+    _osrm_route_entry,
+    _osrm_route_url,
+    _osrm_table_metrics_from_payload,
+    _osrm_table_url_one_to_many,
+    _pick_closest_dealer,
+    _route_key,
+)
+import route_cache
+from tracing import span, traced
+
+NOMINATIM_SEARCH_URL = "https://nominatim.openstreetmap.org/search"
+ARCGIS_FIND_URL = "https://geocode.arcgis.com/arcgis/rest/services/World/GeocodeServer/findAddressCandidates"
+GEOCODE_TIMEOUT_S = 10.0
+
+HTTP_MAX_CONNECTIONS = 100
+HTTP_MAX_KEEPALIVE = 20
+
+_CLIENT: Optional["httpx.AsyncClient"] = None
+
+
+def _require_httpx() -> None:
+    if httpx is None:
+        raise RuntimeError("httpx is required for the async server (pip install httpx)")
+
+
+# --------------------------------------------------------------------
+# Shared connection pool
+# --------------------------------------------------------------------
+def open_client() -> "httpx.AsyncClient":
+    """Create the process-wide client (call from the event loop that will use it)."""
+    global _CLIENT
+    _require_httpx()
+    if _CLIENT is None:
+        _CLIENT = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_KEEPALIVE),
+            headers={"User-Agent": geocoding.GEOCODER_USER_AGENT},
+            follow_redirects=True,
+        )
+    return _CLIENT
+
+
+async def close_client() -> None:
+    global _CLIENT
+    if _CLIENT is not None:
+        client, _CLIENT = _CLIENT, None
+        await client.aclose()
+
+
+async def _get_json(url: str, timeout: float, params: Optional[dict] = None):
+    resp = await open_client().get(url, params=params, timeout=timeout)
+    resp.raise_for_status()
+    return resp.json()
+
+
+# --------------------------------------------------------------------
+# Geocoding
+# --------------------------------------------------------------------
+async def _nominatim(query: str) -> Optional[Coords]:
+    rows = await _get_json(NOMINATIM_SEARCH_URL, GEOCODE_TIMEOUT_S, {"q": query, "format": "json", "limit": 1})
+    return _coords((rows[0].get("lat"), rows[0].get("lon"))) if rows else None
+
+
+async def _arcgis(query: str) -> Optional[Coords]:
+    data = await _get_json(ARCGIS_FIND_URL, GEOCODE_TIMEOUT_S, {"singleLine": query, "f": "json", "maxLocations": 1})
+    candidates = data.get("candidates") or []
+    if not candidates:
+        return None
+    loc = candidates[0].get("location") or {}
+    return _coords((loc.get("y"), loc.get("x")))
+
+
+_HTTP_GEOCODERS = {"nominatim": _nominatim, "arcgis": _arcgis}
+
+
+async def _provider_geocode(provider: GeocodeProvider, query: str) -> Optional[Coords]:
+    """GeocodeProvider.geocode(wait_on_cooldown=False) without blocking the event loop."""
+    fetch = _HTTP_GEOCODERS.get(provider.name)
+    if fetch is None:
+        return None
+    for i in range(1, provider.attempts + 1):
+        if provider.cooling_down():
+            provider.record("cooldown")
+            return None
+        wait_s = provider.reserve_turn()
+        if wait_s > 0:
+            await asyncio.sleep(wait_s)
+        try:
+            with span(f"geocode.{provider.name}"):
+                coords = await fetch(query)
+        except httpx.HTTPStatusError as e:
+            status = e.response.status_code
+            if status == 429:
+                provider.record("rate_limited")
+                provider.start_cooldown()
+            elif status < 500:
+                provider.record("error")
+                return None
+            else:
+                provider.record("error")
+                await asyncio.sleep(1.5 * i)
+        except (httpx.TimeoutException, httpx.TransportError):
+            provider.record("error")
+            await asyncio.sleep(1.5 * i)
+        except Exception:
+            provider.record("error")
+            return None
+        else:
+            provider.record("found" if coords is not None else "not_found")
+            return coords
+    return None
+
+
+@traced()
+async def geocode_async(city: str, prov: str, country: str = "Canada") -> Optional[Coords]:
+    """geocoding.geocode() for the event loop: shared geo cache first, then the provider chain."""
+    _require_httpx()
+    cache = geocoding.get_geo_cache()
+    ck = canonical_key(city, prov, country)
+    if not ck:
+        return None
+    hit = cache.get(ck)
+    metrics.inc("geocode_cache_total", result="hit" if hit is not None else "miss")
+    if hit is not None:
+        return hit
+
+    query = geocode_query(city, prov, country)
+    for provider in geocoding.shared_providers():
+        coords = await _provider_geocode(provider, query)
+        if coords is not None:
+            print(f"DEBUG: {provider.name} geocoded '{query}' → {coords[0]}, {coords[1]}", flush=True)
+            cache[ck] = coords
+            try:
+                await asyncio.to_thread(cache.save)
+            except Exception as e:
+                print(f"WARNING: Failed to save geo cache: {e}", flush=True)
+            return coords
+    print(f"WARNING: Could not geocode '{query}'", flush=True)
+    return None
+
+
+# --------------------------------------------------------------------
+# OSRM
+# --------------------------------------------------------------------
+async def _osrm_table_one_to_many(src_lat: float, src_lon: float, dests: list) -> Dict[int, dict]:
+    if not dests:
+        return {}
+    with span("osrm.table", coords=len(dests) + 1):
+        payload = await _get_json(_osrm_table_url_one_to_many(src_lat, src_lon, dests), OSRM_TABLE_TIMEOUT_S)
+    return _osrm_table_metrics_from_payload(payload, dests)
+
+
+async def _osrm_route_metrics(lat1: float, lon1: float, lat2: float, lon2: float, cache) -> Optional[dict]:
+    key = _route_key(lat1, lon1, lat2, lon2)
+    if route_cache.is_complete(cache.get(key)):
+        return cache[key]
+    try:
+        with span("osrm.route"):
+            entry = _osrm_route_entry(await _get_json(_osrm_route_url(lat1, lon1, lat2, lon2), OSRM_ROUTE_TIMEOUT_S))
+    except Exception:
+        return None
+    if entry is None:
+        return None
+    cache[key] = entry
+    return entry
+
+
+async def _fetch_chunk_metrics(customer_lat: float, customer_lon: float, chunk: list, cache) -> Dict[int, dict]:
+    """One table call for chunk; on failure smaller tables, then a bounded number of single routes."""
+    dests = [(idx, lat, lon) for idx, _, _, lat, lon in chunk]
+    try:
+        return await _osrm_table_one_to_many(customer_lat, customer_lon, dests)
+    except Exception as e:
+        print(f"WARNING dealer: OSRM table batch failed for {len(chunk)} destinations. error={e}", flush=True)
+
+    metrics_by_idx: Dict[int, dict] = {}
+    if len(chunk) > 1:
+        for j in range(0, len(chunk), OSRM_TABLE_SMALL_BATCH):
+            small_dests = dests[j:j + OSRM_TABLE_SMALL_BATCH]
+            try:
+                metrics_by_idx.update(await _osrm_table_one_to_many(customer_lat, customer_lon, small_dests))
+            except Exception as e_small:
+                print(
+                    f"WARNING dealer: OSRM small-table batch failed for {len(small_dests)} "
+                    f"destinations. error={e_small}",
+                    flush=True,
+                )
+
+    unresolved = [row for row in chunk if row[0] not in metrics_by_idx]
+    for idx, _dealer, _key, dlat, dlon in unresolved[:OSRM_ROUTE_FALLBACK_MAX_CALLS]:
+        m = await _osrm_route_metrics(customer_lat, customer_lon, float(dlat), float(dlon), cache)
+        if route_cache.is_complete(m):
+            metrics_by_idx[idx] = {"duration_s": float(m["duration_s"]), "distance_m": float(m["distance_m"])}
+    return metrics_by_idx
+
+
+@traced()
+async def find_closest_dealer_async(customer_lat, customer_lon, max_drive_hours: float = MAX_DEALER_DRIVE_HOURS):
+    """odoo_connector.find_closest_dealer() with non-blocking OSRM calls (table chunks run concurrently)."""
+    _require_httpx()
+    if not DEALER_LOCATIONS:
+        print("No dealer locations defined.")
+        return None
+
+    cache = odoo_connector._load_route_cache()
+    direct_rows, all_rows, missing = _dealer_route_candidates(customer_lat, customer_lon, max_drive_hours, cache)
+    if not direct_rows:
+        return None
+
+    lat, lon = float(customer_lat), float(customer_lon)
+    chunks = [missing[i:i + OSRM_TABLE_BATCH] for i in range(0, len(missing), OSRM_TABLE_BATCH)]
+    fetched = await asyncio.gather(*(_fetch_chunk_metrics(lat, lon, chunk, cache) for chunk in chunks))
+    cache_dirty = False
+    for chunk, metrics_by_idx in zip(chunks, fetched):
+        for idx, dealer, key, _lat, _lon in chunk:
+            m = metrics_by_idx.get(idx)
+            if not m:
+                continue
+            cache[key] = route_cache.make_entry(m["duration_s"], m["distance_m"])
+            cache_dirty = True
+            all_rows.append((idx, dealer, key, float(m["duration_s"]), float(m["distance_m"])))
+    print(f"DEBUG dealer: routes available after fetch={len(all_rows)}", flush=True)
+
+    if cache_dirty:
+        await asyncio.to_thread(odoo_connector._save_route_cache, cache)
+    return _pick_closest_dealer(customer_lat, customer_lon, max_drive_hours, direct_rows, all_rows)
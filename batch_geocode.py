@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+batch_geocode.py
+
+Batch geocoding stage for the report/search tools.
+
+Given the unique city/province/country keys a run needs, batch_geocode():
+1) skips keys already in the geo cache (and keys a checkpoint says already failed),
+2) spreads the rest over several providers at once (geocoding.shared_providers():
+   Nominatim + ArcGIS, the same pair webhook_server uses), one thread per provider,
+3) retries a key on the next provider when one provider can't find it,
+4) checkpoints results to disk every few keys so an interrupted run resumes
+   where it stopped instead of re-geocoding from scratch.
+
+Results are written into the caller's cache dict; callers still persist the cache
+the way they always have.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import tempfile
+import threading
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Set, Tuple, Union
+
+from geocoding import GeocodeProvider, geocode_query, shared_providers
+
+Coords = Tuple[float, float]
+GeoJob = Tuple[str, str, str]  # (city, prov, country)
+
+DEFAULT_CHECKPOINT_PATH = Path("geocode_checkpoint.json")
+
+
+def _load_checkpoint(path: Path) -> Tuple[Dict[str, Coords], Set[str]]:
+    if not path.exists():
+        return {}, set()
+    try:
+        raw = json.loads(path.read_text(encoding="utf-8"))
+    except Exception:
+        return {}, set()
+    resolved = {}
+    for k, v in (raw.get("resolved") or {}).items():
+        try:
+            resolved[k] = (float(v[0]), float(v[1]))
+        except Exception:
+            continue
+    return resolved, set(raw.get("failed") or [])
+
+
+def _save_checkpoint(path: Path, resolved: Dict[str, Coords], failed: Set[str]) -> None:
+    data = {"resolved": {k: list(v) for k, v in resolved.items()}, "failed": sorted(failed)}
+    fd, tmp = tempfile.mkstemp(prefix=f".{path.name}.", dir=str(path.parent.resolve()))
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def batch_geocode(
+    jobs: Dict[str, GeoJob],
+    cache: Dict[str, Coords],
+    providers: Optional[Sequence[GeocodeProvider]] = None,
+    checkpoint_path: Union[str, Path, None] = DEFAULT_CHECKPOINT_PATH,
+    checkpoint_every: int = 10,
+    progress_cb: Optional[Callable[[int, int], None]] = None,
+) -> Dict[str, int]:
+    """
+    Geocode every key in jobs ({cache_key: (city, prov, country)}) that is not in cache.
+    Found coordinates are stored in cache under the same key.
+    Returns stats: requested, cached, resumed, geocoded, failed, calls (provider requests made by this call).
+    progress_cb(done, total) is called as keys finish.
+    """
+    cp_path = Path(checkpoint_path) if checkpoint_path else None
+    cp_resolved, cp_failed = _load_checkpoint(cp_path) if cp_path else ({}, set())
+
+    stats = {"requested": len(jobs), "cached": 0, "resumed": 0, "geocoded": 0, "failed": 0, "calls": 0}
+    pending: List[str] = []
+    for k in jobs:
+        if k in cache:
+            stats["cached"] += 1
+        elif k in cp_resolved:
+            cache[k] = cp_resolved[k]
+            stats["resumed"] += 1
+        elif k in cp_failed:
+            stats["failed"] += 1
+        else:
+            pending.append(k)
+
+    if not pending:
+        if cp_path and cp_path.exists():
+            cp_path.unlink()
+        return stats
+
+    providers = list(providers) if providers is not None else shared_providers()
+    # Provider counters are process-wide (shared_providers); report only this run's requests.
+    calls_at_start = sum(p.calls for p in providers)
+    total = len(pending)
+    tried: Dict[str, Set[str]] = {k: set() for k in pending}
+    cond = threading.Condition()
+    in_flight = [0]
+    done = [0]
+    since_checkpoint = [0]
+
+    def finish(key: str, coords: Optional[Coords]) -> None:
+        # Called with cond held.
+        done[0] += 1
+        if coords is not None:
+            cache[key] = coords
+            cp_resolved[key] = coords
+            stats["geocoded"] += 1
+        else:
+            cp_failed.add(key)
+            stats["failed"] += 1
+        since_checkpoint[0] += 1
+        if cp_path and since_checkpoint[0] >= checkpoint_every:
+            _save_checkpoint(cp_path, cp_resolved, cp_failed)
+            since_checkpoint[0] = 0
+        if progress_cb:
+            progress_cb(done[0], total)
+
+    errors: List[BaseException] = []
+
+    def worker(provider: GeocodeProvider) -> None:
+        while True:
+            with cond:
+                while True:
+                    if errors:
+                        return
+                    key = next((k for k in pending if provider.name not in tried[k]), None)
+                    if key is not None:
+                        pending.remove(key)
+                        tried[key].add(provider.name)
+                        in_flight[0] += 1
+                        break
+                    # Nothing for this provider; wait while others may hand keys back.
+                    if in_flight[0] == 0:
+                        cond.notify_all()
+                        return
+                    cond.wait()
+
+            city, prov, country = jobs[key]
+            try:
+                coords = provider.geocode(geocode_query(city, prov, country))
+            except BaseException as e:
+                with cond:
+                    in_flight[0] -= 1
+                    errors.append(e)
+                    cond.notify_all()
+                return
+
+            with cond:
+                in_flight[0] -= 1
+                if coords is not None or len(tried[key]) >= len(providers):
+                    finish(key, coords)
+                else:
+                    pending.append(key)  # let another provider try it
+                cond.notify_all()
+
+    threads = [threading.Thread(target=worker, args=(p,), daemon=True) for p in providers]
+    try:
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    except BaseException as e:  # e.g. Ctrl+C: stop the workers and keep what we have
+        with cond:
+            errors.append(e)
+            cond.notify_all()
+    if errors:
+        if cp_path:
+            with cond:
+                _save_checkpoint(cp_path, cp_resolved, cp_failed)
+        raise errors[0]
+
+    stats["calls"] = sum(p.calls for p in providers) - calls_at_start
+    if cp_path and cp_path.exists():
+        cp_path.unlink()  # finished cleanly; the caller's cache now holds everything
+    return stats
@@ -0,0 +1,8 @@
+"""
+Benchmarks for the webhook and dealer-routing code. Run from the repository root, e.g.
+
+    python -m benchmarks.webhook_replay --submissions 300 --concurrency 16
+    python -m benchmarks.dealer_routing
+
+Nothing here talks to production Odoo, Nominatim or OSRM: fake_services.py stands in for them.
+"""
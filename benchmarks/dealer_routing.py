@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+"""
+dealer_routing.py
+
+Micro-benchmarks for the dealer-assignment engine, on the repo's real fixtures:
+geo_city_cache.json and route_duration_cache.json (imported into a fresh cache database in a
+temp directory) and leads_export.json (lead locations resolved from that geo cache).
+
+    python -m benchmarks.dealer_routing                   # run, compare with the stored baseline
+    python -m benchmarks.dealer_routing --save-baseline   # record a new baseline
+    python -m benchmarks.dealer_routing --only find_closest_dealer
+
+Cases (time per operation; the fastest of --rounds is compared, being the least noisy):
+- find_closest_dealer: cold route cache (new points each round, stub OSRM), warm route cache,
+  OSRM down (connection refused: table, small-table and route retries, then the distance fallback)
+- GeoCache.lookup: exact hit, variant spelling hit (case/punctuation/full province name/country
+  alias, resolved by canonical_key), miss
+- _match_dealer_option_value_by_location: exact label, partial label, no match
+- normalize_state / resolve_country on the export's province values and on spelled-out names
+- the report scripts' lead x dealer loops: straight-line nearest dealer per lead
+  (nearest_by_direct_distance), top-K driving pick from the warm route cache
+  (lead_nearest_dealer_report_v3 --use-driving), dealer radius matches (dealer_radius_report)
+
+OSRM is benchmarks.fake_services.StubOSRM with no added latency, so the cold numbers are this
+code's own cost plus a local HTTP round trip. Nothing reaches the network.
+
+Baselines live in benchmarks/baselines/dealer_routing.json. A case slower than its baseline by
+more than --tolerance (default 0.5 = +50%) is reported as a regression and the exit code is 1.
+Timings depend on the machine: record the baseline on the machine that runs the check.
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+if str(REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(REPO_ROOT))
+
+import dealer_radius_report  # noqa: E402
+import lead_nearest_dealer_report_v3 as report_v3  # noqa: E402
+import odoo_connector  # noqa: E402
+from benchmarks.fake_services import StubOSRM  # noqa: E402
+from geocoding import PROVINCE_NAMES, canonical_province, get_geo_cache  # noqa: E402
+from leads_export_io import load_leads_export  # noqa: E402
+from leads_snapshot import lead_location  # noqa: E402
+
+BASELINE_PATH = Path(__file__).resolve().parent / "baselines" / "dealer_routing.json"
+FIXTURES = ("geo_city_cache.json", "route_duration_cache.json")
+OSRM_DOWN_URL = "http://127.0.0.1:9"  # discard port: connection refused at once
+DEFAULT_POINTS = 60
+DEFAULT_ROUNDS = 7
+DEFAULT_TOLERANCE = 0.5
+
+Case = Tuple[str, Callable[[], int]]  # (name, run one round -> operations done)
+
+
+# --------------------------------------------------------------------
+# Fixtures
+# --------------------------------------------------------------------
+def prepare_workdir() -> Path:
+    """Temp dir holding copies of the cache fixtures; caches import them on first use."""
+    workdir = Path(tempfile.mkdtemp(prefix="wavcor-bench-"))
+    for name in FIXTURES:
+        shutil.copy(REPO_ROOT / name, workdir / name)
+    os.chdir(workdir)
+    return workdir
+
+
+def resolve_leads(leads: List[dict]) -> Tuple[List[Tuple[str, str, str]], List[Tuple[float, float]]]:
+    """Export locations found in the geo cache, and their distinct coordinates."""
+    cache = get_geo_cache()
+    locations, coords = [], {}
+    for lead in leads:
+        city, prov, country = lead_location(lead)
+        c = cache.lookup(city, prov, country)
+        if c is not None:
+            locations.append((city, prov, country))
+            coords[c] = None
+    return locations, list(coords)
+
+
+def _variant(city: str, prov: str, country: str) -> Tuple[str, str, str]:
+    """Same place, spelled the way a form or an old cache key might have it."""
+    code = canonical_province(prov)
+    prov_text = (PROVINCE_NAMES.get(code) or prov).upper()
+    country_text = {"canada": "CA", "united states": "USA"}.get(country.strip().lower(), country)
+    return f"  {city.upper()}. ", prov_text, country_text
+
+
+# --------------------------------------------------------------------
+# Cases
+# --------------------------------------------------------------------
+def dealer_cases(points: List[Tuple[float, float]], osrm_url: str) -> List[Case]:
+    cold_round = [0]
+
+    def cold():
+        # Shift every point by a few metres per round so no route is cached yet.
+        cold_round[0] += 1
+        shift = cold_round[0] * 1e-4
+        odoo_connector.OSRM_BASE_URL = osrm_url
+        for lat, lon in points:
+            odoo_connector.find_closest_dealer(lat + shift, lon)
+        return len(points)
+
+    def warm():
+        odoo_connector.OSRM_BASE_URL = osrm_url
+        for lat, lon in points:
+            odoo_connector.find_closest_dealer(lat, lon)
+        return len(points)
+
+    down_points = points[: max(1, len(points) // 6)]
+    down_round = [0]
+
+    def osrm_down():
+        down_round[0] += 1
+        shift = -down_round[0] * 1e-4
+        odoo_connector.OSRM_BASE_URL = OSRM_DOWN_URL
+        try:
+            for lat, lon in down_points:
+                odoo_connector.find_closest_dealer(lat + shift, lon)
+        finally:
+            odoo_connector.OSRM_BASE_URL = osrm_url
+        return len(down_points)
+
+    warm()  # fill the route cache for the warm case
+    return [
+        ("find_closest_dealer cold cache", cold),
+        ("find_closest_dealer warm cache", warm),
+        ("find_closest_dealer OSRM down", osrm_down),
+    ]
+
+
+def geo_cache_cases(locations: List[Tuple[str, str, str]]) -> List[Case]:
+    cache = get_geo_cache()
+    variants = [_variant(*loc) for loc in locations]
+    misses = [(f"Nowhere {i}", prov, country) for i, (_, prov, country) in enumerate(locations)]
+    found = sum(cache.lookup(*v) is not None for v in variants)
+    if found != len(variants):
+        print(f"NOTE: {len(variants) - found}/{len(variants)} variant spellings did not resolve to the cached key", file=sys.stderr)
+
+    def run(queries):
+        def fn():
+            for q in queries:
+                cache.lookup(*q)
+            return len(queries)
+        return fn
+
+    return [
+        ("GeoCache.lookup exact hit", run(locations)),
+        ("GeoCache.lookup variant hit", run(variants)),
+        ("GeoCache.lookup miss", run(misses)),
+    ]
+
+
+def option_match_cases() -> List[Case]:
+    options = [[f"dealer_{i}", d["Location"]] for i, d in enumerate(odoo_connector.DEALER_LOCATIONS)]
+    exact = [d["Location"] for d in odoo_connector.DEALER_LOCATIONS]
+    partial = [loc.split(" - ", 1)[-1] for loc in exact]
+    missing = [f"Nowhere Co-op {i}" for i in range(len(exact))]
+
+    def run(names):
+        def fn():
+            for name in names:
+                odoo_connector._match_dealer_option_value_by_location(options, name)
+            return len(names)
+        return fn
+
+    return [
+        ("_match_dealer_option_value_by_location exact", run(exact)),
+        ("_match_dealer_option_value_by_location partial", run(partial)),
+        ("_match_dealer_option_value_by_location miss", run(missing)),
+    ]
+
+
+def state_cases(leads: List[dict]) -> List[Case]:
+    values = [lead_location(lead)[1] for lead in leads]
+    values = [v for v in values if v]
+    names = [name.title() for name in odoo_connector.NAME_TO_CODE]
+
+    def run(fn, inputs):
+        def round_():
+            for v in inputs:
+                fn(v)
+            return len(inputs)
+        return round_
+
+    return [
+        ("normalize_state export values", run(odoo_connector.normalize_state, values)),
+        ("normalize_state spelled-out names", run(odoo_connector.normalize_state, names)),
+        ("resolve_country export values", run(odoo_connector.resolve_country, values)),
+    ]
+
+
+def report_cases(points: List[Tuple[float, float]], osrm_url: str) -> List[Case]:
+    dealers = report_v3._prepare_dealers()
+    dealer_dicts = [d for d in odoo_connector.DEALER_LOCATIONS if d.get("Latitude") is not None]
+    routes = report_v3._load_routes_cache()
+    odoo_connector.OSRM_BASE_URL = osrm_url
+    report_v3.OSRM_BASE_URL = osrm_url
+    resolved = [({}, lat, lon) for lat, lon in points]
+    _, unroutable = report_v3.prefetch_driving_matrix(resolved, dealers, report_v3.DEFAULT_TOPK, routes)
+    report_v3._save_routes_cache(routes)
+
+    def nearest():
+        for lat, lon in points:
+            odoo_connector.nearest_by_direct_distance(lat, lon, dealers)
+        return len(points)
+
+    def driving():
+        for lat, lon in points:
+            report_v3._nearest_dealer_by_driving(lat, lon, dealers, report_v3.DEFAULT_TOPK, routes, unroutable)
+        return len(points)
+
+    def radius():
+        dealer_radius_report.dealer_radius_matches(dealer_dicts, points, 50.0)
+        return 1
+
+    return [
+        ("report nearest dealer per lead (straight line)", nearest),
+        ("report nearest dealer per lead (driving, warm)", driving),
+        ("report dealer radius matches, all leads (50 km)", radius),
+    ]
+
+
+# --------------------------------------------------------------------
+# Harness
+# --------------------------------------------------------------------
+def time_case(fn: Callable[[], int], rounds: int) -> dict:
+    per_op = []
+    ops = 0
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for _ in range(rounds):
+            t0 = time.perf_counter()
+            ops = fn()
+            per_op.append((time.perf_counter() - t0) * 1000.0 / max(1, ops))
+    return {"ms_per_op": statistics.median(per_op), "min_ms_per_op": min(per_op), "ops_per_round": ops}
+
+
+def compare(results: Dict[str, dict], baseline: dict, tolerance: float) -> List[str]:
+    regressions = []
+    base = baseline.get("results", {})
+    for name, r in results.items():
+        b = base.get(name)
+        if not b:
+            continue
+        ratio = r["min_ms_per_op"] / b["min_ms_per_op"] if b["min_ms_per_op"] else 1.0
+        r["baseline_min_ms_per_op"] = b["min_ms_per_op"]
+        r["ratio"] = round(ratio, 2)
+        if ratio > 1.0 + tolerance:
+            regressions.append(name)
+    return regressions
+
+
+def print_results(results: Dict[str, dict], regressions: List[str]) -> None:
+    print(f"{'case':<52} {'median':>10} {'min':>10} {'ops':>6} {'base min':>10} {'ratio':>6}")
+    for name, r in results.items():
+        base = f"{r['baseline_min_ms_per_op']:.4f}" if "baseline_min_ms_per_op" in r else "-"
+        ratio = f"{r['ratio']:.2f}" if "ratio" in r else "-"
+        flag = "  ❌ REGRESSION" if name in regressions else ""
+        print(f"{name:<52} {r['ms_per_op']:>10.4f} {r['min_ms_per_op']:>10.4f} {r['ops_per_round']:>6} {base:>10} {ratio:>6}{flag}")
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Micro-benchmarks for dealer routing on the repo's cache and lead fixtures.")
+    ap.add_argument("--leads", default=str(REPO_ROOT / "leads_export.json"), help="Leads export fixture (default: repo leads_export.json)")
+    ap.add_argument("--points", type=int, default=DEFAULT_POINTS,
+                    help=f"Distinct lead locations for the find_closest_dealer cases (default {DEFAULT_POINTS})")
+    ap.add_argument("--rounds", type=int, default=DEFAULT_ROUNDS, help=f"Rounds per case (default {DEFAULT_ROUNDS})")
+    ap.add_argument("--only", default=None, help="Run only cases whose name contains this text")
+    ap.add_argument("--baseline", default=str(BASELINE_PATH), help="Baseline file (default: %(default)s)")
+    ap.add_argument("--save-baseline", action="store_true", help="Write this run as the new baseline")
+    ap.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                    help=f"Allowed slowdown vs baseline before failing (default {DEFAULT_TOLERANCE} = +50%%)")
+    ap.add_argument("--json", help="Also write the results to this JSON file")
+    args = ap.parse_args()
+
+    baseline_path = Path(args.baseline).resolve()
+    json_path = Path(args.json).resolve() if args.json else None
+    leads = load_leads_export(Path(args.leads).resolve())
+    workdir = prepare_workdir()
+    osrm = StubOSRM().start()
+
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        locations, coords = resolve_leads(leads)
+        points = coords[: args.points]
+        builders = [
+            lambda: dealer_cases(points, osrm.url),
+            lambda: geo_cache_cases(locations),
+            option_match_cases,
+            lambda: state_cases(leads),
+            lambda: report_cases(coords, osrm.url),
+        ]
+        cases: List[Case] = []
+        for build in builders:
+            cases.extend(build())
+    print(f"Fixtures: {len(leads)} leads, {len(locations)} with cached coordinates ({len(coords)} distinct), "
+          f"{len(odoo_connector.dealer_points())} dealers; work dir {workdir}")
+
+    results: Dict[str, dict] = {}
+    for name, fn in cases:
+        if args.only and args.only.lower() not in name.lower():
+            continue
+        results[name] = time_case(fn, max(1, args.rounds))
+    osrm.stop()
+
+    baseline: Optional[dict] = None
+    if baseline_path.exists() and not args.save_baseline:
+        baseline = json.loads(baseline_path.read_text(encoding="utf-8"))
+    regressions = compare(results, baseline, args.tolerance) if baseline else []
+    print_results(results, regressions)
+
+    if args.save_baseline:
+        baseline_path.parent.mkdir(parents=True, exist_ok=True)
+        baseline_path.write_text(json.dumps({
+            "recorded_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "machine": f"{platform.system()} {platform.machine()}",
+            "results": {
+                k: {"min_ms_per_op": round(v["min_ms_per_op"], 5), "ms_per_op": round(v["ms_per_op"], 5), "ops_per_round": v["ops_per_round"]}
+                for k, v in results.items()
+            },
+        }, indent=2) + "\n", encoding="utf-8")
+        print(f"Wrote baseline: {baseline_path}")
+    elif baseline is None:
+        print(f"No baseline at {baseline_path}; run with --save-baseline to record one.")
+    elif regressions:
+        print(f"❌ {len(regressions)} case(s) slower than baseline by more than {args.tolerance:.0%}: {', '.join(regressions)}")
+    else:
+        print(f"✅ No case slower than baseline by more than {args.tolerance:.0%}.")
+
+    if json_path:
+        json_path.write_text(json.dumps(results, indent=2), encoding="utf-8")
+        print(f"Wrote: {json_path}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,412 @@
+#!/usr/bin/env python3
+"""
+fake_services.py
+
+Local stand-ins for the services the webhook calls, for benchmarks:
+
+- FakeOdoo: XML-RPC (/xmlrpc/2/common, /xmlrpc/2/object) and JSON-RPC (/jsonrpc) server over
+  in-memory tables (res.partner, crm.lead, crm.tag, res.country(.state), mail.activity, ...),
+  seeded with what the webhook looks up (countries/states, crm.lead model, To-Do activity
+  type, a crm.team whose Dealer property lists every DEALER_LOCATIONS entry). Supports the
+  ORM calls the webhook makes (search/search_read/read/create/write/fields_get/message_post/...)
+  with Odoo-style domains, and counts calls per model.method.
+- StubGeocoder: Nominatim /search and ArcGIS findAddressCandidates; deterministic prairie
+  coordinates per query.
+- StubOSRM: /route and /table answers from straight-line distance (x1.3 at 85 km/h).
+
+Each has a per-request latency (latency_s) to model the real service.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import re
+import threading
+import time
+import urllib.parse
+import xmlrpc.client
+from collections import Counter
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+from odoo_connector import CANONICAL_CODES, DEALER_LOCATIONS, haversine_distance, resolve_country
+
+
+class _StubServer:
+    """Threaded HTTP server on 127.0.0.1:<free port>; subclasses implement handle(handler)."""
+
+    def __init__(self, latency_s: float = 0.0):
+        self.latency_s = latency_s
+        owner = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True  # headers and body go out as separate writes
+
+            def do_GET(self):
+                owner._serve(self)
+
+            do_POST = do_GET
+
+            def log_message(self, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "_StubServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name=type(self).__name__, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def _serve(self, h: BaseHTTPRequestHandler) -> None:
+        if self.latency_s > 0:
+            time.sleep(self.latency_s)
+        length = int(h.headers.get("Content-Length") or 0)
+        body = h.rfile.read(length) if length else b""
+        status, content_type, data = self.handle(h.command, h.path, body)
+        h.send_response(status)
+        h.send_header("Content-Type", content_type)
+        h.send_header("Content-Length", str(len(data)))
+        h.end_headers()
+        h.wfile.write(data)
+
+    def handle(self, method: str, path: str, body: bytes):
+        raise NotImplementedError
+
+
+def _json(obj, status: int = 200):
+    return status, "application/json", json.dumps(obj).encode("utf-8")
+
+
+# --------------------------------------------------------------------
+# Odoo
+# --------------------------------------------------------------------
+MANY2ONE = {
+    "country_id": "res.country",
+    "state_id": "res.country.state",
+    "partner_id": "res.partner",
+    "user_id": "res.users",
+    "team_id": "crm.team",
+    "create_uid": "res.users",
+    "activity_type_id": "mail.activity.type",
+}
+MODEL_FIELDS = {
+    "res.partner": ["name", "email", "phone", "mobile", "city", "state_id", "country_id", "category_id"],
+    "crm.lead": ["name", "partner_id", "description", "tag_ids", "city", "state_id", "country_id",
+                 "user_id", "team_id", "lead_properties", "type", "active"],
+}
+
+
+def _like(value, pattern: str) -> bool:
+    return str(pattern).casefold() in str(value or "").casefold()
+
+
+def _leaf(rec: dict, field: str, op: str, value) -> bool:
+    v = rec.get(field)
+    if isinstance(v, list) and len(v) == 2 and isinstance(v[0], int):
+        v = v[0]
+    if op == "=":
+        return v == value or (value is False and not v)
+    if op == "!=":
+        return not _leaf(rec, field, "=", value)
+    if op in ("ilike", "like"):
+        return _like(v, value)
+    if op == "=ilike":
+        return str(v or "").casefold() == str(value).casefold()
+    if op == "in":
+        return v in value
+    if op == "not in":
+        return v not in value
+    if v in (None, False):
+        return False
+    return {"<": v < value, "<=": v <= value, ">": v > value, ">=": v >= value}[op]
+
+
+def _merge_properties(current, vals):
+    """Odoo's write of {property name: value} onto a stored [{name, value, ...}] properties list."""
+    if not isinstance(vals, dict) or not isinstance(current, list):
+        return vals
+    out = []
+    for item in current:
+        if isinstance(item, dict) and item.get("name") in vals:
+            item = {**item, "value": vals[item["name"]]}
+        out.append(item)
+    return out
+
+
+def _matches(rec: dict, domain: list) -> bool:
+    """Odoo domain (prefix &, |, ! and implicit AND) against one record."""
+
+    def ev(i):
+        term = domain[i]
+        if term == "!":
+            ok, i = ev(i + 1)
+            return not ok, i
+        if term in ("&", "|"):
+            a, i = ev(i + 1)
+            b, i = ev(i)
+            return (a and b if term == "&" else a or b), i
+        return _leaf(rec, *term), i + 1
+
+    i, ok = 0, True
+    while i < len(domain):
+        leaf_ok, i = ev(i)
+        ok = ok and leaf_ok
+    return ok
+
+
+class FakeOdoo(_StubServer):
+    def __init__(self, latency_s: float = 0.0, db: str = "bench", uid: int = 2):
+        super().__init__(latency_s)
+        self.db = db
+        self.uid = uid
+        self.tables: Dict[str, Dict[int, dict]] = {}
+        self.calls: Counter = Counter()
+        self._next_id = 1
+        self._lock = threading.Lock()
+        self._seed()
+
+    # -- data ------------------------------------------------------------
+    def insert(self, model: str, vals: dict) -> int:
+        with self._lock:
+            rid = self._next_id
+            self._next_id += 1
+            now = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+            self.tables.setdefault(model, {})[rid] = {
+                "id": rid, "create_date": now, "write_date": now, "create_uid": self.uid, **vals,
+            }
+            return rid
+
+    def _seed(self) -> None:
+        countries = {name: self.insert("res.country", {"name": name}) for name in ("Canada", "United States", "Australia")}
+        for code in sorted(CANONICAL_CODES):
+            country = resolve_country(code)
+            if isinstance(country, list):
+                country = country[0]
+            if country in countries:
+                self.insert("res.country.state", {"name": code, "code": code, "country_id": countries[country]})
+        self.insert("ir.model", {"name": "Lead", "model": "crm.lead"})
+        self.insert("res.users", {"name": "Sales", "partner_id": self.insert("res.partner", {"name": "Sales"})})
+        self.insert("mail.activity.type", {"name": "To-Do"})
+        selection = [[f"dealer_{i}", d["Location"]] for i, d in enumerate(DEALER_LOCATIONS)]
+        self.insert("crm.team", {
+            "name": "Sales",
+            "lead_properties_definition": [
+                {"name": "dealer_prop", "string": "Dealer", "type": "selection", "selection": selection},
+            ],
+        })
+
+    def count(self, model: str) -> int:
+        return len(self.tables.get(model, {}))
+
+    def reset_counts(self) -> None:
+        with self._lock:
+            self.calls.clear()
+
+    # -- ORM ---------------------------------------------------------------
+    def _read(self, model: str, rec: dict, fields: Optional[list]) -> dict:
+        out = {}
+        for f in fields or list(rec):
+            v = rec.get(f, False)
+            target = MANY2ONE.get(f)
+            if target and isinstance(v, int) and v:
+                other = self.tables.get(target, {}).get(v, {})
+                v = [v, other.get("name", "")]
+            out[f] = v
+        out["id"] = rec["id"]
+        return out
+
+    def _create_defaults(self, model: str, vals: dict) -> dict:
+        """Like Odoo: a new lead gets the default (first) team and that team's properties."""
+        if model != "crm.lead":
+            return vals
+        vals = dict(vals)
+        teams = self.tables.get("crm.team", {})
+        if not vals.get("team_id") and teams:
+            vals["team_id"] = min(teams)
+        team = teams.get(vals.get("team_id"), {})
+        props = [{**d, "value": False} for d in team.get("lead_properties_definition") or []]
+        vals["lead_properties"] = _merge_properties(props, vals.get("lead_properties") or {})
+        return vals
+
+    def _search(
+        self,
+        model: str,
+        domain: list,
+        offset: int = 0,
+        limit: Optional[int] = None,
+        order: Optional[str] = None,
+        active_test: bool = True,
+    ) -> List[dict]:
+        domain = domain or []
+        # Like Odoo's active_test: archived records only match when the domain asks about active.
+        active_only = active_test and not any(isinstance(t, (list, tuple)) and t[0] == "active" for t in domain)
+        with self._lock:
+            rows = [
+                r for r in self.tables.get(model, {}).values()
+                if _matches(r, domain) and not (active_only and r.get("active") is False)
+            ]
+        rows.sort(key=lambda r: r["id"], reverse=bool(order and "desc" in order.lower()))
+        rows = rows[offset:]
+        return rows[:limit] if limit else rows
+
+    def execute_kw(self, model: str, method: str, args: list, kwargs: Optional[dict] = None):
+        kwargs = kwargs or {}
+        with self._lock:
+            self.calls[f"{model}.{method}"] += 1
+        table = self.tables.setdefault(model, {})
+        if method in ("search", "search_read", "search_count"):
+            domain = args[0] if args else kwargs.get("domain", [])
+            active_test = (kwargs.get("context") or {}).get("active_test", True)
+            rows = self._search(model, domain, kwargs.get("offset", 0), kwargs.get("limit"), kwargs.get("order"), active_test)
+            if method == "search_count":
+                return len(rows)
+            if method == "search":
+                return [r["id"] for r in rows]
+            return [self._read(model, r, kwargs.get("fields")) for r in rows]
+        if method == "read":
+            return [self._read(model, table[i], kwargs.get("fields")) for i in args[0] if i in table]
+        if method == "create":
+            vals = args[0]
+            if isinstance(vals, list):
+                return [self.insert(model, self._create_defaults(model, v)) for v in vals]
+            return self.insert(model, self._create_defaults(model, vals))
+        if method == "write":
+            ids, vals = args[0], args[1]
+            now = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+            with self._lock:
+                for i in ids:
+                    if i in table:
+                        row = dict(vals)
+                        if "lead_properties" in row:
+                            row["lead_properties"] = _merge_properties(table[i].get("lead_properties"), row["lead_properties"])
+                        table[i].update(row, write_date=now)
+            return True
+        if method == "fields_get":
+            return {f: {"string": f} for f in ["id"] + MODEL_FIELDS.get(model, ["name"])}
+        if method == "message_post":
+            return self.insert("mail.message", {"res_id": args[0][0], "model": model, "body": kwargs.get("body", "")})
+        if method == "activity_schedule":
+            return self.insert("mail.activity", {"res_id": args[0][0], "res_model": model, **kwargs})
+        if method in ("message_subscribe", "unlink"):
+            return True
+        raise xmlrpc.client.Fault(2, f"FakeOdoo: {model}.{method} not implemented")
+
+    def dispatch(self, service: str, method: str, args: list):
+        if service == "common":
+            if method in ("authenticate", "login"):
+                return self.uid
+            if method == "version":
+                return {"server_version": "17.0"}
+        if service == "object" and method == "execute_kw":
+            return self.execute_kw(args[3], args[4], args[5] if len(args) > 5 else [], args[6] if len(args) > 6 else {})
+        raise xmlrpc.client.Fault(1, f"FakeOdoo: {service}.{method} not implemented")
+
+    def handle(self, method: str, path: str, body: bytes):
+        path = path.split("?", 1)[0]
+        if path == "/jsonrpc":
+            req = json.loads(body or b"{}")
+            params = req.get("params") or {}
+            try:
+                result = self.dispatch(params.get("service"), params.get("method"), params.get("args") or [])
+                return _json({"jsonrpc": "2.0", "id": req.get("id"), "result": result})
+            except xmlrpc.client.Fault as f:
+                return _json({"jsonrpc": "2.0", "id": req.get("id"), "error": {"code": f.faultCode, "message": f.faultString}})
+        if path.startswith("/xmlrpc/2/"):
+            params, rpc_method = xmlrpc.client.loads(body, use_builtin_types=True)
+            try:
+                result = self.dispatch(path.rsplit("/", 1)[1], rpc_method, list(params))
+                data = xmlrpc.client.dumps((result,), methodresponse=True, allow_none=True)
+            except xmlrpc.client.Fault as f:
+                data = xmlrpc.client.dumps(f, methodresponse=True, allow_none=True)
+            return 200, "text/xml", data.encode("utf-8")
+        return _json({"error": "not found"}, 404)
+
+
+# --------------------------------------------------------------------
+# Geocoder / OSRM
+# --------------------------------------------------------------------
+def stub_coords(query: str):
+    """Deterministic (lat, lon) in the prairies for a query string."""
+    h = hashlib.sha1(query.strip().casefold().encode("utf-8")).digest()
+    lat = 49.0 + (int.from_bytes(h[:4], "big") / 2**32) * 5.0
+    lon = -114.0 + (int.from_bytes(h[4:8], "big") / 2**32) * 18.0
+    return round(lat, 6), round(lon, 6)
+
+
+class StubGeocoder(_StubServer):
+    """Nominatim (/search) and ArcGIS (findAddressCandidates) answers; `unknown` queries find nothing."""
+
+    def __init__(self, latency_s: float = 0.0, unknown: tuple = ("nowhere",)):
+        super().__init__(latency_s)
+        self.unknown = tuple(u.casefold() for u in unknown)
+        self.requests = 0
+
+    def handle(self, method: str, path: str, body: bytes):
+        self.requests += 1
+        parsed = urllib.parse.urlsplit(path)
+        qs = dict(urllib.parse.parse_qsl(parsed.query))
+        query = qs.get("q") or qs.get("singleLine") or qs.get("SingleLine") or ""
+        found = query and not any(u in query.casefold() for u in self.unknown)
+        lat, lon = stub_coords(query)
+        if parsed.path.endswith("/search"):
+            return _json([{"lat": str(lat), "lon": str(lon), "display_name": query}] if found else [])
+        if parsed.path.endswith("findAddressCandidates"):
+            cands = [{"address": query, "location": {"x": lon, "y": lat}, "score": 100}] if found else []
+            return _json({"candidates": cands, "spatialReference": {"wkid": 4326}})
+        return _json({"error": "not found"}, 404)
+
+
+def _drive(lat1, lon1, lat2, lon2):
+    km = haversine_distance(lat1, lon1, lat2, lon2) * 1.3
+    return km / 85.0 * 3600.0, km * 1000.0
+
+
+class StubOSRM(_StubServer):
+    def __init__(self, latency_s: float = 0.0):
+        super().__init__(latency_s)
+        self.requests = Counter()
+
+    def handle(self, method: str, path: str, body: bytes):
+        parsed = urllib.parse.urlsplit(path)
+        m = re.match(r"^/(route|table)/v1/driving/(.+)$", parsed.path)
+        if not m:
+            return _json({"code": "InvalidUrl"}, 400)
+        kind = m.group(1)
+        self.requests[kind] += 1
+        coords = [tuple(float(x) for x in part.split(",")) for part in urllib.parse.unquote(m.group(2)).split(";")]
+        points = [(lat, lon) for lon, lat in coords]
+        if kind == "route":
+            duration, distance = _drive(*points[0], *points[1])
+            return _json({"code": "Ok", "routes": [{"duration": duration, "distance": distance}]})
+        qs = dict(urllib.parse.parse_qsl(parsed.query))
+        sources = [int(i) for i in qs.get("sources", "").split(";") if i] or list(range(len(points)))
+        dests = [int(i) for i in qs.get("destinations", "").split(";") if i] or list(range(len(points)))
+        durations, distances = [], []
+        for s in sources:
+            row = [_drive(*points[s], *points[d]) for d in dests]
+            durations.append([r[0] for r in row])
+            distances.append([r[1] for r in row])
+        return _json({"code": "Ok", "durations": durations, "distances": distances})
+
+
+def start_all(odoo_latency_s: float = 0.0, geocode_latency_s: float = 0.0, osrm_latency_s: float = 0.0) -> Dict[str, Any]:
+    """Start FakeOdoo, StubGeocoder and StubOSRM; returns them by name."""
+    return {
+        "odoo": FakeOdoo(odoo_latency_s).start(),
+        "geocoder": StubGeocoder(geocode_latency_s).start(),
+        "osrm": StubOSRM(osrm_latency_s).start(),
+    }
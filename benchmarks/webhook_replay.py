@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+"""
+webhook_replay.py
+
+Throughput/latency benchmark for /wix_form_webhook without production services. The server
+(Flask app, or webhook_asgi with --server asgi) runs in this process against fake_services
+(FakeOdoo, StubGeocoder, StubOSRM) with fresh caches in a temp directory; a load generator
+replays Wix form payloads at a fixed concurrency.
+
+    python -m benchmarks.webhook_replay --submissions 300 --concurrency 16
+    python -m benchmarks.webhook_replay --server asgi --odoo-latency-ms 60
+    python -m benchmarks.webhook_replay --payloads recorded_payloads.jsonl --json after.json
+
+Reports p50/p95/p99 latency, throughput, Odoo RPCs per submission (as seen by FakeOdoo, after
+the pre-warm) and time per pipeline stage. Server output goes to server.log in the work dir.
+
+--payloads: recorded Wix webhook bodies, one JSON object per line (or a JSON array). Each gets
+a fresh submissionId unless --keep-ids is given (then duplicates are exercised as recorded).
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import math
+import os
+import random
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+if str(REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(REPO_ROOT))
+
+import async_clients  # noqa: E402
+import geocoding  # noqa: E402
+import odoo_connector  # noqa: E402
+import webhook_server  # noqa: E402
+from benchmarks.fake_services import start_all  # noqa: E402
+from tracing import STAGES  # noqa: E402
+
+BENCH_CITIES = [
+    ("Lumsden", "SK"), ("Regina", "SK"), ("Saskatoon", "SK"), ("Yorkton", "SK"), ("Weyburn", "SK"),
+    ("Swift Current", "SK"), ("Humboldt", "SK"), ("Estevan", "SK"), ("Kindersley", "SK"), ("Melfort", "SK"),
+    ("Brandon", "MB"), ("Dauphin", "MB"), ("Portage la Prairie", "MB"), ("Steinbach", "MB"), ("Virden", "MB"),
+    ("Lethbridge", "AB"), ("Red Deer", "AB"), ("Camrose", "AB"), ("Vegreville", "AB"), ("Olds", "AB"),
+    ("Brooks", "AB"), ("Stettler", "AB"), ("Grande Prairie", "AB"), ("Minot", "ND"), ("Fargo", "ND"),
+]
+FIRST_NAMES = ["Alex", "Sam", "Jordan", "Taylor", "Casey", "Morgan", "Jamie", "Riley", "Dana", "Lee"]
+LAST_NAMES = ["Olson", "Schmidt", "Friesen", "Nguyen", "Campbell", "Dueck", "Martin", "Wiebe", "Klassen", "Roy"]
+PRODUCTS = ["Airblast Fans", "DryIT Radial Flow", "Grain Bin Cables", "Manhole Aeration", "Hopper Bottom Aeration"]
+FORM_NAMES = ["Quote Form", "Quote Form", "Contact Form", "Manhole Quote Form"]
+
+
+# --------------------------------------------------------------------
+# Payloads
+# --------------------------------------------------------------------
+def _wix_payload(form_name: str, fields: Dict[str, str], submission_id: str) -> dict:
+    return {
+        "data": {
+            "formName": form_name,
+            "submissionId": submission_id,
+            "submissions": [{"label": k, "value": v} for k, v in fields.items()],
+        }
+    }
+
+
+def synthetic_payloads(n: int, seed: int = 1, repeat_ratio: float = 0.2) -> List[dict]:
+    """n Wix submissions; repeat_ratio of them come from an earlier person (existing contact/opportunity path)."""
+    rnd = random.Random(seed)
+    people: List[Dict[str, str]] = []
+    out = []
+    for i in range(n):
+        if people and rnd.random() < repeat_ratio:
+            person = rnd.choice(people)
+        else:
+            first, last = rnd.choice(FIRST_NAMES), f"{rnd.choice(LAST_NAMES)}{i}"
+            city, prov = rnd.choice(BENCH_CITIES)
+            person = {
+                "First name": first,
+                "Last name": last,
+                "Email": f"{first}.{last}@example.com".lower(),
+                "Phone": f"306{rnd.randrange(10**7):07d}",
+                "City": city,
+                "Province/State": prov,
+            }
+            people.append(person)
+        form_name = rnd.choice(FORM_NAMES)
+        fields = dict(person)
+        if form_name == "Quote Form":
+            fields["What products are you interested in?"] = ", ".join(rnd.sample(PRODUCTS, rnd.randint(1, 2)))
+            fields["Provide any other information that will help us provide a quote."] = "Three 5000 bu bins.\nCall after 6."
+        elif form_name == "Contact Form":
+            fields["Write a message"] = "Looking for a dealer near me."
+        else:
+            fields["What style of man hole does your hopper have?"] = "Round"
+        out.append(_wix_payload(form_name, fields, uuid.uuid4().hex))
+    return out
+
+
+def load_payloads(path: str, keep_ids: bool = False) -> List[dict]:
+    text = Path(path).read_text(encoding="utf-8").strip()
+    rows = json.loads(text) if text.startswith("[") else [json.loads(line) for line in text.splitlines() if line.strip()]
+    if not keep_ids:
+        for row in rows:
+            row.setdefault("data", {})["submissionId"] = uuid.uuid4().hex
+    return rows
+
+
+# --------------------------------------------------------------------
+# Server under test
+# --------------------------------------------------------------------
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def point_at_fakes(services: dict, geocoder_interval_s: float) -> None:
+    """Send the webhook's Odoo, geocoder and OSRM traffic to the local stand-ins."""
+    from geopy.geocoders import ArcGIS, Nominatim
+
+    odoo_connector.ODOO_URL = services["odoo"].url
+    odoo_connector.OSRM_BASE_URL = services["osrm"].url
+    host = services["geocoder"].url.split("://", 1)[1]
+    geocoding._PROVIDERS = [
+        geocoding.GeocodeProvider(
+            "nominatim",
+            geocoding._geopy_fn(Nominatim(user_agent=geocoding.GEOCODER_USER_AGENT, domain=host, scheme="http")),
+            geocoder_interval_s,
+        ),
+        geocoding.GeocodeProvider("arcgis", geocoding._geopy_fn(ArcGIS(domain=host, scheme="http")), geocoder_interval_s),
+    ]
+    async_clients.NOMINATIM_SEARCH_URL = f"{services['geocoder'].url}/search"
+    async_clients.ARCGIS_FIND_URL = f"{services['geocoder'].url}/arcgis/rest/services/World/GeocodeServer/findAddressCandidates"
+
+
+def start_flask():
+    """webhook_server.app under werkzeug's threaded server (one thread per request)."""
+    from werkzeug.serving import make_server
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)  # no access log line per request
+    webhook_server.prewarm()
+    server = make_server("127.0.0.1", 0, webhook_server.app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="bench-flask", daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}", server.shutdown
+
+
+def start_asgi():
+    """webhook_asgi.app under uvicorn (its lifespan pre-warms)."""
+    import uvicorn
+
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config("webhook_asgi:app", host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, name="bench-uvicorn", daemon=True).start()
+    deadline = time.time() + 60
+    while not server.started:
+        if time.time() > deadline:
+            raise RuntimeError("uvicorn did not start")
+        time.sleep(0.05)
+
+    def stop():
+        server.should_exit = True
+
+    return f"http://127.0.0.1:{port}", stop
+
+
+# --------------------------------------------------------------------
+# Load generator + report
+# --------------------------------------------------------------------
+def _post(url: str, payload: dict, timeout_s: float):
+    body = json.dumps(payload).encode("utf-8")
+    req = urllib.request.Request(url, data=body, headers={"Content-Type": "application/json"})
+    t0 = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=timeout_s) as resp:
+            status, data = resp.status, resp.read()
+    except urllib.error.HTTPError as e:
+        status, data = e.code, e.read()
+    except Exception as e:
+        return (time.perf_counter() - t0) * 1000.0, 0, str(e)
+    ms = (time.perf_counter() - t0) * 1000.0
+    try:
+        result = json.loads(data or b"{}")
+    except ValueError:
+        result = {}
+    odoo_status = (result.get("odoo") or {}).get("status") if isinstance(result.get("odoo"), dict) else None
+    return ms, status, odoo_status if odoo_status == "error" else result.get("status")
+
+
+def replay(url: str, payloads: List[dict], concurrency: int, timeout_s: float = 120.0) -> List[tuple]:
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        return list(pool.map(lambda p: _post(url, p, timeout_s), payloads))
+
+
+def percentile(sorted_ms: List[float], p: float) -> float:
+    if not sorted_ms:
+        return 0.0
+    return sorted_ms[max(0, math.ceil(p / 100.0 * len(sorted_ms)) - 1)]
+
+
+def _stage_delta(before: dict, after: dict) -> Dict[str, dict]:
+    out = {}
+    for name, snap in after.items():
+        prev = before.get(name, {"count": 0, "sum_ms": 0.0})
+        n = snap["count"] - prev["count"]
+        if n:
+            out[name] = {"count": n, "mean_ms": (snap["sum_ms"] - prev["sum_ms"]) / n}
+    return out
+
+
+def run(args) -> dict:
+    workdir = Path(tempfile.mkdtemp(prefix="wavcor-bench-"))
+    for name in ["blocked_email_domains.txt"] + (["geo_city_cache.json", "route_duration_cache.json"] if args.warm_caches else []):
+        if (REPO_ROOT / name).exists():
+            shutil.copy(REPO_ROOT / name, workdir / name)
+    os.chdir(workdir)  # caches (sqlite + json imports) live here, so every run starts from the same state
+
+    services = start_all(args.odoo_latency_ms / 1000.0, args.geocode_latency_ms / 1000.0, args.osrm_latency_ms / 1000.0)
+    point_at_fakes(services, args.geocoder_interval_ms / 1000.0)
+    if args.payloads:
+        payloads = load_payloads(args.payloads, args.keep_ids)
+    else:
+        payloads = synthetic_payloads(args.submissions, args.seed, args.repeat_ratio)
+
+    real_stdout = sys.stdout
+    log = open(workdir / "server.log", "w", encoding="utf-8")
+    sys.stdout = log
+    try:
+        url, stop = start_asgi() if args.server == "asgi" else start_flask()
+        services["odoo"].reset_counts()
+        stages_before = STAGES.snapshot()
+        t0 = time.perf_counter()
+        results = replay(f"{url}/wix_form_webhook", payloads, args.concurrency)
+        wall_s = time.perf_counter() - t0
+        stages = _stage_delta(stages_before, STAGES.snapshot())
+        stop()
+    finally:
+        sys.stdout = real_stdout
+        log.close()
+
+    latencies = sorted(ms for ms, _, _ in results)
+    errors = sum(1 for _, status, outcome in results if status != 200 or outcome == "error")
+    rpc_calls = dict(services["odoo"].calls.most_common())
+    n = len(payloads)
+    return {
+        "server": args.server,
+        "submissions": n,
+        "concurrency": args.concurrency,
+        "latency_ms": {"odoo": args.odoo_latency_ms, "geocoder": args.geocode_latency_ms, "osrm": args.osrm_latency_ms},
+        "wall_s": round(wall_s, 3),
+        "throughput_per_s": round(n / wall_s, 2) if wall_s else 0.0,
+        "p50_ms": round(percentile(latencies, 50), 1),
+        "p95_ms": round(percentile(latencies, 95), 1),
+        "p99_ms": round(percentile(latencies, 99), 1),
+        "max_ms": round(latencies[-1], 1) if latencies else 0.0,
+        "errors": errors,
+        "odoo_rpcs": sum(rpc_calls.values()),
+        "odoo_rpcs_per_submission": round(sum(rpc_calls.values()) / n, 2) if n else 0.0,
+        "odoo_rpcs_by_method": rpc_calls,
+        "geocoder_requests": services["geocoder"].requests,
+        "osrm_requests": dict(services["osrm"].requests),
+        "stages": {k: {"count": v["count"], "mean_ms": round(v["mean_ms"], 2)} for k, v in sorted(stages.items())},
+        "workdir": str(workdir),
+    }
+
+
+def print_report(r: dict) -> None:
+    lat = r["latency_ms"]
+    print(f"📈 Webhook replay: {r['submissions']} submissions, concurrency {r['concurrency']}, server={r['server']}")
+    print(f"   stand-in latency: odoo {lat['odoo']} ms/call, geocoder {lat['geocoder']} ms, osrm {lat['osrm']} ms")
+    print(f"   throughput : {r['throughput_per_s']} submissions/s ({r['wall_s']} s wall)")
+    print(f"   latency ms : p50 {r['p50_ms']}  p95 {r['p95_ms']}  p99 {r['p99_ms']}  max {r['max_ms']}")
+    print(f"   errors     : {r['errors']}")
+    print(f"   Odoo RPCs  : {r['odoo_rpcs_per_submission']} per submission ({r['odoo_rpcs']} total)")
+    n = max(1, r["submissions"])
+    for call, count in list(r["odoo_rpcs_by_method"].items())[:12]:
+        print(f"      {call:<40} {count / n:6.2f}/submission")
+    print(f"   geocoder requests: {r['geocoder_requests']}, OSRM: {r['osrm_requests'] or 'none'}")
+    print("   stages (mean ms):")
+    for name, s in sorted(r["stages"].items(), key=lambda kv: -kv[1]["mean_ms"] * kv[1]["count"])[:12]:
+        print(f"      {name:<40} {s['mean_ms']:9.2f} ms × {s['count']}")
+    print(f"   server log: {r['workdir']}/server.log")
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Replay Wix submissions against the webhook with local Odoo/geocoder/OSRM stand-ins.")
+    ap.add_argument("--server", choices=["flask", "asgi"], default="flask")
+    ap.add_argument("--submissions", type=int, default=200, help="Synthetic submissions to send (default 200)")
+    ap.add_argument("--payloads", help="Recorded Wix payloads (JSON lines or array) instead of synthetic ones")
+    ap.add_argument("--keep-ids", action="store_true", help="Keep recorded submissionIds (exercise dedup)")
+    ap.add_argument("--concurrency", type=int, default=8, help="Requests in flight (default 8)")
+    ap.add_argument("--repeat-ratio", type=float, default=0.2, help="Share of submissions from returning people (default 0.2)")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--odoo-latency-ms", type=float, default=40.0, help="Added latency per Odoo RPC (default 40)")
+    ap.add_argument("--geocode-latency-ms", type=float, default=150.0, help="Added latency per geocoder request (default 150)")
+    ap.add_argument("--osrm-latency-ms", type=float, default=40.0, help="Added latency per OSRM request (default 40)")
+    ap.add_argument("--geocoder-interval-ms", type=float, default=0.0,
+                    help="Request spacing per geocoder (production Nominatim: 1000; default 0)")
+    ap.add_argument("--warm-caches", action="store_true", help="Start from the repo's geo/route cache files instead of empty caches")
+    ap.add_argument("--json", help="Also write the results to this JSON file (compare before/after a change)")
+    args = ap.parse_args()
+
+    json_path = Path(args.json).resolve() if args.json else None
+    if args.payloads:
+        args.payloads = str(Path(args.payloads).resolve())
+    result = run(args)
+    print_report(result)
+    if json_path:
+        json_path.write_text(json.dumps(result, indent=2), encoding="utf-8")
+        print(f"Wrote: {json_path}")
+    return 1 if result["errors"] else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+cache_db.py
+
+SQLite store behind the geocode cache (geocoding.py), the route cache (route_cache.py) and the
+webhook's duplicate-submission claims (webhook_server.claim_submission).
+
+One file (wavcor_cache.sqlite3, override with WAVCOR_CACHE_DB) shared by the webhook
+workers, the GUI and the report scripts:
+- WAL journal: readers never block the writer and vice versa; busy_timeout covers
+  writer/writer overlap between processes
+- keyed tables (WITHOUT ROWID, primary key = cache key): point lookups and upserts are
+  O(log n); nothing rewrites the whole cache
+- one connection per thread (sqlite3 connections are not shareable across threads);
+  statements are constant SQL, so the sqlite3 statement cache reuses the prepared form
+
+The old JSON files are imported once by geocoding.py / route_cache.py (re-imported if
+the file changes) and are otherwise left alone.
+"""
+
+from __future__ import annotations
+
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, Optional, Sequence, Tuple, Union
+
+PathLike = Union[str, Path]
+Coords = Tuple[float, float]
+RouteEntry = Dict[str, Optional[float]]
+
+CACHE_DB_PATH = Path(os.getenv("WAVCOR_CACHE_DB") or "wavcor_cache.sqlite3")
+BUSY_TIMEOUT_MS = 10000
+SQL_MAX_VARS = 500  # keys per "IN (...)" query, well under SQLite's variable limit
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS geo (
+    key TEXT PRIMARY KEY,
+    lat REAL NOT NULL,
+    lon REAL NOT NULL,
+    updated_at REAL NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS route (
+    key TEXT PRIMARY KEY,
+    duration_s REAL NOT NULL,
+    distance_m REAL,
+    updated_at REAL NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS submission (
+    id TEXT PRIMARY KEY,
+    claimed_at REAL NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (
+    name TEXT PRIMARY KEY,
+    value TEXT
+) WITHOUT ROWID;
+"""
+
+_GEO_GET = "SELECT lat, lon FROM geo WHERE key = ?"
+_GEO_PUT = (
+    "INSERT INTO geo (key, lat, lon, updated_at) VALUES (?, ?, ?, ?) "
+    "ON CONFLICT(key) DO UPDATE SET lat = excluded.lat, lon = excluded.lon, updated_at = excluded.updated_at"
+)
+_GEO_PUT_IF_MISSING = "INSERT OR IGNORE INTO geo (key, lat, lon, updated_at) VALUES (?, ?, ?, ?)"
+
+_ROUTE_GET = "SELECT duration_s, distance_m FROM route WHERE key = ?"
+# A complete entry (with distance) is never downgraded to a duration-only one.
+_ROUTE_PUT = (
+    "INSERT INTO route (key, duration_s, distance_m, updated_at) VALUES (?, ?, ?, ?) "
+    "ON CONFLICT(key) DO UPDATE SET duration_s = excluded.duration_s, distance_m = excluded.distance_m, "
+    "updated_at = excluded.updated_at "
+    "WHERE excluded.distance_m IS NOT NULL OR route.distance_m IS NULL"
+)
+# Import: only fills gaps and upgrades duration-only rows; never overrides fresher data.
+_ROUTE_PUT_IF_MISSING = (
+    "INSERT INTO route (key, duration_s, distance_m, updated_at) VALUES (?, ?, ?, ?) "
+    "ON CONFLICT(key) DO UPDATE SET duration_s = excluded.duration_s, distance_m = excluded.distance_m, "
+    "updated_at = excluded.updated_at "
+    "WHERE excluded.distance_m IS NOT NULL AND route.distance_m IS NULL"
+)
+
+_SUBMISSION_EXPIRE = "DELETE FROM submission WHERE claimed_at < ?"
+_SUBMISSION_CLAIM = "INSERT OR IGNORE INTO submission (id, claimed_at) VALUES (?, ?)"
+
+_META_GET = "SELECT value FROM meta WHERE name = ?"
+_META_PUT = "INSERT INTO meta (name, value) VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET value = excluded.value"
+
+
+class CacheDB:
+    """Thread-safe handle on the cache database (one sqlite3 connection per thread)."""
+
+    def __init__(self, path: PathLike = CACHE_DB_PATH):
+        self.path = Path(path)
+        self._local = threading.local()
+        self._conn()  # create the file/schema up front so errors surface here
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.path), timeout=BUSY_TIMEOUT_MS / 1000.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+            conn.executescript(SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def _write_many(self, sql: str, rows: Iterable[tuple]) -> int:
+        rows = list(rows)
+        if not rows:
+            return 0
+        conn = self._conn()
+        with conn:  # one transaction per batch
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(sql, rows)
+        return len(rows)
+
+    # ---------------- geo ----------------
+    def geo_get(self, key: str) -> Optional[Coords]:
+        row = self._conn().execute(_GEO_GET, (key,)).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def geo_put_many(self, items: Iterable[Tuple[str, Coords]], overwrite: bool = True) -> int:
+        now = time.time()
+        sql = _GEO_PUT if overwrite else _GEO_PUT_IF_MISSING
+        return self._write_many(sql, ((k, float(c[0]), float(c[1]), now) for k, c in items))
+
+    def geo_count(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM geo").fetchone()[0]
+
+    def geo_keys(self) -> Iterator[str]:
+        for (k,) in self._conn().execute("SELECT key FROM geo ORDER BY key"):
+            yield k
+
+    # ---------------- routes ----------------
+    def route_get(self, key: str) -> Optional[RouteEntry]:
+        row = self._conn().execute(_ROUTE_GET, (key,)).fetchone()
+        return {"duration_s": row[0], "distance_m": row[1]} if row else None
+
+    def route_get_many(self, keys: Sequence[str]) -> Dict[str, RouteEntry]:
+        out: Dict[str, RouteEntry] = {}
+        keys = list(dict.fromkeys(keys))
+        conn = self._conn()
+        for i in range(0, len(keys), SQL_MAX_VARS):
+            chunk = keys[i:i + SQL_MAX_VARS]
+            marks = ",".join("?" * len(chunk))
+            for k, d, m in conn.execute(f"SELECT key, duration_s, distance_m FROM route WHERE key IN ({marks})", chunk):
+                out[k] = {"duration_s": d, "distance_m": m}
+        return out
+
+    def route_put_many(self, items: Iterable[Tuple[str, RouteEntry]], overwrite: bool = True) -> int:
+        now = time.time()
+        return self._write_many(
+            _ROUTE_PUT if overwrite else _ROUTE_PUT_IF_MISSING,
+            ((k, float(e["duration_s"]), e.get("distance_m"), now) for k, e in items),
+        )
+
+    def route_count(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM route").fetchone()[0]
+
+    # ---------------- webhook submissions ----------------
+    def claim_submission(self, submission_id: str, window_s: float) -> bool:
+        """Record submission_id; False when any process already claimed it within the last window_s."""
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(_SUBMISSION_EXPIRE, (now - window_s,))
+            cur = conn.execute(_SUBMISSION_CLAIM, (submission_id, now))
+        return cur.rowcount == 1
+
+    def submission_count(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM submission").fetchone()[0]
+
+    # ---------------- bookkeeping ----------------
+    def meta_get(self, name: str) -> Optional[str]:
+        row = self._conn().execute(_META_GET, (name,)).fetchone()
+        return row[0] if row else None
+
+    def meta_set(self, name: str, value: str) -> None:
+        self._conn().execute(_META_PUT, (name, value))
+
+
+def file_stamp(path: PathLike) -> Optional[str]:
+    """'<mtime_ns>:<size>' for an import source, or None if it does not exist."""
+    try:
+        st = Path(path).stat()
+    except OSError:
+        return None
+    return f"{st.st_mtime_ns}:{st.st_size}"
+
+
+def import_once(db: CacheDB, source: PathLike, import_fn) -> Optional[int]:
+    """
+    Run import_fn(source) unless this exact version of source was imported before.
+    Returns the number of entries import_fn reports, or None when skipped.
+    """
+    stamp = file_stamp(source)
+    if stamp is None:
+        return None
+    name = f"imported:{Path(source).resolve()}"
+    if db.meta_get(name) == stamp:
+        return None
+    n = import_fn(source)
+    db.meta_set(name, stamp)
+    return n
+
+
+_DBS: Dict[Path, CacheDB] = {}
+_DBS_LOCK = threading.Lock()
+
+
+def get_cache_db(path: PathLike = CACHE_DB_PATH) -> CacheDB:
+    """Process-wide CacheDB for path."""
+    p = Path(path).resolve()
+    with _DBS_LOCK:
+        db = _DBS.get(p)
+        if db is None:
+            db = _DBS[p] = CacheDB(p)
+        return db
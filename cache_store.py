@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+cache_store.py
+
+File helpers for JSON files that several processes share: the webhook workers, the GUI
+and the report scripts. (The geo/route caches themselves now live in cache_db.py; their
+old JSON files are only read for the one-time import.)
+
+- read_json(path, default): parsed file, or default when missing/corrupt
+- atomic_write_json(path, data): write to a temp file in the same folder, then os.replace,
+  so readers never see a half-written file; the file gets the usual 0666 & ~umask mode
+  (mkstemp alone would leave it 0600)
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import tempfile
+from pathlib import Path
+from typing import Any, Union
+
+PathLike = Union[str, Path]
+
+# Mode open() gives a new file. The umask can only be read by setting it, so do that once here.
+_UMASK = os.umask(0o022)
+os.umask(_UMASK)
+NEW_FILE_MODE = 0o666 & ~_UMASK
+
+
+def read_json(path: PathLike, default: Any = None) -> Any:
+    path = Path(path)
+    if not path.exists():
+        return default
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except Exception:
+        return default
+
+
+def atomic_write_json(path: PathLike, data: Any, indent: int = 2) -> None:
+    path = Path(path)
+    fd, tmp_name = tempfile.mkstemp(prefix=f".{path.name}.", suffix=".tmp", dir=str(path.parent.resolve()))
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=indent, ensure_ascii=False)
+        os.chmod(tmp_name, NEW_FILE_MODE)
+        os.replace(tmp_name, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_name)
+        except OSError:
+            pass
+        raise
+
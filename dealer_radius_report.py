@@ -12,7 +12,7 @@ Outputs:
     - "Matches" sheet: one row per (dealer, lead) match with distance_km
 Notes:
 - A lead can appear under multiple dealers if it is within radius of multiple dealers.
-- Uses the same city/prov geocoding + local geo_cache.json as nearby_leads_gui.py.
+- Uses the shared city/prov geocoding + geocode cache (geocoding.py), like nearby_leads_gui.py.
 
 
 To run this use python3 dealer_radius_report.py --leads leads_export.json --radius-km 50 --out dealer_leads_50km.xlsx
@@ -22,17 +22,20 @@ To run this use python3 dealer_radius_report.py --leads leads_export.json --radi
 from __future__ import annotations
 
 import argparse
+from bisect import bisect_left, bisect_right
 from pathlib import Path
-from typing import Any, Dict, List
-
-from openpyxl import Workbook
+from typing import Any, Dict, List, Optional, Sequence, Tuple
 
 # Reuse your existing logic + cache/geocoder behavior
 from nearby_leads_gui import (
     DEALER_LOCATIONS,
     load_leads_export,
-    leads_within_radius,
 )
+from batch_geocode import batch_geocode
+from geocoding import canonical_key, get_geo_cache
+from odoo_connector import haversine_distance
+from leads_snapshot import lead_location, load_snapshot_for, np
+from report_writer import open_report, row_values
 
 DEFAULT_RADIUS_KM = 50.0
 
@@ -69,11 +72,126 @@ def _dealer_display_name(dealer: Dict[str, Any]) -> str:
     return str(dealer.get("Location", "")).strip()
 
 
+def resolve_lead_coords(
+    leads: List[Dict[str, Any]],
+    snapshot=None,
+    default_country: str = "Canada",
+) -> List[Optional[Tuple[float, float]]]:
+    """
+    Coordinates for every lead (None when missing/ungeocodable), resolved once for all dealers.
+    Uses the snapshot columns when available, then the geocode cache, then batch_geocode.
+    """
+    cache = get_geo_cache()
+    coords: List[Optional[Tuple[float, float]]] = [None] * len(leads)
+
+    pending = range(len(leads))
+    if snapshot is not None:
+        lat, lon = snapshot.lat, snapshot.lon
+        for i in np.flatnonzero(snapshot.resolved).tolist():
+            coords[i] = (float(lat[i]), float(lon[i]))
+        pending = snapshot.unresolved_indices()
+
+    skipped_missing = 0
+    skipped_geocode = 0
+    locations = {}
+    jobs: Dict[str, Tuple[str, str, str]] = {}
+    for i in pending:
+        city, prov, country = lead_location(leads[i], default_country)
+        key = canonical_key(city, prov, country)
+        if not key:
+            skipped_missing += 1
+            continue
+        locations[i] = key
+        if key not in cache:
+            jobs[key] = (city, prov, country)
+
+    geocode_calls = 0
+    if jobs:
+        print(f"Geocoding {len(jobs)} unique city/province combinations...")
+        stats = batch_geocode(jobs, cache)
+        geocode_calls = stats["geocoded"]
+        if stats["geocoded"] or stats["resumed"]:
+            cache.save()
+
+    for i, key in locations.items():
+        c = cache.get(key)
+        if c is None:
+            skipped_geocode += 1
+            continue
+        coords[i] = c
+
+    print(
+        f"Resolved {sum(c is not None for c in coords)}/{len(leads)} lead locations "
+        f"({geocode_calls} geocoded, {skipped_missing} missing city/province, {skipped_geocode} not found)."
+    )
+    return coords
+
+
+def _candidate_pairs(
+    dealer_points: Sequence[Tuple[float, float]],
+    lead_coords: Sequence[Optional[Tuple[float, float]]],
+    radius_km: float,
+) -> List[List[int]]:
+    """
+    Per dealer, the lead indices that may be within radius_km (superset; exact check happens after).
+    One vectorized dealer x lead haversine with numpy, else a latitude-band prefilter.
+    """
+    idx = [i for i, c in enumerate(lead_coords) if c is not None]
+    if not idx:
+        return [[] for _ in dealer_points]
+
+    slack_km = radius_km + 1.0  # keep float noise away from the boundary; exact distances decide
+    if np is not None:
+        lat = np.radians(np.array([lead_coords[i][0] for i in idx]))[None, :]
+        lon = np.radians(np.array([lead_coords[i][1] for i in idx]))[None, :]
+        d_lat = np.radians(np.array([p[0] for p in dealer_points]))[:, None]
+        d_lon = np.radians(np.array([p[1] for p in dealer_points]))[:, None]
+        a = np.sin((lat - d_lat) / 2) ** 2 + np.cos(d_lat) * np.cos(lat) * np.sin((lon - d_lon) / 2) ** 2
+        km = 6371 * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+        idx_arr = np.array(idx)
+        return [idx_arr[np.flatnonzero(row <= slack_km)].tolist() for row in km]
+
+    # 1 degree of latitude is ~111 km everywhere, so a latitude band is a safe cheap filter.
+    band = slack_km / 111.0
+    by_lat = sorted(idx, key=lambda i: lead_coords[i][0])
+    lats = [lead_coords[i][0] for i in by_lat]
+
+    out = []
+    for d_lat, _ in dealer_points:
+        lo = bisect_left(lats, d_lat - band)
+        hi = bisect_right(lats, d_lat + band)
+        out.append(sorted(by_lat[lo:hi]))
+    return out
+
+
+def dealer_radius_matches(
+    dealers: Sequence[Dict[str, Any]],
+    lead_coords: Sequence[Optional[Tuple[float, float]]],
+    radius_km: float,
+) -> List[List[Tuple[int, float]]]:
+    """
+    For each dealer: [(lead index, distance_km rounded to 0.1)] within radius_km,
+    ordered exactly like nearby_leads_gui.leads_within_radius (distance, then lead order).
+    """
+    points = [(float(d["Latitude"]), float(d["Longitude"])) for d in dealers]
+    out: List[List[Tuple[int, float]]] = []
+    for (dlat, dlon), cand in zip(points, _candidate_pairs(points, lead_coords, radius_km)):
+        hits = []
+        for i in cand:
+            lat, lon = lead_coords[i]
+            dist = haversine_distance(dlat, dlon, lat, lon)
+            if dist <= radius_km:
+                hits.append((i, round(dist, 1)))
+        hits.sort(key=lambda h: h[1])
+        out.append(hits)
+    return out
+
+
 def main() -> int:
     ap = argparse.ArgumentParser()
     ap.add_argument("--leads", required=True, help="Path to leads_export.json")
     ap.add_argument("--radius-km", type=float, default=DEFAULT_RADIUS_KM, help="Radius in km (default: 50)")
-    ap.add_argument("--out", default="dealer_leads_within_radius.xlsx", help="Output .xlsx filename")
+    ap.add_argument("--out", default="dealer_leads_within_radius.xlsx", help="Output .xlsx filename (.csv writes one CSV per sheet)")
     args = ap.parse_args()
 
     print(f"Processing dealer-radius report with args: {args}")
@@ -87,51 +205,33 @@ def main() -> int:
     
     print(f"Loaded {len(leads)} leads.")
 
-    # Build workbook
-    wb = Workbook()
-    ws_summary = wb.active
-    ws_summary.title = "Summary"
-
-    ws_matches = wb.create_sheet("Matches")
-
-    # Headers
-    ws_summary.append(["Dealer", f"Leads within {args.radius_km:.1f} km"])
-    ws_matches.append(["Dealer", "distance_km", *LEAD_COLUMNS])
-
-    print(f"Starting processing of {len(DEALER_LOCATIONS)} dealers.")
-
-    # Iterate all dealers
-    for i, dealer in enumerate(DEALER_LOCATIONS, start=1):
-        print(f"Processing dealer {i}/{len(DEALER_LOCATIONS)}: {dealer.get('Location', 'Unknown')}")
-        dealer_name = _dealer_display_name(dealer)
-        if not dealer_name:
-            continue
-
-        matches = leads_within_radius(dealer, leads, radius_km=float(args.radius_km))
-        ws_summary.append([dealer_name, len(matches)])
-
-        for lead in matches:
-            print(f"Processing lead {lead.get('id', 'Unknown')}")
-            row = [dealer_name, lead.get("distance_km", "")]
-            for col in LEAD_COLUMNS:
-                val = lead.get(col, "")
-                # Keep Excel-friendly strings
-                if isinstance(val, (dict, list)):
-                    val = str(val)
-                row.append(val)
-            ws_matches.append(row)
-
-        # Light progress for long runs (prints every 10 dealers)
-        if i % 10 == 0:
-            print(f"Processed {i}/{len(DEALER_LOCATIONS)} dealers...")
-
-    # Basic formatting: freeze panes
-    ws_summary.freeze_panes = "A2"
-    ws_matches.freeze_panes = "A2"
-
-    # Save
-    wb.save(out_path)
-    print(f"Wrote: {out_path}")
+    snapshot = load_snapshot_for(leads_path, leads)
+    if snapshot is not None:
+        print(f"Using snapshot {snapshot.path} ({int(snapshot.resolved.sum())} leads with coordinates).")
+
+    # Resolve every lead once, then join against all dealers in one step.
+    lead_coords = resolve_lead_coords(leads, snapshot)
+    dealers = [d for d in DEALER_LOCATIONS if _dealer_display_name(d)]
+    print(f"Matching {len(leads)} leads against {len(dealers)} dealers.")
+    all_matches = dealer_radius_matches(dealers, lead_coords, float(args.radius_km))
+
+    # Stream rows straight into the report
+    total = 0
+    with open_report(out_path) as rep:
+        ws_summary = rep.sheet("Summary", ["Dealer", f"Leads within {args.radius_km:.1f} km"])
+        ws_matches = rep.sheet("Matches", ["Dealer", "distance_km", *LEAD_COLUMNS])
+
+        for dealer, matches in zip(dealers, all_matches):
+            dealer_name = _dealer_display_name(dealer)
+            ws_summary.append([dealer_name, len(matches)])
+            total += len(matches)
+
+            for lead_i, dist in matches:
+                ws_matches.append([dealer_name, dist, *row_values(leads[lead_i], LEAD_COLUMNS)])
+
+    print(f"Wrote {total} dealer/lead matches.")
+    for p in rep.outputs:
+        print(f"Wrote: {p}")
     return 0
 
 
@@ -13,11 +13,18 @@ from __future__ import annotations
 from datetime import timezone
 
 import argparse
-import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, datetime
 from typing import Any, Dict, List, Optional, Tuple
 
+from leads_export_io import FORMAT_JSON, FORMAT_JSONL, load_leads_export, read_export_meta, write_leads_export
+from leads_snapshot import build_snapshot, numpy_available, snapshot_path_for
 from odoo_connector import connect_odoo, normalize_state  # uses your existing code
+from odoo_rpc import PROCESS_RPC, OdooModels
+
+# Concurrent read requests against Odoo; keep small to stay polite to the hosted instance.
+DEFAULT_WORKERS = 4
 
 
 def _iso(v: Any) -> Optional[str]:
@@ -57,22 +64,46 @@ def _m2o_id(v: Any) -> Optional[int]:
         return None
 
 
-def fetch_all_crm_leads(
-    include_active_only: bool = True,
-    types: Tuple[str, ...] = ("lead", "opportunity"),
-    page_size: int = 500,
-) -> List[Dict[str, Any]]:
-    """
-    Fetches crm.lead records using paged search_read.
+# Fields to export (tuned for location + CRM triage)
+LEAD_FIELDS = [
+    "id",
+    "name",
+    "type",
+    "active",
+    "contact_name",
+    "partner_name",
+    "email_from",
+    "phone",
+    "mobile",
+    "street",
+    "street2",
+    "city",
+    "state_id",
+    "zip",
+    "country_id",
+    "stage_id",
+    "team_id",
+    "user_id",
+    "source_id",
+    "tag_ids",
+    "description",
+    "expected_revenue",
+    "probability",
+    "create_date",
+    "write_date",
+]
+
+
+def _odoo_dt(v: Any) -> Optional[str]:
+    """Normalize a datetime (object, Odoo string or ISO string) to Odoo's 'YYYY-MM-DD HH:MM:SS'."""
+    if v is None or v is False or v == "":
+        return None
+    if isinstance(v, datetime):
+        return v.strftime("%Y-%m-%d %H:%M:%S")
+    return str(v).replace("T", " ")[:19]
 
-    types:
-      - "lead" and/or "opportunity" (Odoo uses crm.lead.type)
-    """
-    uid, models = connect_odoo()
-    if not uid or not models:
-        raise RuntimeError("Could not authenticate to Odoo (connect_odoo failed).")
 
-    # Domain
+def _lead_domain(include_active_only: bool, types: Tuple[str, ...]) -> List[Any]:
     domain: List[Any] = []
     if include_active_only:
         domain.append(("active", "=", True))
@@ -83,127 +114,248 @@ def fetch_all_crm_leads(
             domain.append(("type", "=", types[0]))
         else:
             domain.append(("type", "in", list(types)))
+    return domain
+
+
+def _execute_kw(models, uid, *args):
+    oc = __import__("odoo_connector")
+    return models.execute_kw(oc.ODOO_DB, uid, oc.ODOO_PASSWORD, *args)
+
+
+def _connect():
+    uid, models = connect_odoo()
+    if not uid or not models:
+        raise RuntimeError("Could not authenticate to Odoo (connect_odoo failed).")
+    return uid, models
 
-    # Fields to export (tuned for location + CRM triage)
-    fields = [
-        "id",
-        "name",
-        "type",
-        "active",
-        "contact_name",
-        "partner_name",
-        "email_from",
-        "phone",
-        "mobile",
-        "street",
-        "street2",
-        "city",
-        "state_id",
-        "zip",
-        "country_id",
-        "stage_id",
-        "team_id",
-        "user_id",
-        "source_id",
-        "tag_ids",
-        "description",
-        "expected_revenue",
-        "probability",
-        "create_date",
-        "write_date",
-    ]
-
-    all_rows: List[Dict[str, Any]] = []
-    offset = 0
-
-    while True:
-        rows = models.execute_kw(
-            # NOTE: odoo_connector.py holds ODOO_DB + ODOO_PASSWORD; connect_odoo() uses them already
-            # so we just re-use the same module-level constants implicitly via the server session.
-            # execute_kw signature requires db + uid + password. We'll import them from odoo_connector
-            # if you prefer, but keeping this minimal: pull them from the odoo_connector module.
-            __import__("odoo_connector").ODOO_DB,
-            uid,
-            __import__("odoo_connector").ODOO_PASSWORD,
-            "crm.lead",
-            "search_read",
-            [domain],
-            {"fields": fields, "limit": page_size, "offset": offset, "order": "id"},
-        )
 
-        if not rows:
-            break
+def _models_proxy():
+    """A fresh XML-RPC object proxy; ServerProxy is not thread-safe, so each worker gets its own."""
+    oc = __import__("odoo_connector")
+    return OdooModels(oc.ODOO_URL, use_datetime=True)
 
-        all_rows.extend(rows)
-        offset += len(rows)
 
-    return all_rows
+def _read_ids_concurrently(uid, lead_ids: List[int], page_size: int, workers: int) -> List[Dict[str, Any]]:
+    """
+    Read crm.lead rows for lead_ids in id-range pages, with at most `workers` requests in flight.
+    Pages are independent (unlike offset paging), so they can be fetched in parallel; order is preserved.
+    """
+    if not lead_ids:
+        return []
+    local = threading.local()
+
+    def read_page(chunk: List[int]) -> List[Dict[str, Any]]:
+        models = getattr(local, "models", None)
+        if models is None:
+            models = local.models = _models_proxy()
+        return _execute_kw(models, uid, "crm.lead", "read", [chunk], {"fields": LEAD_FIELDS}) or []
+
+    pages = [lead_ids[i:i + page_size] for i in range(0, len(lead_ids), page_size)]
+    rows: List[Dict[str, Any]] = []
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(pages)))) as pool:
+        for page_rows in pool.map(read_page, pages):
+            rows.extend(page_rows)
+    return rows
+
+
+def _search_ids(models, uid, domain: List[Any]) -> List[int]:
+    return [int(i) for i in _execute_kw(models, uid, "crm.lead", "search", [domain], {"order": "id"}) or []]
 
 
-def transform(rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+def fetch_all_crm_leads(
+    include_active_only: bool = True,
+    types: Tuple[str, ...] = ("lead", "opportunity"),
+    page_size: int = 500,
+    workers: int = DEFAULT_WORKERS,
+) -> List[Dict[str, Any]]:
+    """
+    Fetches crm.lead records: one id-only search, then concurrent id-range reads.
+
+    types:
+      - "lead" and/or "opportunity" (Odoo uses crm.lead.type)
+    """
+    uid, models = _connect()
+    lead_ids = _search_ids(models, uid, _lead_domain(include_active_only, types))
+    return _read_ids_concurrently(uid, lead_ids, page_size, workers)
+
+
+def fetch_changed_crm_leads(
+    since_write_date: str,
+    include_active_only: bool = True,
+    types: Tuple[str, ...] = ("lead", "opportunity"),
+    page_size: int = 500,
+    workers: int = DEFAULT_WORKERS,
+) -> Tuple[List[Dict[str, Any]], List[int]]:
+    """
+    Incremental fetch against a write_date high-water mark.
+
+    Returns (changed_rows, current_ids):
+      - changed_rows: full rows for records written at/after since_write_date
+        (>= so same-second writes are never missed; re-fetching a few is harmless)
+      - current_ids: id-only listing of every record matching the filters, used to
+        detect deletions/archival and records missing from the previous export
+    """
+    uid, models = _connect()
+    domain = _lead_domain(include_active_only, types)
+    changed_ids = _search_ids(models, uid, domain + [("write_date", ">=", since_write_date)])
+    current_ids = _search_ids(models, uid, domain)
+    return _read_ids_concurrently(uid, changed_ids, page_size, workers), current_ids
+
+
+def fetch_crm_leads_by_ids(lead_ids: List[int], page_size: int = 500, workers: int = DEFAULT_WORKERS) -> List[Dict[str, Any]]:
+    if not lead_ids:
+        return []
+    uid, _models = _connect()
+    return _read_ids_concurrently(uid, list(lead_ids), page_size, workers)
+
+
+def transform_record(r: Dict[str, Any]) -> Dict[str, Any]:
+    """Transform one raw Odoo row into the stable export schema."""
+    state_name = _m2o_name(r.get("state_id"))
+    province_code = normalize_state(state_name) if state_name else None
+
+    return {
+        "lead_id": r.get("id"),
+        "name": r.get("name"),
+        "type": r.get("type"),
+        "active": bool(r.get("active")),
+
+        # Contact-ish fields
+        "contact_name": r.get("contact_name") or None,
+        "company_name": r.get("partner_name") or None,
+        "email": r.get("email_from") or None,
+        "phone": r.get("phone") or None,
+        "mobile": r.get("mobile") or None,
+
+        # Address fields (city/province is your “good enough” locator)
+        "street": r.get("street") or None,
+        "street2": r.get("street2") or None,
+        "city": r.get("city") or None,
+        "province_state_name": state_name,
+        "province_state_code": province_code,
+        "postal_code": r.get("zip") or None,
+        "country_name": _m2o_name(r.get("country_id")),
+        "country_id": _m2o_id(r.get("country_id")),
+
+        # CRM fields
+        "stage_name": _m2o_name(r.get("stage_id")),
+        "stage_id": _m2o_id(r.get("stage_id")),
+        "salesperson": _m2o_name(r.get("user_id")),
+        "salesperson_id": _m2o_id(r.get("user_id")),
+        "team": _m2o_name(r.get("team_id")),
+        "team_id": _m2o_id(r.get("team_id")),
+        "source": _m2o_name(r.get("source_id")),
+        "source_id": _m2o_id(r.get("source_id")),
+        "tag_ids": r.get("tag_ids") or [],
+
+        "expected_revenue": r.get("expected_revenue"),
+        "probability": r.get("probability"),
+
+        "created_at": _iso(r.get("create_date")),
+        "updated_at": _iso(r.get("write_date")),
+
+        # Optional—sometimes useful for debugging / context:
+        "description": r.get("description") or None,
+    }
+
+
+def _sync_state(records: List[Dict[str, Any]], include_active_only: bool, types: Tuple[str, ...]) -> Dict[str, Any]:
+    """High-water mark + filters stored alongside the records for the next --incremental run."""
+    stamps = [_odoo_dt(r.get("updated_at")) for r in records]
+    stamps = [s for s in stamps if s]
+    return {
+        "write_date": max(stamps) if stamps else None,
+        "include_active_only": include_active_only,
+        "types": list(types),
+    }
+
+
+def transform(
+    rows: List[Dict[str, Any]],
+    include_active_only: bool = True,
+    types: Tuple[str, ...] = ("lead", "opportunity"),
+) -> Dict[str, Any]:
     """
     Transform raw Odoo rows into a stable schema for your radius search tooling.
     """
-    out: List[Dict[str, Any]] = []
-
-    for r in rows:
-        state_name = _m2o_name(r.get("state_id"))
-        province_code = normalize_state(state_name) if state_name else None
-
-        out.append(
-            {
-                "lead_id": r.get("id"),
-                "name": r.get("name"),
-                "type": r.get("type"),
-                "active": bool(r.get("active")),
-
-                # Contact-ish fields
-                "contact_name": r.get("contact_name") or None,
-                "company_name": r.get("partner_name") or None,
-                "email": r.get("email_from") or None,
-                "phone": r.get("phone") or None,
-                "mobile": r.get("mobile") or None,
-
-                # Address fields (city/province is your “good enough” locator)
-                "street": r.get("street") or None,
-                "street2": r.get("street2") or None,
-                "city": r.get("city") or None,
-                "province_state_name": state_name,
-                "province_state_code": province_code,
-                "postal_code": r.get("zip") or None,
-                "country_name": _m2o_name(r.get("country_id")),
-                "country_id": _m2o_id(r.get("country_id")),
-
-                # CRM fields
-                "stage_name": _m2o_name(r.get("stage_id")),
-                "stage_id": _m2o_id(r.get("stage_id")),
-                "salesperson": _m2o_name(r.get("user_id")),
-                "salesperson_id": _m2o_id(r.get("user_id")),
-                "team": _m2o_name(r.get("team_id")),
-                "team_id": _m2o_id(r.get("team_id")),
-                "source": _m2o_name(r.get("source_id")),
-                "source_id": _m2o_id(r.get("source_id")),
-                "tag_ids": r.get("tag_ids") or [],
-
-                "expected_revenue": r.get("expected_revenue"),
-                "probability": r.get("probability"),
-
-                "created_at": _iso(r.get("create_date")),
-                "updated_at": _iso(r.get("write_date")),
-
-                # Optional—sometimes useful for debugging / context:
-                "description": r.get("description") or None,
-            }
-        )
+    return _payload([transform_record(r) for r in rows], include_active_only, types)
+
 
+def _payload(out: List[Dict[str, Any]], include_active_only: bool, types: Tuple[str, ...]) -> Dict[str, Any]:
     return {
         "exported_at": datetime.now(timezone.utc).isoformat(),
         "record_count": len(out),
         "schema_version": 1,
+        "sync": _sync_state(out, include_active_only, types),
         "records": out,
     }
 
 
+def merge_incremental(
+    previous: Dict[str, Any],
+    changed_rows: List[Dict[str, Any]],
+    current_ids: List[int],
+    missing_rows: List[Dict[str, Any]],
+    include_active_only: bool,
+    types: Tuple[str, ...],
+) -> Tuple[Dict[str, Any], Dict[str, int]]:
+    """
+    Merge an incremental fetch into a previous export payload.
+    Records no longer in current_ids (deleted, archived, or moved out of the type filter) are dropped.
+    """
+    by_id: Dict[int, Dict[str, Any]] = {}
+    for rec in previous.get("records") or []:
+        if rec.get("lead_id"):
+            by_id[int(rec["lead_id"])] = rec
+
+    current = set(current_ids)
+    removed = [lid for lid in by_id if lid not in current]
+    for lid in removed:
+        del by_id[lid]
+
+    added = 0
+    for row in list(changed_rows) + list(missing_rows):
+        lid = int(row["id"])
+        if lid not in current:
+            continue
+        if lid not in by_id:
+            added += 1
+        by_id[lid] = transform_record(row)
+
+    records = [by_id[lid] for lid in sorted(by_id)]
+    stats = {"changed": len(changed_rows), "added": added, "removed": len(removed)}
+    return _payload(records, include_active_only, types), stats
+
+
+def _load_previous_export(path: str) -> Optional[Dict[str, Any]]:
+    """Load a previous export (JSONL or legacy JSON) back into payload shape."""
+    try:
+        meta = read_export_meta(path)
+        records = load_leads_export(path)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(meta, dict):
+        return None
+    return {**meta, "records": records}
+
+
+def write_payload(path: str, payload: Dict[str, Any], fmt: str = FORMAT_JSONL) -> int:
+    """Write an export payload; the sync state goes in the footer so --incremental can read it cheaply."""
+    meta = {"schema_version": payload["schema_version"], "exported_at": payload["exported_at"]}
+    return write_leads_export(path, payload["records"], meta=meta, fmt=fmt, footer={"sync": payload["sync"]})
+
+
+def _high_water_mark(previous: Dict[str, Any], include_active_only: bool, types: Tuple[str, ...]) -> Optional[str]:
+    """Return the stored write_date mark, or None when the previous export can't seed an incremental run."""
+    sync = previous.get("sync")
+    if isinstance(sync, dict):
+        if sync.get("include_active_only") != include_active_only or list(sync.get("types") or []) != list(types):
+            return None
+        return sync.get("write_date")
+    # Exports written before "sync" existed: derive the mark from the records themselves.
+    return _sync_state(previous["records"], include_active_only, types)["write_date"]
+
+
 def main() -> None:
     ap = argparse.ArgumentParser(description="Export Odoo CRM leads to JSON for geo-radius searching.")
     ap.add_argument("--out", default="leads_export.json", help="Output JSON path (default: leads_export.json)")
@@ -213,24 +365,83 @@ def main() -> None:
         default="lead,opportunity",
         help="Comma-separated list of crm.lead types to export: lead,opportunity (default: both)",
     )
-    ap.add_argument("--page-size", type=int, default=500, help="Odoo page size for search_read (default: 500)")
+    ap.add_argument("--page-size", type=int, default=500, help="Odoo page size (ids per read) (default: 500)")
+    ap.add_argument(
+        "--workers",
+        type=int,
+        default=DEFAULT_WORKERS,
+        help=f"Max concurrent Odoo read requests (default: {DEFAULT_WORKERS})",
+    )
+    ap.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only fetch leads changed since the previous export in --out and merge them (falls back to a full export)",
+    )
+    ap.add_argument(
+        "--format",
+        choices=(FORMAT_JSONL, FORMAT_JSON),
+        default=None,
+        help="jsonl: streamable header/records/footer lines; json: legacy single document "
+             "(default: json when --out ends in .json, else jsonl)",
+    )
+    ap.add_argument(
+        "--snapshot",
+        action="store_true",
+        help="Also write a columnar NumPy snapshot (<out stem>.snapshot/) with cached coordinates for fast radius queries",
+    )
     args = ap.parse_args()
+    if args.format is None:
+        # Outside consumers json.load() a .json file; only write JSON Lines where that can't break them.
+        args.format = FORMAT_JSON if args.out.lower().endswith(".json") else FORMAT_JSONL
 
     types = tuple(t.strip() for t in args.types.split(",") if t.strip())
     include_active_only = not args.include_inactive
 
-    rows = fetch_all_crm_leads(
-        include_active_only=include_active_only,
-        types=types,  # type: ignore[arg-type]
-        page_size=args.page_size,
-    )
-    payload = transform(rows)
+    previous = _load_previous_export(args.out) if args.incremental else None
+    since = _high_water_mark(previous, include_active_only, types) if previous else None
 
-    with open(args.out, "w", encoding="utf-8") as f:
-        json.dump(payload, f, indent=2, ensure_ascii=False)
+    if since:
+        changed, current_ids = fetch_changed_crm_leads(
+            since,
+            include_active_only=include_active_only,
+            types=types,  # type: ignore[arg-type]
+            page_size=args.page_size,
+            workers=args.workers,
+        )
+        known = {int(r["lead_id"]) for r in previous["records"] if r.get("lead_id")}
+        known.update(int(r["id"]) for r in changed)
+        missing_ids = [lid for lid in current_ids if lid not in known]
+        missing = fetch_crm_leads_by_ids(missing_ids, page_size=args.page_size, workers=args.workers)
+        payload, stats = merge_incremental(previous, changed, current_ids, missing, include_active_only, types)
+        print(
+            f"Incremental sync since {since}: {stats['changed']} changed, "
+            f"{stats['added']} new, {stats['removed']} removed."
+        )
+    else:
+        if args.incremental:
+            print(f"No usable previous export at {args.out}; running a full export.")
+        rows = fetch_all_crm_leads(
+            include_active_only=include_active_only,
+            types=types,  # type: ignore[arg-type]
+            page_size=args.page_size,
+            workers=args.workers,
+        )
+        payload = transform(rows, include_active_only, types)
 
-    print(f"Exported {payload['record_count']} CRM lead(s) to: {args.out}")
+    count = write_payload(args.out, payload, fmt=args.format)
+    print(f"Exported {count} CRM lead(s) to: {args.out} ({args.format})")
+
+    if args.snapshot:
+        if not numpy_available():
+            print("Skipping snapshot: numpy is not installed.")
+        else:
+            snap_dir = snapshot_path_for(args.out)
+            stats = build_snapshot(payload["records"], snap_dir, source_meta=payload)
+            print(f"Snapshot: {stats['resolved']}/{stats['records']} lead(s) with cached coordinates -> {snap_dir}")
 
 
 if __name__ == "__main__":
-    main()
+    try:
+        main()
+    finally:
+        print(PROCESS_RPC.summary())
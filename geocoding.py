@@ -0,0 +1,391 @@
+#!/usr/bin/env python3
+"""
+geocoding.py
+
+City/province geocoding shared by every entry point (webhook_server, nearby_leads(_gui),
+the dealer reports, lead_radius_search, where_should_lead_go, leads_snapshot).
+
+- canonical_key(): one cache key per place, whatever spelling the caller has
+  ("Saskatchewan (CA)", "SK", "Sask." all map to province SK; "St. Albert" == "st albert").
+- GeoCache: the geo table of the shared SQLite cache (cache_db.py), keyed by canonical key.
+  geo_city_cache.json is imported on first use (every older key style is folded into its
+  canonical key, so every existing hit still hits); point lookups and small upserts
+  replace whole-file reads/rewrites, and concurrent processes share one store.
+- Provider chain: Nominatim, then ArcGIS, each with its own request spacing and a 429
+  cooldown. batch_geocode.py runs the same providers concurrently for reports.
+"""
+
+from __future__ import annotations
+
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+try:
+    from geopy.exc import GeocoderQuotaExceeded, GeocoderServiceError, GeocoderTimedOut
+except ImportError:  # cache lookups work without geopy; default_providers() needs it
+
+    class GeocoderQuotaExceeded(Exception):
+        pass
+
+    GeocoderServiceError = GeocoderTimedOut = GeocoderQuotaExceeded
+
+from cache_db import CACHE_DB_PATH, CacheDB, get_cache_db, import_once
+from cache_store import read_json
+import metrics
+from odoo_connector import CANONICAL_CODES, normalize_state
+from tracing import span
+
+Coords = Tuple[float, float]
+PathLike = Union[str, Path]
+
+GEO_CACHE_PATH = Path("geo_city_cache.json")
+
+NOMINATIM_MIN_INTERVAL_S = 1.2  # Nominatim usage policy: max 1 request/second
+ARCGIS_MIN_INTERVAL_S = 0.25
+RATE_LIMIT_COOLDOWN_S = 60.0
+GEOCODER_USER_AGENT = "WavcorGeocode/1.0"
+
+PROVINCE_NAMES = {
+    "AB": "Alberta",
+    "BC": "British Columbia",
+    "MB": "Manitoba",
+    "NB": "New Brunswick",
+    "NL": "Newfoundland and Labrador",
+    "NS": "Nova Scotia",
+    "NT": "Northwest Territories",
+    "NU": "Nunavut",
+    "ON": "Ontario",
+    "PE": "Prince Edward Island",
+    "QC": "Quebec",
+    "SK": "Saskatchewan",
+    "YT": "Yukon",
+}
+
+COUNTRY_ALIASES = {
+    "ca": "canada",
+    "can": "canada",
+    "us": "united states",
+    "usa": "united states",
+    "united states of america": "united states",
+    "au": "australia",
+}
+
+# Odoo state names carry a country suffix: "Saskatchewan (CA)" / "saskatchewan ca".
+_COUNTRY_SUFFIX_RE = re.compile(r"\s+(CA|US|AU)$")
+_RAW_COUNTRY_SUFFIX_RE = re.compile(r"\s*\((?:CA|US|AU)\)$|\s+(?:CA|US|AU)$", re.IGNORECASE)
+
+
+# --------------------------------------------------------------------
+# Canonical keys
+# --------------------------------------------------------------------
+def normalize_city(city: str) -> str:
+    text = re.sub(r"[^\w\s-]", " ", str(city or "").strip().lower())
+    return re.sub(r"[\s_-]+", " ", text).strip()
+
+
+def canonical_province(prov: str) -> str:
+    code = normalize_state(str(prov or "").strip())
+    if not code or code in CANONICAL_CODES:
+        return code or ""
+    stripped = _COUNTRY_SUFFIX_RE.sub("", code)
+    if stripped != code:
+        retry = normalize_state(stripped)
+        if retry in CANONICAL_CODES:
+            return retry
+    return code
+
+
+def canonical_country(country: str) -> str:
+    c = re.sub(r"\s+", " ", str(country or "").strip().lower())
+    return COUNTRY_ALIASES.get(c, c)
+
+
+def canonical_key(city: str, prov: str, country: str = "Canada") -> str:
+    """'redvers|SK|canada'; empty string when city or province is missing."""
+    city_key = normalize_city(city).replace(" ", "")
+    prov_key = canonical_province(prov)
+    if not city_key or not prov_key:
+        return ""
+    return f"{city_key}|{prov_key}|{canonical_country(country or 'Canada')}"
+
+
+def geocode_query(city: str, prov: str, country: str = "Canada") -> str:
+    """Text sent to the providers; Canadian codes are spelled out, which geocodes better."""
+    code = canonical_province(prov)
+    prov_text = PROVINCE_NAMES.get(code) or _RAW_COUNTRY_SUFFIX_RE.sub("", str(prov or "").strip())
+    return f"{str(city).strip()}, {prov_text}, {str(country or 'Canada').strip()}"
+
+
+def _coords(v) -> Optional[Coords]:
+    if isinstance(v, (list, tuple)) and len(v) == 2 and v[0] is not None and v[1] is not None:
+        try:
+            return float(v[0]), float(v[1])
+        except (TypeError, ValueError):
+            return None
+    return None
+
+
+# --------------------------------------------------------------------
+# Cache
+# --------------------------------------------------------------------
+def _import_geo_json(db: CacheDB, path: PathLike) -> int:
+    """Fold a geo_city_cache.json (any older key style) into the store; existing rows win."""
+    raw = read_json(path, default={})
+    items: Dict[str, Coords] = {}
+    if isinstance(raw, dict):
+        for k, v in raw.items():
+            coords = _coords(v)
+            parts = str(k).split("|", 2)
+            if coords is None or len(parts) != 3:
+                continue
+            ck = canonical_key(*parts)
+            if ck and ck not in items:
+                items[ck] = coords
+    return db.geo_put_many(items.items(), overwrite=False)
+
+
+class GeoCache:
+    """
+    Geocode cache keyed by canonical_key(), stored in the shared SQLite cache (cache_db.py).
+    Also behaves like a dict of canonical key -> (lat, lon) for batch_geocode.
+    Stored entries are visible to this process at once and to others after save().
+    """
+
+    def __init__(self, db_path: PathLike = CACHE_DB_PATH, import_path: Optional[PathLike] = GEO_CACHE_PATH):
+        self.db = get_cache_db(db_path)
+        self._pending: Dict[str, Coords] = {}
+        self._lock = threading.RLock()
+        if import_path is not None:
+            n = import_once(self.db, import_path, lambda p: _import_geo_json(self.db, p))
+            if n:
+                print(f"Imported {n} geocode cache entries from {import_path}", flush=True)
+
+    def key(self, city: str, prov: str, country: str = "Canada") -> str:
+        return canonical_key(city, prov, country)
+
+    def lookup(self, city: str, prov: str, country: str = "Canada") -> Optional[Coords]:
+        return self.get(canonical_key(city, prov, country))
+
+    def store(self, city: str, prov: str, country: str, coords: Coords) -> None:
+        ck = canonical_key(city, prov, country)
+        if ck:
+            self[ck] = coords
+
+    # dict-style access by canonical key
+    def get(self, key: str, default=None):
+        if not key:
+            return default
+        hit = self._pending.get(key)
+        if hit is None:
+            hit = self.db.geo_get(key)
+        return default if hit is None else hit
+
+    def __contains__(self, key: object) -> bool:
+        return isinstance(key, str) and self.get(key) is not None
+
+    def __getitem__(self, key: str) -> Coords:
+        hit = self.get(key)
+        if hit is None:
+            raise KeyError(key)
+        return hit
+
+    def __setitem__(self, key: str, coords: Coords) -> None:
+        c = _coords(coords)
+        if c is None or not key:
+            return
+        with self._lock:
+            self._pending[key] = c
+
+    def __len__(self) -> int:
+        return self.db.geo_count() + sum(1 for k in list(self._pending) if self.db.geo_get(k) is None)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(sorted(set(self.db.geo_keys()) | set(self._pending)))
+
+    def save(self) -> None:
+        """Write stored entries to the database (one transaction)."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        try:
+            self.db.geo_put_many(pending.items())
+        except BaseException:
+            with self._lock:
+                for k, v in pending.items():
+                    self._pending.setdefault(k, v)
+            raise
+
+
+_CACHES: Dict[Path, GeoCache] = {}
+_CACHES_LOCK = threading.Lock()
+
+
+def get_geo_cache(db_path: PathLike = CACHE_DB_PATH) -> GeoCache:
+    """Process-wide GeoCache on the shared cache database."""
+    p = Path(db_path).resolve()
+    with _CACHES_LOCK:
+        cache = _CACHES.get(p)
+        if cache is None:
+            cache = _CACHES[p] = GeoCache(p)
+        return cache
+
+
+# --------------------------------------------------------------------
+# Providers
+# --------------------------------------------------------------------
+class GeocodeProvider:
+    """One geocoding backend with its own request spacing and 429 cooldown (thread-safe)."""
+
+    def __init__(
+        self,
+        name: str,
+        geocode_fn: Callable[[str], Optional[Coords]],
+        min_interval_s: float,
+        attempts: int = 3,
+    ):
+        self.name = name
+        self._geocode_fn = geocode_fn
+        self.min_interval_s = min_interval_s
+        self.attempts = attempts
+        self.cooldown_until = 0.0
+        self.calls = 0
+        self._last_request_ts = 0.0
+        self._lock = threading.Lock()
+
+    def cooling_down(self) -> float:
+        """Seconds left in the 429 cooldown (0 when the provider is usable)."""
+        return max(0.0, self.cooldown_until - time.time())
+
+    def backlog_s(self) -> float:
+        """How long a request issued now would wait for its slot (requests already queued ahead)."""
+        return max(0.0, self._last_request_ts + self.min_interval_s - time.time())
+
+    def reserve_turn(self) -> float:
+        """
+        Claim the next request slot and return how long to wait for it. Callers sleep
+        outside the lock, so sync threads and async tasks (webhook_asgi) share one budget.
+        """
+        with self._lock:
+            now = time.time()
+            slot = max(now, self._last_request_ts + self.min_interval_s)
+            self._last_request_ts = slot
+            self.calls += 1
+            return slot - now
+
+    def start_cooldown(self) -> None:
+        self.cooldown_until = time.time() + RATE_LIMIT_COOLDOWN_S
+        print(f"WARNING: {self.name} rate limited; cooling down {int(RATE_LIMIT_COOLDOWN_S)}s", flush=True)
+
+    def record(self, result: str) -> None:
+        """Count one request outcome for /metrics: found, not_found, error, rate_limited or cooldown."""
+        metrics.inc("geocode_requests_total", provider=self.name, result=result)
+
+    def _wait_turn(self) -> None:
+        wait_s = self.reserve_turn()
+        if wait_s > 0:
+            time.sleep(wait_s)
+
+    def geocode(self, query: str, wait_on_cooldown: bool = True) -> Optional[Coords]:
+        """
+        Geocode one query. During a 429 cooldown this either waits it out (batch jobs)
+        or returns None straight away (wait_on_cooldown=False, for request handlers).
+        """
+        for i in range(1, self.attempts + 1):
+            remaining = self.cooling_down()
+            if remaining:
+                if not wait_on_cooldown:
+                    self.record("cooldown")
+                    return None
+                time.sleep(remaining)
+            self._wait_turn()
+            try:
+                with span(f"geocode.{self.name}"):
+                    coords = self._geocode_fn(query)
+            except GeocoderQuotaExceeded:
+                self.record("rate_limited")
+                self.start_cooldown()
+            except (GeocoderTimedOut, GeocoderServiceError):
+                self.record("error")
+                time.sleep(1.5 * i)
+            except Exception:
+                self.record("error")
+                return None
+            else:
+                self.record("found" if coords is not None else "not_found")
+                return coords
+        return None
+
+
+def _geopy_fn(geocoder) -> Callable[[str], Optional[Coords]]:
+    def fn(query: str) -> Optional[Coords]:
+        loc = geocoder.geocode(query, timeout=10)
+        if loc is None:
+            return None
+        return _coords((loc.latitude, loc.longitude))
+
+    return fn
+
+
+def default_providers(
+    user_agent: str = GEOCODER_USER_AGENT,
+    nominatim_interval_s: float = NOMINATIM_MIN_INTERVAL_S,
+) -> List[GeocodeProvider]:
+    from geopy.geocoders import ArcGIS, Nominatim
+
+    return [
+        GeocodeProvider("nominatim", _geopy_fn(Nominatim(user_agent=user_agent)), nominatim_interval_s),
+        GeocodeProvider("arcgis", _geopy_fn(ArcGIS(timeout=10)), ARCGIS_MIN_INTERVAL_S),
+    ]
+
+
+_PROVIDERS: Optional[List[GeocodeProvider]] = None
+_PROVIDERS_LOCK = threading.Lock()
+
+
+def shared_providers() -> List[GeocodeProvider]:
+    """Process-wide provider chain, so every caller in a process shares one rate budget."""
+    global _PROVIDERS
+    with _PROVIDERS_LOCK:
+        if _PROVIDERS is None:
+            _PROVIDERS = default_providers()
+        return _PROVIDERS
+
+
+def geocode(
+    city: str,
+    prov: str,
+    country: str = "Canada",
+    cache: Optional[GeoCache] = None,
+    providers: Optional[Sequence[GeocodeProvider]] = None,
+    wait_on_cooldown: bool = True,
+    save: bool = True,
+) -> Optional[Coords]:
+    """
+    Cache first, then each provider in order. New results are stored (and saved unless save=False).
+    Returns (lat, lon) or None.
+    """
+    cache = cache if cache is not None else get_geo_cache()
+    ck = canonical_key(city, prov, country)
+    if not ck:
+        return None
+    hit = cache.get(ck)
+    metrics.inc("geocode_cache_total", result="hit" if hit is not None else "miss")
+    if hit is not None:
+        return hit
+
+    query = geocode_query(city, prov, country)
+    for provider in providers if providers is not None else shared_providers():
+        coords = provider.geocode(query, wait_on_cooldown=wait_on_cooldown)
+        if coords is not None:
+            print(f"DEBUG: {provider.name} geocoded '{query}' → {coords[0]}, {coords[1]}", flush=True)
+            cache[ck] = coords
+            if save:
+                try:
+                    cache.save()
+                except Exception as e:
+                    print(f"WARNING: Failed to save geo cache: {e}", flush=True)
+            return coords
+    print(f"WARNING: Could not geocode '{query}'", flush=True)
+    return None
@@ -0,0 +1,33 @@
+# gunicorn.conf.py
+#
+# Production server for webhook_server.py:
+#     gunicorn -c gunicorn.conf.py
+#
+# gthread workers: request handlers mostly wait on Odoo / OSRM / geocoder HTTP calls, so a
+# few processes with several threads each serve many concurrent requests. The app is not
+# preloaded in the master, so every worker opens its own Odoo session and cache DB
+# connections (neither survives fork) in create_app() before it starts accepting traffic.
+# Duplicate Wix submissions are caught across workers: claims go to the shared cache DB
+# (wavcor_cache.sqlite3 / WAVCOR_CACHE_DB, which every worker must point at).
+
+import os
+
+wsgi_app = "webhook_server:create_app()"
+bind = f"0.0.0.0:{os.getenv('PORT', '8080')}"
+worker_class = "gthread"
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+threads = int(os.getenv("GUNICORN_THREADS", "8"))
+preload_app = False
+
+# find_closest_dealer may fall back to several sequential OSRM /route calls on a cache miss.
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "60"))
+graceful_timeout = 30
+keepalive = 5
+
+# Recycle workers now and then so a slow leak can't build up.
+max_requests = 2000
+max_requests_jitter = 200
+
+accesslog = "-"
+errorlog = "-"
+loglevel = os.getenv("LOG_LEVEL", "info")
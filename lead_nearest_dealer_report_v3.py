@@ -4,7 +4,7 @@ Assign each lead to its *nearest* dealer (and optionally only keep leads within
 then export an Excel report.
 
 Why this is fast:
-- Geocodes each unique (city, province/state, country) at most once using geo_city_cache.json
+- Geocodes each unique (city, province/state, country) at most once using the shared geocode cache
 - Computes nearest dealer via pure distance math (no extra geocoding inside the dealer loop)
 
 Inputs:
@@ -34,26 +34,35 @@ python3 lead_nearest_dealer_report_v3.py \
 from __future__ import annotations
 
 import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import json
 import math
-import time
 import urllib.parse
 import urllib.request
 from pathlib import Path
 from typing import Any, Dict, List, Optional, Tuple
 
-from openpyxl import Workbook
-
-from geopy.geocoders import Nominatim
-from geopy.exc import GeocoderTimedOut, GeocoderServiceError
-
-from odoo_connector import DEALER_LOCATIONS, haversine_distance, connect_odoo, ODOO_DB, ODOO_PASSWORD
-
-GEO_CACHE_PATH = Path("geo_city_cache.json")
-_geolocator = Nominatim(user_agent="WavcorLeadNearestDealer/1.0")
+from batch_geocode import batch_geocode
+from geocoding import canonical_key, get_geo_cache
+from leads_export_io import load_leads_export
+from report_writer import open_report, row_values
+from route_cache import load_route_cache, make_entry, route_key, save_route_cache
+from odoo_connector import (
+    DEALER_LOCATIONS,
+    ODOO_DB,
+    ODOO_PASSWORD,
+    _matrix_chunks,
+    _osrm_table_metrics_many_to_many,
+    connect_odoo,
+    haversine_distance,
+    nearest_by_direct_distance,
+)
+from odoo_rpc import PROCESS_RPC
 
 DEFAULT_RADIUS_KM = 50.0
 DEFAULT_TOPK = 5
+DEFAULT_OSRM_WORKERS = 4
+OSRM_MATRIX_TIMEOUT_S = 60
 OSRM_BASE_URL = "https://router.project-osrm.org"
 
 LEAD_COLUMNS = [
@@ -148,68 +157,21 @@ def fetch_tag_names_from_odoo(tag_ids: List[int]) -> Dict[int, str]:
             name_by_id[rid] = (r.get("name") or "").strip()
     return name_by_id
 
-def load_leads_export(path: Path) -> List[Dict[str, Any]]:
-    data = json.loads(path.read_text(encoding="utf-8"))
-    if isinstance(data, dict) and isinstance(data.get("records"), list):
-        return data["records"]
-    if isinstance(data, list):
-        return data
-    raise ValueError(f"Unrecognized leads JSON format: {path}")
-
-
-def _geo_key(city: str, prov: str, country: str) -> str:
-    return f"{city.strip().lower()}|{prov.strip().lower()}|{country.strip().lower()}"
-
-
-def _load_geo_cache() -> Dict[str, Tuple[float, float]]:
-    if not GEO_CACHE_PATH.exists():
-        return {}
-    try:
-        raw = json.loads(GEO_CACHE_PATH.read_text(encoding="utf-8"))
-    except Exception:
-        return {}
-    clean: Dict[str, Tuple[float, float]] = {}
-    if isinstance(raw, dict):
-        for k, v in raw.items():
-            try:
-                if isinstance(v, (list, tuple)) and len(v) == 2 and v[0] is not None and v[1] is not None:
-                    clean[k] = (float(v[0]), float(v[1]))
-            except Exception:
-                continue
-    return clean
-
+def _load_routes_cache() -> Dict[str, Dict[str, Any]]:
+    return load_route_cache()
 
-def _save_geo_cache(cache: Dict[str, Tuple[float, float]]) -> None:
-    GEO_CACHE_PATH.write_text(json.dumps(cache, indent=2, ensure_ascii=False), encoding="utf-8")
 
-def _routes_cache_path() -> Path:
-    return Path("route_duration_cache.json")
-
-
-def _load_routes_cache() -> Dict[str, Dict[str, float]]:
-    path = _routes_cache_path()
-    if not path.exists():
-        return {}
-    try:
-        raw = json.loads(path.read_text(encoding="utf-8"))
-    except Exception:
-        return {}
-    if isinstance(raw, dict):
-        return raw
-    return {}
-
-
-def _save_routes_cache(cache: Dict[str, Dict[str, float]]) -> None:
-    _routes_cache_path().write_text(json.dumps(cache, indent=2, ensure_ascii=False), encoding="utf-8")
+def _save_routes_cache(cache: Dict[str, Dict[str, Any]]) -> None:
+    save_route_cache(cache)
 
 
 def _route_key(lat1: float, lon1: float, lat2: float, lon2: float) -> str:
-    return f"{lat1:.6f},{lon1:.6f}->{lat2:.6f},{lon2:.6f}"
+    return route_key(lat1, lon1, lat2, lon2)
 
 
 def _osrm_route_duration_s(
     lat1: float, lon1: float, lat2: float, lon2: float,
-    cache: Dict[str, Dict[str, float]],
+    cache: Dict[str, Dict[str, Any]],
 ) -> Optional[float]:
     key = _route_key(lat1, lon1, lat2, lon2)
     if key in cache:
@@ -224,47 +186,101 @@ def _osrm_route_duration_s(
         routes = payload.get("routes") or []
         if not routes:
             return None
-        duration_s = float(routes[0].get("duration"))
-        cache[key] = {"duration_s": duration_s}
-        return duration_s
+        route = routes[0]
+        # Store distance too so the webhook's find_closest_dealer can reuse the entry.
+        cache[key] = make_entry(route.get("duration"), route.get("distance"))
+        return cache[key]["duration_s"]
     except Exception:
         return None
 
 
-def geocode_city_prov(
-    city: str,
-    prov: str,
-    country: str,
-    cache: Dict[str, Tuple[float, float]],
-    attempts: int = 3,
-    sleep_s: float = 1.05,
-) -> Optional[Tuple[float, float]]:
+def _driving_candidates(
+    lat: float, lon: float, dealers: List[Tuple[str, float, float]], topk: int
+) -> List[Tuple[float, str, float, float]]:
+    """Top-K dealers by straight-line distance: [(km, name, lat, lon)]."""
+    ranked = [(haversine_distance(dlat, dlon, lat, lon), name, dlat, dlon) for name, dlat, dlon in dealers]
+    ranked.sort(key=lambda t: t[0])
+    return ranked[:topk]
+
+
+def _nearest_dealer_by_driving(
+    lat: float, lon: float, dealers: List[Tuple[str, float, float]], topk: int,
+    cache: Dict[str, Dict[str, Any]], unroutable: set,
+) -> Tuple[Optional[str], Optional[float], Optional[float]]:
+    """(name, duration_s, straight-line km) of the fastest-to-reach of the top-K dealers; Nones when none routes."""
+    best_name = None
+    best_duration_s = None
+    best_dist_km = None
+    for dist, name, dlat, dlon in _driving_candidates(lat, lon, dealers, topk):
+        if _route_key(lat, lon, dlat, dlon) in unroutable:
+            continue
+        duration_s = _osrm_route_duration_s(lat, lon, dlat, dlon, cache)
+        if duration_s is None:
+            continue
+        if best_duration_s is None or duration_s < best_duration_s:
+            best_duration_s = duration_s
+            best_name = name
+            best_dist_km = dist
+    return best_name, best_duration_s, best_dist_km
+
+
+def prefetch_driving_matrix(
+    resolved: List[Tuple[Dict[str, Any], float, float]],
+    dealers: List[Tuple[str, float, float]],
+    topk: int,
+    cache: Dict[str, Dict[str, float]],
+    workers: int = DEFAULT_OSRM_WORKERS,
+) -> Tuple[int, set]:
     """
-    Geocode city/prov/country, caching results. Returns (lat, lon) or None.
-    Polite throttling for Nominatim via sleep_s between successful calls.
+    Fill the route cache for every (lead, top-K dealer) pair with concurrent OSRM /table
+    requests instead of one /route call per pair.
+    Returns (pairs cached, route keys OSRM reported as unroutable).
     """
-    if not city or not prov:
-        return None
-
-    key = _geo_key(city, prov, country)
-    if key in cache:
-        return cache[key]
+    wanted: Dict[Tuple[float, float], set] = {}
+    for _, lat, lon in resolved:
+        for _, _, dlat, dlon in _driving_candidates(lat, lon, dealers, topk):
+            if _route_key(lat, lon, dlat, dlon) not in cache:
+                wanted.setdefault((lat, lon), set()).add((dlat, dlon))
+    if not wanted:
+        return 0, set()
+
+    chunks = _matrix_chunks(wanted)
+    n_pairs = sum(len(v) for v in wanted.values())
+    print(f"Routing {n_pairs} lead/dealer pairs with {len(chunks)} OSRM table request(s) ({workers} at a time)...")
+
+    def fetch(chunk):
+        srcs, dests = chunk
+        return _osrm_table_metrics_many_to_many(
+            [(i, lat, lon) for i, (lat, lon) in enumerate(srcs)],
+            [(j, lat, lon) for j, (lat, lon) in enumerate(dests)],
+            timeout_s=OSRM_MATRIX_TIMEOUT_S,
+        )
 
-    query = f"{city}, {prov}, {country}"
-    for i in range(1, attempts + 1):
-        try:
-            loc = _geolocator.geocode(query, timeout=10)
-            if loc:
-                cache[key] = (loc.latitude, loc.longitude)
-                # polite throttle (only when we actually called out)
-                time.sleep(sleep_s)
-                return cache[key]
-            return None
-        except (GeocoderTimedOut, GeocoderServiceError):
-            time.sleep(1.5 * i)
-        except Exception:
-            return None
-    return None
+    filled = 0
+    unroutable = set()
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {pool.submit(fetch, c): c for c in chunks}
+        for n, fut in enumerate(as_completed(futures), start=1):
+            srcs, dests = futures[fut]
+            try:
+                metrics = fut.result()
+            except Exception as e:
+                # Leave these pairs uncached; the per-pair /route fallback picks them up.
+                print(f"  OSRM table request failed ({len(srcs)}x{len(dests)}): {e}")
+                continue
+            dest_idx = {d: j for j, d in enumerate(dests)}
+            for i, src in enumerate(srcs):
+                for dest in wanted[src]:
+                    key = _route_key(src[0], src[1], dest[0], dest[1])
+                    m = metrics.get((i, dest_idx[dest]))
+                    if m is None:
+                        unroutable.add(key)
+                        continue
+                    cache[key] = make_entry(m["duration_s"], m["distance_m"])
+                    filled += 1
+            if n % 10 == 0:
+                print(f"  Table requests done: {n}/{len(chunks)}")
+    return filled, unroutable
 
 
 def _dealer_name(d: Dict[str, Any]) -> str:
@@ -299,6 +315,11 @@ def _lead_city_prov_country(lead: Dict[str, Any], default_country: str = "Canada
     return city, prov, country
 
 
+def _geocode_progress(done: int, total: int) -> None:
+    if done % 25 == 0:
+        print(f"  Geocoded {done}/{total}...")
+
+
 def main() -> int:
     ap = argparse.ArgumentParser()
     ap.add_argument("--leads", required=True, help="Path to leads_export.json")
@@ -306,7 +327,8 @@ def main() -> int:
     ap.add_argument("--use-driving", action="store_true", help="Use OSRM driving time to choose nearest dealer")
     ap.add_argument("--max-hours", type=float, default=None, help="Only keep leads within this many driving hours of their nearest dealer (requires --use-driving)")
     ap.add_argument("--topk", type=int, default=DEFAULT_TOPK, help="When using --use-driving, only route the top K closest by straight-line distance")
-    ap.add_argument("--out", default="lead_nearest_dealer.xlsx", help="Output .xlsx filename")
+    ap.add_argument("--osrm-workers", type=int, default=DEFAULT_OSRM_WORKERS, help="When using --use-driving, concurrent OSRM table requests")
+    ap.add_argument("--out", default="lead_nearest_dealer.xlsx", help="Output .xlsx filename (.csv writes one CSV per sheet)")
     ap.add_argument("--default-country", default="Canada", help="Fallback country name (default: Canada)")
     ap.add_argument("--fetch-odoo", action="store_true", help="Fetch email_from and tags from Odoo by lead ID (requires Odoo credentials in odoo_connector.py)")
     args = ap.parse_args()
@@ -318,7 +340,7 @@ def main() -> int:
     dealers = _prepare_dealers()
 
     # 1) Resolve coordinates for leads (cached by unique city/prov/country)
-    cache = _load_geo_cache()
+    cache = get_geo_cache()
     cache_dirty = False
 
     resolved: List[Tuple[Dict[str, Any], float, float]] = []
@@ -330,36 +352,37 @@ def main() -> int:
     unique_keys: Dict[str, Tuple[str, str, str]] = {}
     for lead in leads:
         city, prov, country = _lead_city_prov_country(lead, default_country=args.default_country)
-        if not city or not prov:
+        k = canonical_key(city, prov, country)
+        if not k:
             out = dict(lead)
             out["unassigned_reason"] = "missing_city_or_province"
             unassigned_rows.append(out)
             continue
-        k = _geo_key(city, prov, country)
         if k not in unique_keys:
             unique_keys[k] = (city, prov, country)
 
     # Geocode only keys not already in cache
     keys_to_geocode = [(k, *unique_keys[k]) for k in unique_keys.keys() if k not in cache]
     if keys_to_geocode:
-        print(f"Geocoding {len(keys_to_geocode)} unique city/province combinations (cached in {GEO_CACHE_PATH})...")
-    for idx, (k, city, prov, country) in enumerate(keys_to_geocode, start=1):
-        coords = geocode_city_prov(city, prov, country, cache)
-        if coords:
-            cache_dirty = True
-        if idx % 25 == 0:
-            print(f"  Geocoded {idx}/{len(keys_to_geocode)}...")
+        print(f"Geocoding {len(keys_to_geocode)} unique city/province combinations (cached in {cache.db.path})...")
+        stats = batch_geocode(
+            {k: (city, prov, country) for k, city, prov, country in keys_to_geocode},
+            cache,
+            progress_cb=_geocode_progress,
+        )
+        cache_dirty = bool(stats["geocoded"] or stats["resumed"])
+        print(f"  Geocoded {stats['geocoded']} new, {stats['resumed']} resumed from checkpoint, {stats['failed']} not found.")
 
     if cache_dirty:
-        _save_geo_cache(cache)
+        cache.save()
 
     # Now resolve each lead quickly from cache
     for lead in leads:
         city, prov, country = _lead_city_prov_country(lead, default_country=args.default_country)
-        if not city or not prov:
+        k = canonical_key(city, prov, country)
+        if not k:
             skipped_missing += 1
             continue
-        k = _geo_key(city, prov, country)
         coords = cache.get(k)
         if not coords:
             out = dict(lead)
@@ -384,34 +407,23 @@ def main() -> int:
     topk = max(1, int(args.topk))
     routes_cache = _load_routes_cache() if use_driving else {}
     routes_cache_dirty = False
+    unroutable: set = set()
+
+    if use_driving:
+        filled, unroutable = prefetch_driving_matrix(resolved, dealers, topk, routes_cache, workers=args.osrm_workers)
+        routes_cache_dirty = filled > 0
 
     for i, (lead, lat, lon) in enumerate(resolved, start=1):
         if use_driving:
-            ranked = []
-            for name, dlat, dlon in dealers:
-                dist = haversine_distance(dlat, dlon, lat, lon)
-                ranked.append((dist, name, dlat, dlon))
-            ranked.sort(key=lambda t: t[0])
-            candidates = ranked[:topk]
-
-            best_name = None
-            best_duration_s = None
-            best_dist_km = None
-            for dist, name, dlat, dlon in candidates:
-                duration_s = _osrm_route_duration_s(lat, lon, dlat, dlon, routes_cache)
-                if duration_s is None:
-                    continue
-                routes_cache_dirty = True
-                if best_duration_s is None or duration_s < best_duration_s:
-                    best_duration_s = duration_s
-                    best_name = name
-                    best_dist_km = dist
-
+            best_name, best_duration_s, best_dist_km = _nearest_dealer_by_driving(
+                lat, lon, dealers, topk, routes_cache, unroutable
+            )
             if best_name is None:
                 out = dict(lead)
                 out["unassigned_reason"] = "no_route_found"
                 unassigned_rows.append(out)
                 continue
+            routes_cache_dirty = True
 
             if max_hours is not None and best_duration_s is not None:
                 if best_duration_s > max_hours * 3600:
@@ -431,14 +443,7 @@ def main() -> int:
             assigned_rows.append(out)
             counts[best_name] = counts.get(best_name, 0) + 1
         else:
-            best_name = None
-            best_dist = 1e18
-            for name, dlat, dlon in dealers:
-                dist = haversine_distance(dlat, dlon, lat, lon)
-                if dist < best_dist:
-                    best_dist = dist
-                    best_name = name
-
+            best_name, best_dist = nearest_by_direct_distance(lat, lon, dealers)
             if best_name is None:
                 out = dict(lead)
                 out["unassigned_reason"] = "no_dealer_found"
@@ -489,61 +494,44 @@ def main() -> int:
         else:
             print("No lead IDs found in leads_export.json; cannot fetch email/tags from Odoo. Ensure export includes lead ID.")
 
-    # 3) Write Excel
-    wb = Workbook()
-    ws_summary = wb.active
-    ws_summary.title = "Summary"
-    ws_assigned = wb.create_sheet("Assigned")
-    ws_unassigned = wb.create_sheet("Unassigned")
-
-    ws_summary.append(["Dealer", f"Assigned leads within {radius_km:.1f} km"])
-    for dealer_name in sorted(counts.keys()):
-        ws_summary.append([dealer_name, counts[dealer_name]])
-
+    # 3) Write the report (rows are streamed; nothing is held as cell objects)
     # Build one column per tag (based on tags present in assigned rows)
     tag_names = sorted({t for r in assigned_rows for t in (r.get("tag_names") or []) if t})
-    if use_driving:
-        ws_assigned.append(["nearest_dealer", "distance_km", "drive_time_hr", "email_from", *tag_names, *[c for c in LEAD_COLUMNS if c != "email_from"]])
-    else:
-        ws_assigned.append(["nearest_dealer", "distance_km", "email_from", *tag_names, *[c for c in LEAD_COLUMNS if c != "email_from"]])
-    for row in assigned_rows:
+    # email_from gets its own explicit column (and is also present in LEAD_COLUMNS in some exports)
+    lead_cols = [c for c in LEAD_COLUMNS if c != "email_from"]
+
+    def tag_bits(row: Dict[str, Any]) -> List[int]:
         row_tags = set(row.get("tag_names") or [])
-        tag_bits = [1 if t in row_tags else 0 for t in tag_names]
-        # email_from gets its own explicit column (and is also present in LEAD_COLUMNS in some exports)
-        email = row.get("email_from", "")
-        lead_vals = []
-        for c in LEAD_COLUMNS:
-            if c == "email_from":
-                continue
-            v = row.get(c, "")
-            lead_vals.append(v if not isinstance(v, (dict, list)) else str(v))
+        return [1 if t in row_tags else 0 for t in tag_names]
+
+    with open_report(out_path) as rep:
+        ws_summary = rep.sheet("Summary", ["Dealer", f"Assigned leads within {radius_km:.1f} km"])
+        for dealer_name in sorted(counts.keys()):
+            ws_summary.append([dealer_name, counts[dealer_name]])
+
         if use_driving:
-            ws_assigned.append([row.get("nearest_dealer", ""), row.get("distance_km", ""), row.get("drive_time_hr", ""), email, *tag_bits, *lead_vals])
+            ws_assigned = rep.sheet("Assigned", ["nearest_dealer", "distance_km", "drive_time_hr", "email_from", *tag_names, *lead_cols])
         else:
-            ws_assigned.append([row.get("nearest_dealer", ""), row.get("distance_km", ""), email, *tag_bits, *lead_vals])
-
-    # Unassigned sheet (no dealer assignment)
-    ws_unassigned.append(["unassigned_reason", "distance_km", "drive_time_hr", "email_from", *tag_names, *[c for c in LEAD_COLUMNS if c != "email_from"]])
-    for row in unassigned_rows:
-        row_tags = set(row.get("tag_names") or [])
-        tag_bits = [1 if t in row_tags else 0 for t in tag_names]
-        email = row.get("email_from", "")
-        lead_vals = []
-        for c in LEAD_COLUMNS:
-            if c == "email_from":
-                continue
-            v = row.get(c, "")
-            lead_vals.append(v if not isinstance(v, (dict, list)) else str(v))
-        ws_unassigned.append([row.get("unassigned_reason", ""), row.get("distance_km", ""), row.get("drive_time_hr", ""), email, *tag_bits, *lead_vals])
+            ws_assigned = rep.sheet("Assigned", ["nearest_dealer", "distance_km", "email_from", *tag_names, *lead_cols])
+        for row in assigned_rows:
+            email = row.get("email_from", "")
+            if use_driving:
+                ws_assigned.append([row.get("nearest_dealer", ""), row.get("distance_km", ""), row.get("drive_time_hr", ""), email, *tag_bits(row), *row_values(row, lead_cols)])
+            else:
+                ws_assigned.append([row.get("nearest_dealer", ""), row.get("distance_km", ""), email, *tag_bits(row), *row_values(row, lead_cols)])
 
-    ws_summary.freeze_panes = "A2"
-    ws_assigned.freeze_panes = "A2"
-    ws_unassigned.freeze_panes = "A2"
+        # Unassigned sheet (no dealer assignment)
+        ws_unassigned = rep.sheet("Unassigned", ["unassigned_reason", "distance_km", "drive_time_hr", "email_from", *tag_names, *lead_cols])
+        for row in unassigned_rows:
+            ws_unassigned.append([row.get("unassigned_reason", ""), row.get("distance_km", ""), row.get("drive_time_hr", ""), row.get("email_from", ""), *tag_bits(row), *row_values(row, lead_cols)])
 
-    wb.save(out_path)
-    print(f"Wrote: {out_path}")
+    for p in rep.outputs:
+        print(f"Wrote: {p}")
     return 0
 
 
 if __name__ == "__main__":
-    raise SystemExit(main())
+    try:
+        raise SystemExit(main())
+    finally:
+        print(PROCESS_RPC.summary())
@@ -1,50 +1,13 @@
-import json
-import time
-from pathlib import Path
 from typing import Dict, Tuple, Optional, List, Any
 
-from geopy.geocoders import Nominatim
-from geopy.exc import GeocoderTimedOut, GeocoderServiceError
-
+import geocoding
+from geocoding import GeoCache, get_geo_cache
+from leads_export_io import load_leads_export
 from odoo_connector import DEALER_LOCATIONS, haversine_distance  # already in your codebase :contentReference[oaicite:5]{index=5}
 
-# Persistent cache for city/province -> (lat, lon)
-GEO_CACHE_PATH = Path("geo_city_cache.json")
-geolocator = Nominatim(user_agent="WavcorLeadRadius")  # similar to webhook_server :contentReference[oaicite:6]{index=6}
-
-def _load_geo_cache() -> Dict[str, Tuple[float, float]]:
-    if GEO_CACHE_PATH.exists():
-        return json.loads(GEO_CACHE_PATH.read_text())
-    return {}
-
-def _save_geo_cache(cache: Dict[str, Tuple[float, float]]) -> None:
-    GEO_CACHE_PATH.write_text(json.dumps(cache, indent=2))
-
-def _geo_key(city: str, prov: str, country: str = "Canada") -> str:
-    return f"{city.strip().lower()}|{prov.strip().lower()}|{country.strip().lower()}"
-
-def geocode_city_prov(city: str, prov: str, cache: Dict[str, Tuple[float, float]], country: str = "Canada") -> Optional[Tuple[float, float]]:
-    if not city or not prov:
-        return None
-
-    key = _geo_key(city, prov, country)
-    if key in cache:
-        lat, lon = cache[key]
-        return float(lat), float(lon)
-
-    query = f"{city}, {prov}, {country}"
-    for attempt in range(1, 4):
-        try:
-            loc = geolocator.geocode(query, timeout=10)
-            if loc:
-                cache[key] = (loc.latitude, loc.longitude)
-                return loc.latitude, loc.longitude
-            return None
-        except (GeocoderTimedOut, GeocoderServiceError):
-            time.sleep(1.5 * attempt)
-        except Exception:
-            return None
-    return None
+def geocode_city_prov(city: str, prov: str, cache: GeoCache, country: str = "Canada") -> Optional[Tuple[float, float]]:
+    # Shared cache/provider chain (geocoding.py); the caller saves the cache once at the end.
+    return geocoding.geocode(city, prov, country, cache=cache, save=False)
 
 def find_dealer_by_name(dealer_name: str) -> Dict[str, Any]:
     name_norm = dealer_name.strip().lower()
@@ -58,7 +21,7 @@ def find_dealer_by_name(dealer_name: str) -> Dict[str, Any]:
     raise ValueError(f"Dealer not found: {dealer_name!r}")
 
 def load_leads_cache(path: str = "leads_cache.json") -> List[Dict[str, Any]]:
-    return json.loads(Path(path).read_text())
+    return load_leads_export(path)
 
 def leads_within_radius_of_dealer(
     dealer: Dict[str, Any],
@@ -66,7 +29,7 @@ def leads_within_radius_of_dealer(
     radius_km: float = 100.0,
     country_default: str = "Canada"
 ) -> List[Dict[str, Any]]:
-    cache = _load_geo_cache()
+    cache = get_geo_cache()
 
     dealer_lat = float(dealer["Latitude"])
     dealer_lon = float(dealer["Longitude"])
@@ -87,7 +50,7 @@ def leads_within_radius_of_dealer(
             out["distance_km"] = round(dist, 1)
             results.append(out)
 
-    _save_geo_cache(cache)
+    cache.save()
     results.sort(key=lambda x: x["distance_km"])
     return results
 
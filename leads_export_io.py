@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+leads_export_io.py
+
+Shared reader/writer for leads_export.json.
+
+Formats:
+- JSON Lines (written by export_leads_json.py unless --out ends in .json):
+    line 1:  {"_meta": "header", "schema_version": 1, "exported_at": ...}
+    line 2+: one lead record per line
+    last:    {"_meta": "footer", "record_count": N, "sync": {...}}
+- Legacy single document: {"records": [...], ...} or a bare [...] list.
+
+iter_leads_export() streams records from either format, so tools can process
+leads in constant memory and start work before the whole file is read.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Union
+
+from cache_store import NEW_FILE_MODE
+
+FORMAT_JSONL = "jsonl"
+FORMAT_JSON = "json"
+
+PathLike = Union[str, Path]
+
+
+def _first_line(path: Path) -> str:
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                return line
+    return ""
+
+
+def _parse_meta_line(line: str, kind: str) -> Optional[Dict[str, Any]]:
+    line = line.strip()
+    if not line.startswith("{"):
+        return None
+    try:
+        obj = json.loads(line)
+    except ValueError:
+        return None
+    if isinstance(obj, dict) and obj.get("_meta") == kind:
+        return obj
+    return None
+
+
+def is_jsonl_export(path: PathLike) -> bool:
+    return _parse_meta_line(_first_line(Path(path)), "header") is not None
+
+
+def _load_legacy(path: Path) -> List[Dict[str, Any]]:
+    data = json.loads(path.read_text(encoding="utf-8"))
+    if isinstance(data, dict) and isinstance(data.get("records"), list):
+        return data["records"]
+    if isinstance(data, list):
+        return data
+    raise ValueError(f"Unrecognized leads JSON format: {path}")
+
+
+def iter_leads_export(path: PathLike) -> Iterator[Dict[str, Any]]:
+    """Yield lead records one at a time from a JSONL or legacy leads export."""
+    path = Path(path)
+    if not is_jsonl_export(path):
+        yield from _load_legacy(path)
+        return
+
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                obj = json.loads(line)
+            except ValueError as e:
+                raise ValueError(f"Bad JSON on line {line_no} of {path}: {e}") from e
+            if isinstance(obj, dict) and "_meta" in obj:
+                continue
+            yield obj
+
+
+def load_leads_export(path: PathLike) -> List[Dict[str, Any]]:
+    """Read every lead record into a list (either format)."""
+    return list(iter_leads_export(path))
+
+
+def _last_line(path: Path, block_size: int = 8192) -> str:
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        end = f.tell()
+        pos = max(0, end - block_size)
+        while True:
+            f.seek(pos)
+            chunk = f.read(end - pos)
+            lines = [ln for ln in chunk.splitlines() if ln.strip()]
+            if len(lines) >= 2 or pos == 0:
+                return lines[-1].decode("utf-8") if lines else ""
+            pos = max(0, pos - block_size)
+
+
+def read_export_meta(path: PathLike) -> Dict[str, Any]:
+    """
+    Return export metadata (exported_at, schema_version, record_count, sync, ...) without
+    reading the records of a JSONL export. Legacy files are parsed in full.
+    """
+    path = Path(path)
+    header = _parse_meta_line(_first_line(path), "header")
+    if header is None:
+        data = json.loads(path.read_text(encoding="utf-8"))
+        if isinstance(data, list):
+            return {"record_count": len(data)}
+        return {k: v for k, v in data.items() if k != "records"} if isinstance(data, dict) else {}
+    meta = {k: v for k, v in header.items() if k != "_meta"}
+    footer = _parse_meta_line(_last_line(path), "footer")
+    if footer:
+        meta.update({k: v for k, v in footer.items() if k != "_meta"})
+    return meta
+
+
+def write_leads_export(
+    path: PathLike,
+    records: Iterable[Dict[str, Any]],
+    meta: Optional[Dict[str, Any]] = None,
+    fmt: str = FORMAT_JSONL,
+    footer: Optional[Dict[str, Any]] = None,
+) -> int:
+    """
+    Write records to path atomically (temp file + rename), streaming for JSONL.
+    meta goes in the header (JSONL) or top level (legacy JSON); footer (e.g. the sync
+    high-water mark) goes in the JSONL footer or top level. record_count is added automatically.
+    Returns the number of records written.
+    """
+    path = Path(path)
+    meta = dict(meta or {})
+    footer = dict(footer or {})
+    fd, tmp_name = tempfile.mkstemp(prefix=f".{path.name}.", suffix=".tmp", dir=str(path.parent.resolve()))
+    count = 0
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            if fmt == FORMAT_JSONL:
+                f.write(json.dumps({"_meta": "header", **meta}, ensure_ascii=False) + "\n")
+                for rec in records:
+                    f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+                    count += 1
+                footer["record_count"] = count
+                f.write(json.dumps({"_meta": "footer", **footer}, ensure_ascii=False) + "\n")
+            elif fmt == FORMAT_JSON:
+                out = list(records)
+                count = len(out)
+                payload = dict(meta)
+                payload["record_count"] = count
+                payload.update(footer)
+                payload["records"] = out
+                json.dump(payload, f, indent=2, ensure_ascii=False)
+            else:
+                raise ValueError(f"Unknown leads export format: {fmt!r}")
+        os.chmod(tmp_name, NEW_FILE_MODE)
+        os.replace(tmp_name, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_name)
+        except OSError:
+            pass
+        raise
+    return count
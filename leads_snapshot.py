@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+leads_snapshot.py
+
+Columnar snapshot of leads_export.json for fast geo queries.
+
+export_leads_json.py --snapshot writes a directory next to the export
+(leads_export.json -> leads_export.snapshot/) holding one NumPy array per column:
+
+    lead_id.npy    int64     crm.lead id
+    lat.npy        float64   resolved latitude  (NaN when the city/province isn't in the geo cache)
+    lon.npy        float64   resolved longitude (NaN likewise)
+    province.npy   <U        province/state code (or name) used for geocoding
+    stage_id.npy   int32     crm.stage id (-1 when empty)
+    tag_bits.npy   uint64    (rows, words) bitset; bit i <-> meta["tag_ids"][i]
+    meta.json                exported_at/record_count of the source export, tag_ids, counts
+
+Rows are in the same order as the export, so row i of the snapshot is record i of
+load_leads_export(). Readers memory-map the arrays and answer radius/nearest-dealer
+queries with vectorized scans; only matching rows are turned back into dicts.
+
+Coordinates are resolved from the geocode cache only (no network). Leads that were not
+cached at export time keep NaN coordinates and callers fall back to their usual geocoding.
+
+numpy is optional: without it build_snapshot() raises and load_snapshot_for() returns None.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+try:
+    import numpy as np
+except ImportError:  # optional dependency
+    np = None
+
+from geocoding import GeoCache, canonical_key, get_geo_cache
+from leads_export_io import read_export_meta
+
+SNAPSHOT_VERSION = 1
+EARTH_RADIUS_KM = 6371  # same as odoo_connector.haversine_distance
+
+PathLike = Union[str, Path]
+
+
+def numpy_available() -> bool:
+    return np is not None
+
+
+def snapshot_path_for(export_path: PathLike) -> Path:
+    export_path = Path(export_path)
+    return export_path.with_name(export_path.stem + ".snapshot")
+
+
+def lead_location(lead: Dict[str, Any], default_country: str = "Canada") -> Tuple[str, str, str]:
+    """(city, prov, country) as the radius tools pass them to geocoding.canonical_key()."""
+    city = (lead.get("city") or "").strip()
+    prov = (
+        (lead.get("province_state_code") or "")
+        or (lead.get("province_state_name") or "")
+        or (lead.get("province") or "")
+    ).strip()
+    country = (lead.get("country_name") or lead.get("country") or default_country).strip() or default_country
+    return city, prov, country
+
+
+def _require_numpy() -> None:
+    if np is None:
+        raise RuntimeError("numpy is required for lead snapshots (pip install numpy)")
+
+
+def build_snapshot(
+    records: Sequence[Dict[str, Any]],
+    out_dir: PathLike,
+    source_meta: Optional[Dict[str, Any]] = None,
+    geo_cache: Optional[GeoCache] = None,
+) -> Dict[str, int]:
+    """
+    Write the columnar snapshot for records into out_dir (replaced atomically).
+    source_meta should be the export's metadata (exported_at, record_count) so readers can detect staleness.
+    Returns counts: records, resolved, tags.
+    """
+    _require_numpy()
+    out_dir = Path(out_dir)
+    cache = get_geo_cache() if geo_cache is None else geo_cache
+    n = len(records)
+
+    lead_id = np.zeros(n, dtype=np.int64)
+    lat = np.full(n, np.nan, dtype=np.float64)
+    lon = np.full(n, np.nan, dtype=np.float64)
+    stage_id = np.full(n, -1, dtype=np.int32)
+    provinces: List[str] = []
+
+    tag_ids = sorted({int(t) for r in records for t in (r.get("tag_ids") or [])})
+    tag_bit = {t: i for i, t in enumerate(tag_ids)}
+    words = max(1, (len(tag_ids) + 63) // 64)
+    tag_bits = np.zeros((n, words), dtype=np.uint64)
+
+    resolved = 0
+    for i, r in enumerate(records):
+        lead_id[i] = int(r.get("lead_id") or r.get("id") or 0)
+        if r.get("stage_id"):
+            stage_id[i] = int(r["stage_id"])
+        city, prov, country = lead_location(r)
+        provinces.append(prov)
+        coords = cache.get(canonical_key(city, prov, country))
+        if coords is not None:
+            lat[i], lon[i] = coords
+            resolved += 1
+        for t in r.get("tag_ids") or []:
+            b = tag_bit[int(t)]
+            tag_bits[i, b // 64] |= np.uint64(1) << np.uint64(b % 64)
+
+    width = max([1] + [len(p) for p in provinces])
+    province = np.array(provinces, dtype=f"<U{width}") if provinces else np.zeros(0, dtype="<U1")
+
+    source_meta = source_meta or {}
+    meta = {
+        "snapshot_version": SNAPSHOT_VERSION,
+        "exported_at": source_meta.get("exported_at"),
+        "record_count": n,
+        "resolved_count": resolved,
+        "tag_ids": tag_ids,
+    }
+
+    out_dir.parent.mkdir(parents=True, exist_ok=True)
+    tmp_dir = Path(tempfile.mkdtemp(prefix=f".{out_dir.name}.", dir=str(out_dir.parent.resolve())))
+    try:
+        np.save(tmp_dir / "lead_id.npy", lead_id)
+        np.save(tmp_dir / "lat.npy", lat)
+        np.save(tmp_dir / "lon.npy", lon)
+        np.save(tmp_dir / "province.npy", province)
+        np.save(tmp_dir / "stage_id.npy", stage_id)
+        np.save(tmp_dir / "tag_bits.npy", tag_bits)
+        (tmp_dir / "meta.json").write_text(json.dumps(meta, indent=2), encoding="utf-8")
+
+        old_dir = None
+        if out_dir.exists():
+            old_dir = out_dir.with_name(f".{out_dir.name}.old")
+            shutil.rmtree(old_dir, ignore_errors=True)
+            os.replace(out_dir, old_dir)
+        os.replace(tmp_dir, out_dir)
+        if old_dir is not None:
+            shutil.rmtree(old_dir, ignore_errors=True)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+    return {"records": n, "resolved": resolved, "tags": len(tag_ids)}
+
+
+class LeadsSnapshot:
+    """Memory-mapped snapshot columns plus vectorized geo queries."""
+
+    def __init__(self, path: PathLike, mmap: bool = True):
+        _require_numpy()
+        self.path = Path(path)
+        self.meta: Dict[str, Any] = json.loads((self.path / "meta.json").read_text(encoding="utf-8"))
+        mode = "r" if mmap else None
+        self.lead_id = np.load(self.path / "lead_id.npy", mmap_mode=mode)
+        self.lat = np.load(self.path / "lat.npy", mmap_mode=mode)
+        self.lon = np.load(self.path / "lon.npy", mmap_mode=mode)
+        self.province = np.load(self.path / "province.npy", mmap_mode=mode)
+        self.stage_id = np.load(self.path / "stage_id.npy", mmap_mode=mode)
+        self.tag_bits = np.load(self.path / "tag_bits.npy", mmap_mode=mode)
+        self._tag_bit = {int(t): i for i, t in enumerate(self.meta.get("tag_ids") or [])}
+        self._rad: Optional[Tuple[Any, Any, Any]] = None
+
+    def __len__(self) -> int:
+        return int(self.lead_id.shape[0])
+
+    def aligned_with(self, records: Sequence[Dict[str, Any]]) -> bool:
+        """True when row i of the snapshot is records[i] (same export, same order)."""
+        if len(records) != len(self):
+            return False
+        ids = np.fromiter((int(r.get("lead_id") or r.get("id") or 0) for r in records), dtype=np.int64, count=len(records))
+        return bool(np.array_equal(ids, self.lead_id))
+
+    @property
+    def resolved(self):
+        """Boolean mask of rows with coordinates."""
+        return ~np.isnan(self.lat)
+
+    def unresolved_indices(self) -> List[int]:
+        return np.flatnonzero(np.isnan(self.lat)).tolist()
+
+    def _radians(self):
+        if self._rad is None:
+            lat_r = np.radians(self.lat)
+            self._rad = (lat_r, np.radians(self.lon), np.cos(lat_r))
+        return self._rad
+
+    def distances_km(self, lat: float, lon: float):
+        """Great-circle km from (lat, lon) to every row; NaN for unresolved rows."""
+        lat_r, lon_r, cos_lat = self._radians()
+        p_lat = np.radians(lat)
+        dlat = lat_r - p_lat
+        dlon = lon_r - np.radians(lon)
+        a = np.sin(dlat / 2) ** 2 + np.cos(p_lat) * cos_lat * np.sin(dlon / 2) ** 2
+        return EARTH_RADIUS_KM * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+    def within_radius(self, lat: float, lon: float, radius_km: float) -> Tuple[List[int], List[float]]:
+        """Row indices within radius_km of (lat, lon), nearest first, with their distances."""
+        dist = self.distances_km(lat, lon)
+        with np.errstate(invalid="ignore"):
+            idx = np.flatnonzero(dist <= radius_km)
+        idx = idx[np.argsort(dist[idx], kind="stable")]
+        return idx.tolist(), dist[idx].tolist()
+
+    def nearest(self, points: Iterable[Tuple[float, float]], chunk: int = 4096) -> Tuple[Any, Any]:
+        """
+        For every row, the index of the nearest point and its km distance.
+        Unresolved rows get index -1 and distance NaN.
+        """
+        pts = np.asarray(list(points), dtype=np.float64).reshape(-1, 2)
+        n = len(self)
+        best_idx = np.full(n, -1, dtype=np.int64)
+        best_km = np.full(n, np.nan, dtype=np.float64)
+        if n == 0 or len(pts) == 0:
+            return best_idx, best_km
+
+        lat_r, lon_r, cos_lat = self._radians()
+        p_lat = np.radians(pts[:, 0])[None, :]
+        p_lon = np.radians(pts[:, 1])[None, :]
+        p_cos = np.cos(p_lat)
+        for start in range(0, n, chunk):
+            sl = slice(start, start + chunk)
+            dlat = lat_r[sl, None] - p_lat
+            dlon = lon_r[sl, None] - p_lon
+            a = np.sin(dlat / 2) ** 2 + cos_lat[sl, None] * p_cos * np.sin(dlon / 2) ** 2
+            km = EARTH_RADIUS_KM * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+            ok = ~np.isnan(lat_r[sl])
+            if not ok.any():
+                continue
+            arg = np.argmin(np.where(np.isnan(km), np.inf, km), axis=1)
+            rows = np.flatnonzero(ok)
+            best_idx[start + rows] = arg[rows]
+            best_km[start + rows] = km[rows, arg[rows]]
+        return best_idx, best_km
+
+    def has_tag(self, tag_id: int):
+        """Boolean mask of rows carrying tag_id."""
+        b = self._tag_bit.get(int(tag_id))
+        if b is None:
+            return np.zeros(len(self), dtype=bool)
+        word = self.tag_bits[:, b // 64]
+        return (word >> np.uint64(b % 64)) & np.uint64(1) == np.uint64(1)
+
+
+def load_snapshot(path: PathLike, mmap: bool = True) -> LeadsSnapshot:
+    return LeadsSnapshot(path, mmap=mmap)
+
+
+def load_snapshot_for(
+    export_path: PathLike,
+    records: Optional[Sequence[Dict[str, Any]]] = None,
+) -> Optional[LeadsSnapshot]:
+    """
+    Open the snapshot belonging to export_path, or None when numpy is missing,
+    no snapshot exists, or it is stale (different export run / row order than records).
+    """
+    if np is None:
+        return None
+    snap_dir = snapshot_path_for(export_path)
+    if not (snap_dir / "meta.json").exists():
+        return None
+    try:
+        snap = LeadsSnapshot(snap_dir)
+        if snap.meta.get("snapshot_version") != SNAPSHOT_VERSION:
+            return None
+        if snap.meta.get("exported_at") != read_export_meta(export_path).get("exported_at"):
+            return None
+        if records is not None and not snap.aligned_with(records):
+            return None
+        return snap
+    except (OSError, ValueError):
+        return None
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+metrics.py
+
+Process-local counters and gauges, rendered in the Prometheus text format for /metrics
+(webhook_server.py / webhook_asgi.py).
+
+- inc(name, n=1, **labels): bump a counter (created on first use; declare help text once
+  with describe()).
+- register(name, help, fn, kind="gauge"): fn() is read at scrape time and returns a number
+  or {((label, value), ...): number} (kind="counter" for totals kept elsewhere).
+- Latency: the per-stage histograms from tracing.STAGES are exported as
+  wavcor_stage_seconds{stage=...}, and the Odoo RPC stages ("odoo.<model>.<method>") as
+  wavcor_odoo_rpc_seconds{model=..., method=...}.
+
+Values are per process: under gunicorn each worker reports its own (see README).
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Tuple
+
+from tracing import STAGES
+
+PREFIX = "wavcor_"
+PROCESS_START = time.time()
+
+Labels = Tuple[Tuple[str, str], ...]
+
+_COUNTERS: Dict[str, Dict[Labels, float]] = {}
+_HELP: Dict[str, str] = {}
+_COLLECTORS: List[Tuple[str, str, Callable, str]] = []
+_LOCK = threading.Lock()
+
+
+def _labels(labels: dict) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def describe(name: str, help_text: str) -> None:
+    _HELP[name] = help_text
+
+
+def inc(name: str, n: float = 1, **labels) -> None:
+    key = _labels(labels)
+    with _LOCK:
+        series = _COUNTERS.setdefault(name, {})
+        series[key] = series.get(key, 0) + n
+
+
+def counter_value(name: str, **labels) -> float:
+    return _COUNTERS.get(name, {}).get(_labels(labels), 0)
+
+
+def register(name: str, help_text: str, fn: Callable, kind: str = "gauge") -> None:
+    _COLLECTORS.append((name, help_text, fn, kind))
+
+
+class InFlight:
+    """Thread-safe count of work in progress; `with in_flight:` around each unit of work."""
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self) -> None:
+        with self._lock:
+            self.value += 1
+
+    def dec(self) -> None:
+        with self._lock:
+            self.value -= 1
+
+    def __enter__(self):
+        self.inc()
+        return self
+
+    def __exit__(self, *exc):
+        self.dec()
+        return False
+
+
+# --------------------------------------------------------------------
+# Prometheus text format
+# --------------------------------------------------------------------
+def _escape(v: str) -> str:
+    return v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+
+def _fmt_value(v: float) -> str:
+    return repr(float(v)) if isinstance(v, float) and not float(v).is_integer() else str(int(v))
+
+
+def _histogram_lines(name: str, labels: Labels, snap: dict) -> List[str]:
+    lines = []
+    for le, cumulative in snap["buckets"]:
+        le_s = "+Inf" if le == "+Inf" else repr(le / 1000.0)
+        lines.append(f"{name}_bucket{_fmt_labels(labels + (('le', le_s),))} {cumulative}")
+    lines.append(f"{name}_sum{_fmt_labels(labels)} {snap['sum_ms'] / 1000.0!r}")
+    lines.append(f"{name}_count{_fmt_labels(labels)} {snap['count']}")
+    return lines
+
+
+def _odoo_stage(stage: str):
+    """("res.partner", "search_read") for "odoo.res.partner.search_read", else None."""
+    if not stage.startswith("odoo.") or stage.count(".") < 2:
+        return None
+    model, _, method = stage[len("odoo."):].rpartition(".")
+    return model, method
+
+
+def render() -> str:
+    out: List[str] = [
+        f"# HELP {PREFIX}process_start_time_seconds Start time of this worker process.",
+        f"# TYPE {PREFIX}process_start_time_seconds gauge",
+        f'{PREFIX}process_start_time_seconds{{pid="{os.getpid()}"}} {PROCESS_START!r}',
+    ]
+
+    with _LOCK:
+        counters = {name: dict(series) for name, series in _COUNTERS.items()}
+    for name in sorted(counters):
+        full = PREFIX + name
+        out.append(f"# HELP {full} {_HELP.get(name, name)}")
+        out.append(f"# TYPE {full} counter")
+        for labels, value in sorted(counters[name].items()):
+            out.append(f"{full}{_fmt_labels(labels)} {_fmt_value(value)}")
+
+    for name, help_text, fn, kind in _COLLECTORS:
+        try:
+            value = fn()
+        except Exception as e:
+            print(f"WARNING: metrics collector {name} failed: {e}", flush=True)
+            continue
+        full = PREFIX + name
+        out.append(f"# HELP {full} {help_text}")
+        out.append(f"# TYPE {full} {kind}")
+        series = value if isinstance(value, dict) else {(): value}
+        for labels, v in sorted(series.items()):
+            out.append(f"{full}{_fmt_labels(labels)} {_fmt_value(v)}")
+
+    stages, odoo = [], []
+    for stage, snap in STAGES.snapshot().items():
+        mm = _odoo_stage(stage)
+        if mm:
+            odoo.append((mm, snap))
+        else:
+            stages.append((stage, snap))
+
+    for name, help_text, rows, label_fn in (
+        ("stage_seconds", "Latency per pipeline stage (tracing spans).", stages, lambda s: (("stage", s),)),
+        ("odoo_rpc_seconds", "Odoo RPC latency per model/method.", odoo, lambda mm: (("model", mm[0]), ("method", mm[1]))),
+    ):
+        if not rows:
+            continue
+        full = PREFIX + name
+        out.append(f"# HELP {full} {help_text}")
+        out.append(f"# TYPE {full} histogram")
+        for key, snap in rows:
+            out.extend(_histogram_lines(full, label_fn(key), snap))
+        err = f"{PREFIX}{name.rsplit('_', 1)[0]}_errors_total"
+        out.append(f"# HELP {err} Failed calls per {'stage' if name == 'stage_seconds' else 'model/method'}.")
+        out.append(f"# TYPE {err} counter")
+        for key, snap in rows:
+            out.append(f"{err}{_fmt_labels(label_fn(key))} {snap['errors']}")
+
+    return "\n".join(out) + "\n"
+
+
+describe("geocode_cache_total", "Geocode lookups by cache result (hit/miss).")
+describe("geocode_requests_total", "Geocoder requests by provider and result (found/not_found/error/rate_limited).")
+describe("route_cache_total", "Dealer route lookups by route cache result (hit/miss).")
+describe("dealer_lookups_total", "Closest-dealer picks by route mode: osrm, distance_fallback or none (find_closest_dealer), "
+         "nearest_direct (/nearest_dealer's last resort after none).")
+describe("webhook_submissions_total", "Wix submissions by dedup result (new/duplicate/no_id).")
+describe("nearest_dealer_limited_total", "/nearest_dealer requests refused by rate limiting or load shedding.")
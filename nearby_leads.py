@@ -10,124 +10,23 @@ Inputs:
 
 Geocoding:
 - Uses city + province/state only (as requested)
-- Uses Nominatim via geopy (same general approach as webhook_server.py)
-- Caches city/province -> lat/lon in geo_city_cache.json for speed and rate-limit friendliness
+- Uses the shared geocoding module (same cache keys and providers as webhook_server.py)
+- Caches city/province -> lat/lon in the shared cache database for speed and rate-limit friendliness
 """
 
 from __future__ import annotations
 
 import argparse
 import csv
-import json
-import time
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Tuple
-
-from geopy.geocoders import Nominatim
-from geopy.exc import GeocoderTimedOut, GeocoderServiceError
+from typing import Any, Dict, Iterable, List, Tuple
 
+from batch_geocode import batch_geocode
+from geocoding import canonical_key, get_geo_cache
+from leads_export_io import iter_leads_export, read_export_meta
 from odoo_connector import DEALER_LOCATIONS, haversine_distance  # haversine_distance is already in your repo
 
 
-# -----------------------------
-# Geocode cache
-# -----------------------------
-GEO_CACHE_PATH = Path("geo_city_cache.json")
-
-def _load_geo_cache() -> Dict[str, Tuple[float, float]]:
-    if not GEO_CACHE_PATH.exists():
-        return {}
-
-    try:
-        raw = json.loads(GEO_CACHE_PATH.read_text(encoding="utf-8"))
-    except Exception:
-        return {}
-
-    clean: Dict[str, Tuple[float, float]] = {}
-    if isinstance(raw, dict):
-        for k, v in raw.items():
-            try:
-                if (
-                    isinstance(v, (list, tuple))
-                    and len(v) == 2
-                    and v[0] is not None
-                    and v[1] is not None
-                ):
-                    lat = float(v[0])
-                    lon = float(v[1])
-                    clean[k] = (lat, lon)
-            except Exception:
-                # skip invalid entries
-                continue
-
-    # If we removed anything, rewrite the cache so it stays clean
-    if clean != raw:
-        _save_geo_cache(clean)
-
-    return clean
-
-
-def _save_geo_cache(cache: Dict[str, Tuple[float, float]]) -> None:
-    GEO_CACHE_PATH.write_text(json.dumps(cache, indent=2, ensure_ascii=False), encoding="utf-8")
-
-def _geo_key(city: str, prov: str, country: str = "Canada") -> str:
-    return f"{city.strip().lower()}|{prov.strip().lower()}|{country.strip().lower()}"
-
-_geolocator = Nominatim(user_agent="WavcorLeadRadius/1.0")
-
-def geocode_city_prov(
-    city: str,
-    prov: str,
-    cache: Dict[str, Tuple[float, float]],
-    country: str = "Canada",
-    attempts: int = 3,
-) -> Tuple[Optional[Tuple[float, float]], bool]:
-    """
-    Returns: (coords, cache_hit)
-    """
-    if not city or not prov:
-        return None, False
-
-    key = _geo_key(city, prov, country)
-    if key in cache:
-        lat, lon = cache[key]
-        return (float(lat), float(lon)), True
-
-    query = f"{city}, {prov}, {country}"
-
-    for i in range(1, attempts + 1):
-        try:
-            loc = _geolocator.geocode(query, timeout=10)
-            if loc:
-                cache[key] = (loc.latitude, loc.longitude)
-                return (loc.latitude, loc.longitude), False
-            return None, False
-        except (GeocoderTimedOut, GeocoderServiceError):
-            time.sleep(1.5 * i)
-        except Exception:
-            return None, False
-
-    return None, False
-
-
-
-# -----------------------------
-# Leads file loading
-# -----------------------------
-def load_leads_export(path: str) -> List[Dict[str, Any]]:
-    """
-    Supports either:
-    - {"records":[...], ...} (the schema from export_leads_json.py)
-    - [...] (a raw list, if you ever output that)
-    """
-    data = json.loads(Path(path).read_text(encoding="utf-8"))
-    if isinstance(data, dict) and "records" in data and isinstance(data["records"], list):
-        return data["records"]
-    if isinstance(data, list):
-        return data
-    raise ValueError(f"Unrecognized leads JSON format in {path}")
-
-
 def pick_dealer(query: str) -> Dict[str, Any]:
     """
     Find a dealer by exact or partial match on Location.
@@ -168,20 +67,32 @@ def list_dealers() -> None:
 # -----------------------------
 def leads_within_radius_km(
     dealer: Dict[str, Any],
-    leads: List[Dict[str, Any]],
+    leads: Iterable[Dict[str, Any]],
     radius_km: float = 100.0,
     default_country: str = "Canada",
 ) -> List[Dict[str, Any]]:
     dealer_lat = float(dealer["Latitude"])
     dealer_lon = float(dealer["Longitude"])
 
-    cache = _load_geo_cache()
+    cache = get_geo_cache()
 
-    results: List[Dict[str, Any]] = []
+    hits: List[Tuple[float, int, Dict[str, Any]]] = []
     skipped_missing_addr = 0
     skipped_geocode_fail = 0
 
-    for lead in leads:
+    # Leads whose city/province isn't cached yet are parked here and geocoded in one batch.
+    deferred: Dict[str, List[Tuple[int, Dict[str, Any]]]] = {}
+    jobs: Dict[str, Tuple[str, str, str]] = {}
+
+    def consider(idx: int, lead: Dict[str, Any], coords: Tuple[float, float]) -> None:
+        lat, lon = coords
+        dist = haversine_distance(dealer_lat, dealer_lon, lat, lon)
+        if dist <= radius_km:
+            out = dict(lead)
+            out["distance_km"] = round(dist, 1)
+            hits.append((out["distance_km"], idx, out))
+
+    for idx, lead in enumerate(leads):
         city = (lead.get("city") or "").strip()
 
         # Your export includes both name and code; use code if present, else name.
@@ -193,63 +104,35 @@ def leads_within_radius_km(
 
         country = (lead.get("country_name") or lead.get("country") or default_country).strip() or default_country
 
-        if not city or not prov:
+        key = canonical_key(city, prov, country)
+        if not key:
             skipped_missing_addr += 1
             continue
 
-        cache_dirty = False
-
-        key = _geo_key(city, prov, country)
-
         coords = cache.get(key)
-        cache_hit = coords is not None
-
-        if not cache_hit:
-            coords, cache_hit = geocode_city_prov(city, prov, cache, country=country)
-            if coords is None:
-                skipped_geocode_fail += 1
-                continue
-            cache_dirty = True
-        else:
-            # coords is already (lat, lon)
-            pass
-
-
         if coords is None:
-            skipped_geocode_fail += 1
+            deferred.setdefault(key, []).append((idx, lead))
+            jobs[key] = (city, prov, country)
             continue
 
-        if not cache_hit:
-            cache_dirty = True
+        consider(idx, lead, coords)
 
-        # Explicitly unpack coordinates
-        lat, lon = coords
-
-        # Defensive safety check
-        if lat is None or lon is None:
-            skipped_geocode_fail += 1
-            continue
-
-        dist = haversine_distance(dealer_lat, dealer_lon, lat, lon)
-
-        if dist <= radius_km:
-            out = dict(lead)
-            out["distance_km"] = round(dist, 1)
-            results.append(out)
-
-        # Polite throttling ONLY when we just created a new cache entry.
-        # A simple approach is: if key not present we pause. We can detect that by checking again.
-        # (If you're doing large first-time runs, you may want to increase this.)
-        # NOTE: This is conservative; cached lookups won't sleep.
-        # We do not know if this call was cached without tracking; simplest is accept occasional sleep
-        # only if cache file is being populated heavily by adding a slightly larger sleep for safety.
-        # Comment this out if you use a paid geocoder.
-        # time.sleep(0.1)
-
-    if cache_dirty:
-        _save_geo_cache(cache)
+    if jobs:
+        print(f"Geocoding {len(jobs)} new city/province combination(s)...")
+        stats = batch_geocode(jobs, cache)
+        if stats["geocoded"] or stats["resumed"]:
+            cache.save()
+        for key, group in deferred.items():
+            coords = cache.get(key)
+            if coords is None:
+                skipped_geocode_fail += len(group)
+                continue
+            for idx, lead in group:
+                consider(idx, lead, coords)
 
-    results.sort(key=lambda x: x.get("distance_km", 1e9))
+    # Distance first, then export order (same as a plain stable sort over the leads)
+    hits.sort(key=lambda h: (h[0], h[1]))
+    results = [out for _, _, out in hits]
 
     print(f"Skipped (missing city/province): {skipped_missing_addr}")
     print(f"Skipped (geocode failed):        {skipped_geocode_fail}")
@@ -314,13 +197,14 @@ def main() -> None:
         raise SystemExit("ERROR: --dealer is required (or use --list-dealers).")
 
     dealer = pick_dealer(args.dealer)
-    leads = load_leads_export(args.leads)
+    meta = read_export_meta(args.leads)
 
     print(f"Dealer: {dealer['Location']}  ({dealer['Latitude']}, {dealer['Longitude']})")
     print(f"Radius: {args.radius} km")
-    print(f"Leads loaded: {len(leads)}\n")
+    print(f"Leads in export: {meta.get('record_count', '?')}\n")
 
-    matches = leads_within_radius_km(dealer, leads, radius_km=args.radius)
+    # Stream records so matching starts before the whole export is parsed.
+    matches = leads_within_radius_km(dealer, iter_leads_export(args.leads), radius_km=args.radius)
 
     print(f"\nMatches within {args.radius:.0f} km: {len(matches)}\n")
 
@@ -2,9 +2,7 @@
 from __future__ import annotations
 
 import csv
-import json
 import threading
-import time
 import os
 import sys
 import subprocess
@@ -12,100 +10,22 @@ import sys
 import subprocess
 
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Dict, List, Tuple
 
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 
-from geopy.geocoders import Nominatim
-from geopy.exc import GeocoderTimedOut, GeocoderServiceError
-
+from leads_export_io import load_leads_export
+from batch_geocode import batch_geocode
+from geocoding import canonical_key, get_geo_cache
+from leads_snapshot import lead_location, load_snapshot_for
 from odoo_connector import DEALER_LOCATIONS, haversine_distance
 
 
 # -----------------------------
-# Files / cache
+# Files
 # -----------------------------
 LEADS_PATH_DEFAULT = Path("leads_export.json")
-GEO_CACHE_PATH = Path("geo_city_cache.json")
-
-_geolocator = Nominatim(user_agent="WavcorLeadRadiusDesktop/1.0")
-
-
-def _geo_key(city: str, prov: str, country: str = "Canada") -> str:
-    return f"{city.strip().lower()}|{prov.strip().lower()}|{country.strip().lower()}"
-
-
-def _load_geo_cache() -> Dict[str, Tuple[float, float]]:
-    if not GEO_CACHE_PATH.exists():
-        return {}
-
-    try:
-        raw = json.loads(GEO_CACHE_PATH.read_text(encoding="utf-8"))
-    except Exception:
-        return {}
-
-    clean: Dict[str, Tuple[float, float]] = {}
-    if isinstance(raw, dict):
-        for k, v in raw.items():
-            try:
-                if isinstance(v, (list, tuple)) and len(v) == 2 and v[0] is not None and v[1] is not None:
-                    clean[k] = (float(v[0]), float(v[1]))
-            except Exception:
-                continue
-
-    # If we removed anything, rewrite the cache so it stays clean
-    if clean and clean != raw:
-        _save_geo_cache(clean)
-
-    return clean
-
-
-def _save_geo_cache(cache: Dict[str, Tuple[float, float]]) -> None:
-    GEO_CACHE_PATH.write_text(json.dumps(cache, indent=2, ensure_ascii=False), encoding="utf-8")
-
-
-def load_leads_export(path: Path) -> List[Dict[str, Any]]:
-    data = json.loads(path.read_text(encoding="utf-8"))
-    if isinstance(data, dict) and isinstance(data.get("records"), list):
-        return data["records"]
-    if isinstance(data, list):
-        return data
-    raise ValueError(f"Unrecognized leads JSON format: {path}")
-
-
-def geocode_city_prov(
-    city: str,
-    prov: str,
-    cache: Dict[str, Tuple[float, float]],
-    country: str = "Canada",
-    attempts: int = 3,
-) -> Tuple[Optional[Tuple[float, float]], bool]:
-    """
-    Returns: (coords, cache_hit)
-      coords is (lat, lon) or None
-    """
-    if not city or not prov:
-        return None, False
-
-    key = _geo_key(city, prov, country)
-    if key in cache:
-        return cache[key], True
-
-    query = f"{city}, {prov}, {country}"
-    for i in range(1, attempts + 1):
-        try:
-            loc = _geolocator.geocode(query, timeout=10)
-            if loc:
-                cache[key] = (loc.latitude, loc.longitude)
-                return cache[key], False
-            return None, False
-        except (GeocoderTimedOut, GeocoderServiceError):
-            time.sleep(1.5 * i)
-        except Exception:
-            return None, False
-
-    return None, False
 
 
 def find_dealer(location: str) -> Dict[str, Any]:
@@ -122,11 +42,17 @@ def leads_within_radius(
     radius_km: float,
     default_country: str = "Canada",
     progress_cb=None,
+    snapshot=None,
 ) -> List[Dict[str, Any]]:
+    """
+    snapshot: optional leads_snapshot.LeadsSnapshot aligned with leads (see load_snapshot_for).
+    Rows it has coordinates for are matched with one vectorized scan; only the rest are
+    looked up/geocoded one by one.
+    """
     dealer_lat = float(dealer["Latitude"])
     dealer_lon = float(dealer["Longitude"])
 
-    cache = _load_geo_cache()
+    cache = get_geo_cache()
     cache_dirty = False
 
     results: List[Dict[str, Any]] = []
@@ -135,32 +61,44 @@ def leads_within_radius(
     geocode_calls = 0
 
     total = len(leads)
+    pending = range(total)
 
-    for idx, lead in enumerate(leads, start=1):
-        city = (lead.get("city") or "").strip()
-        prov = (
-            (lead.get("province_state_code") or "")
-            or (lead.get("province_state_name") or "")
-            or (lead.get("province") or "")
-        ).strip()
-        country = (lead.get("country_name") or lead.get("country") or default_country).strip() or default_country
+    if snapshot is not None:
+        # Row order (not distance order) so ties after rounding sort exactly like the per-lead path.
+        for i, dist in sorted(zip(*snapshot.within_radius(dealer_lat, dealer_lon, radius_km))):
+            out = dict(leads[i])
+            out["distance_km"] = round(dist, 1)
+            results.append(out)
+        pending = snapshot.unresolved_indices()
+
+    # Geocode every uncached city/province up front, in one concurrent batch.
+    jobs: Dict[str, Tuple[str, str, str]] = {}
+    for lead_i in pending:
+        city, prov, country = lead_location(leads[lead_i], default_country)
+        key = canonical_key(city, prov, country)
+        if key and key not in cache:
+            jobs[key] = (city, prov, country)
+    if jobs:
+        done_before = total - len(pending)
+        stats = batch_geocode(
+            jobs,
+            cache,
+            progress_cb=(lambda d, t: progress_cb(done_before, total, d)) if progress_cb else None,
+        )
+        geocode_calls = stats["geocoded"]
+        cache_dirty = bool(stats["geocoded"] or stats["resumed"])
 
-        if not city or not prov:
+    for idx, lead_i in enumerate(pending, start=1):
+        lead = leads[lead_i]
+        key = canonical_key(*lead_location(lead, default_country))
+        if not key:
             skipped_missing += 1
             continue
 
-        # fast cache lookup first
-        key = _geo_key(city, prov, country)
         coords = cache.get(key)
         if coords is None:
-            coords, cache_hit = geocode_city_prov(city, prov, cache, country=country)
-            if coords is None:
-                skipped_geocode += 1
-                continue
-            cache_dirty = True
-            geocode_calls += 1
-            # polite throttling for Nominatim
-            time.sleep(1.05)
+            skipped_geocode += 1
+            continue
 
         lat, lon = coords
         dist = haversine_distance(dealer_lat, dealer_lon, lat, lon)
@@ -170,10 +108,10 @@ def leads_within_radius(
             results.append(out)
 
         if progress_cb and idx % 25 == 0:
-            progress_cb(idx, total, geocode_calls)
+            progress_cb(total - len(pending) + idx, total, geocode_calls)
 
     if cache_dirty:
-        _save_geo_cache(cache)
+        cache.save()
 
     results.sort(key=lambda x: x.get("distance_km", 1e9))
 
@@ -312,7 +250,7 @@ class App(tk.Tk):
                 leads=leads,
                 radius_km=radius,
                 progress_cb=lambda c, t, g, **kw: self._ui(self._progress, c, t, g, **kw),
-
+                snapshot=load_snapshot_for(leads_path, leads),
             )
             self.matches = matches
 
@@ -499,6 +437,8 @@ class App(tk.Tk):
                 "export_leads_json.py",
                 "--out",
                 str(Path(self.leads_path.get()).resolve()),
+                "--incremental",
+                "--snapshot",
             ]
 
             # Run exporter and capture output for troubleshooting
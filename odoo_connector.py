@@ -4,15 +4,23 @@
 import xmlrpc.client
 from datetime import datetime, date, timedelta 
 import math
-from typing import Optional, Union, Dict
+from typing import Optional, Union, Dict, List, Tuple
 import re
 import string
+from functools import lru_cache
 import traceback
 import json
+import threading
+import time
 import urllib.parse
 import urllib.request
 from pathlib import Path
 
+import metrics
+import odoo_rpc
+import route_cache
+from tracing import span, traced
+
 ODOO_URL = 'https://wavcor-international-inc2.odoo.com'
 #ODOO_URL = 'https://wavcor-test-2025-07-20.odoo.com'
 ODOO_DB = 'wavcor-international-inc2'
@@ -31,9 +39,31 @@ DIRECT_DISTANCE_RADIUS_PER_HOUR_KM = 120.0
 DIRECT_DISTANCE_BUFFER_KM = 75.0
 OSRM_ROUTE_TIMEOUT_S = 4
 OSRM_TABLE_TIMEOUT_S = 15
+# Public OSRM servers reject /table requests with more than 100 coordinates.
+OSRM_TABLE_MAX_COORDS = 100
 OSRM_ROUTE_FALLBACK_MAX_CALLS = 8
+OSRM_TABLE_BATCH = 40  # destinations per table call in find_closest_dealer
+OSRM_TABLE_SMALL_BATCH = 10  # retry size when a full batch is rejected/times out
 DIRECT_DISTANCE_FALLBACK_KMH = 80.0
 _MODEL_FIELD_CACHE = {}
+# {key: (fetched at, definition or None)}; refetched after the TTL, or early when a dealer
+# option (or the property) is missing, so options added in Odoo are picked up without a restart.
+_LEAD_PROPERTY_DEFINITION_CACHE = {}
+LEAD_PROPERTY_DEFINITION_TTL_S = 600.0
+_LEAD_CREATE_TEAM_CACHE = {}
+_DEALER_OPTION_MISS_CACHE = {}  # (db, label, dealer location) -> monotonic time of the refetch that missed
+# Reference data that doesn't change between requests (only found IDs are cached).
+_COUNTRY_ID_CACHE = {}
+_STATE_ID_CACHE = {}
+_MODEL_ID_CACHE = {}
+_USER_ID_CACHE = {}
+# Odoo session: authenticate once per process; one XML-RPC proxy per thread
+# (ServerProxy keeps one HTTP connection and is not safe to share between threads).
+_ODOO_UID = None
+_JSONRPC_UID = None
+_ODOO_AUTH_LOCK = threading.Lock()
+_ODOO_LOCAL = threading.local()
+_DEALER_POINTS = None
 
 def _ensure_char(v):
     """Return a safe Char/Text value: empty string for None."""
@@ -113,18 +143,29 @@ def _similar_names(a: str, b: str) -> bool:
 
 
 def connect_odoo():
-    """Establishes an XML-RPC connection to the Odoo server."""
+    """
+    Returns (uid, models) for XML-RPC calls to the Odoo server.
+    Authenticates once per process; each thread reuses its own models proxy (and connection).
+    Every models.execute_kw goes through odoo_rpc (timeout, read retries, RPC accounting).
+    """
+    global _ODOO_UID
     try:
-        common = xmlrpc.client.ServerProxy(f'{ODOO_URL}/xmlrpc/2/common', allow_none=True, use_datetime=True)
-        version = common.version()
-        #print(f"Odoo version: {version}")
-        uid = common.authenticate(ODOO_DB, ODOO_USERNAME, ODOO_PASSWORD, {})
-        ##print(f"Authenticated as UID: {uid}")
-        if not uid:
-            print("ERROR: Authentication failed. Check your Odoo credentials.")
-            return None, None
-        models = xmlrpc.client.ServerProxy(f'{ODOO_URL}/xmlrpc/2/object', allow_none=True, use_datetime=True)
-        return uid, models
+        if _ODOO_UID is None:
+            with _ODOO_AUTH_LOCK:
+                if _ODOO_UID is None:
+                    common = odoo_rpc.server_proxy(f'{ODOO_URL}/xmlrpc/2/common', use_datetime=True)
+                    with span("odoo.authenticate"):
+                        uid = common.authenticate(ODOO_DB, ODOO_USERNAME, ODOO_PASSWORD, {})
+                    ##print(f"Authenticated as UID: {uid}")
+                    if not uid:
+                        print("ERROR: Authentication failed. Check your Odoo credentials.")
+                        return None, None
+                    _ODOO_UID = uid
+        models = getattr(_ODOO_LOCAL, "models", None)
+        if models is None:
+            models = odoo_rpc.OdooModels(ODOO_URL, use_datetime=True)
+            _ODOO_LOCAL.models = models
+        return _ODOO_UID, models
     except Exception as e:
         print(f"ERROR: Failed to connect to Odoo server: {e}")
         return None, None
@@ -522,11 +563,7 @@ def _clean(value: str) -> str:
     v = re.sub(r"\s+", " ", v)     # collapse whitespace
     return v.strip()
 
-def normalize_state(value: str) -> str:
-    """
-    Normalize any state/province input into a canonical code (e.g. 'ND', 'SK', 'VIC').
-    Returns the canonical code if recognized, otherwise cleaned input.
-    """
+def _normalize_state_uncached(value: str) -> str:
     if not value:
         return value
     v = _clean(value)
@@ -546,12 +583,7 @@ def normalize_state(value: str) -> str:
 
     return v  # fallback: cleaned input
 
-def resolve_country(state_input: str, country_hint: Optional[str] = None) -> Union[str, list, None]:
-    """
-    Return a single country (string) when unambiguous, a list when ambiguous,
-    or None when unknown. You may pass country_hint (like 'Canada' or 'Australia')
-    to resolve ambiguous codes.
-    """
+def _resolve_country_uncached(state_input: str, country_hint: Optional[str] = None) -> Union[str, list, None]:
     if not state_input:
         return None
 
@@ -587,6 +619,50 @@ def resolve_country(state_input: str, country_hint: Optional[str] = None) -> Uni
     # cannot disambiguate
     return countries
 
+
+# Every known spelling of every state/province (codes, names, aliases in upper/lower/title
+# case) resolved once at import; other inputs go through a bounded LRU.
+STATE_LOOKUP_CACHE_SIZE = 4096
+
+
+def _known_state_spellings() -> set:
+    names = set(CANONICAL_CODES) | set(NAME_TO_CODE) | set(STATE_TO_COUNTRY_MAP)
+    return {variant for name in names for variant in (name, name.upper(), name.lower(), name.title())}
+
+
+_STATE_CODE_BY_SPELLING = {v: _normalize_state_uncached(v) for v in _known_state_spellings()}
+_normalize_state_lru = lru_cache(maxsize=STATE_LOOKUP_CACHE_SIZE)(_normalize_state_uncached)
+
+
+def normalize_state(value: str) -> str:
+    """
+    Normalize any state/province input into a canonical code (e.g. 'ND', 'SK', 'VIC').
+    Returns the canonical code if recognized, otherwise cleaned input.
+    """
+    if not value or not isinstance(value, str):
+        return _normalize_state_uncached(value)
+    code = _STATE_CODE_BY_SPELLING.get(value)
+    if code is None:
+        code = _normalize_state_lru(value)
+    return code
+
+
+_COUNTRY_BY_SPELLING = {v: _resolve_country_uncached(v) for v in _STATE_CODE_BY_SPELLING}
+_resolve_country_lru = lru_cache(maxsize=STATE_LOOKUP_CACHE_SIZE)(_resolve_country_uncached)
+
+
+def resolve_country(state_input: str, country_hint: Optional[str] = None) -> Union[str, list, None]:
+    """
+    Return a single country (string) when unambiguous, a list when ambiguous,
+    or None when unknown. You may pass country_hint (like 'Canada' or 'Australia')
+    to resolve ambiguous codes.
+    """
+    if not state_input or not isinstance(state_input, str) or not isinstance(country_hint, (str, type(None))):
+        return _resolve_country_uncached(state_input, country_hint)
+    if country_hint is None and state_input in _COUNTRY_BY_SPELLING:
+        return _COUNTRY_BY_SPELLING[state_input]
+    return _resolve_country_lru(state_input, country_hint)
+
 def get_state_id(models, uid, state_name):
     if not state_name:
         return False
@@ -608,6 +684,10 @@ def get_state_id(models, uid, state_name):
         print(f"DEBUG: Could not get country ID for '{country_name}'.")
         return False
 
+    cache_key = (ODOO_DB, normalized_state, country_id)
+    if cache_key in _STATE_ID_CACHE:
+        return _STATE_ID_CACHE[cache_key]
+
     # 1. Search for an exact match on the code first
     states = models.execute_kw(ODOO_DB, uid, ODOO_PASSWORD,
         'res.country.state', 'search_read',
@@ -616,6 +696,7 @@ def get_state_id(models, uid, state_name):
         
     if states:
         #print(f"DEBUG: Found Odoo state ID {states[0]['id']} by code for '{state_name}'.")
+        _STATE_ID_CACHE[cache_key] = states[0]['id']
         return states[0]['id']
     else:
         # 2. Fallback to a case-insensitive name search if no code match is found
@@ -635,9 +716,14 @@ def get_country_id(models, uid, country_name):
     if not country_name:
         return False
     try:
+        cache_key = (ODOO_DB, country_name.strip())
+        if cache_key in _COUNTRY_ID_CACHE:
+            return _COUNTRY_ID_CACHE[cache_key]
         country = models.execute_kw(ODOO_DB, uid, ODOO_PASSWORD,
             'res.country', 'search_read',
             [[('name', '=', country_name.strip())]], {'fields': ['id'], 'limit': 1})
+        if country:
+            _COUNTRY_ID_CACHE[cache_key] = country[0]['id']
         return country[0]['id'] if country else False
     except xmlrpc.client.Fault as e:
         #print(f"Odoo RPC Error getting country ID for '{country_name}': {e.faultString}")
@@ -669,11 +755,15 @@ def get_model_id(models, uid, model_name):
     """
     Gets the Odoo ID for a given model (e.g., 'crm.lead').
     """
+    cache_key = (ODOO_DB, model_name)
+    if cache_key in _MODEL_ID_CACHE:
+        return _MODEL_ID_CACHE[cache_key]
     try:
         model_record = models.execute_kw(ODOO_DB, uid, ODOO_PASSWORD,
             'ir.model', 'search_read',
             [[('model', '=', model_name)]], {'fields': ['id'], 'limit': 1})
         if model_record:
+            _MODEL_ID_CACHE[cache_key] = model_record[0]['id']
             return model_record[0]['id']
         else:
             print(f"ERROR: Model '{model_name}' not found in Odoo.")
@@ -707,52 +797,82 @@ def haversine_distance(lat1, lon1, lat2, lon2):
     distance = R * c
     return distance
 
+
+def nearest_by_direct_distance(lat: float, lon: float, dealers: List[Tuple[str, float, float]]) -> Tuple[Optional[str], float]:
+    """(name, km) of the (name, lat, lon) dealer closest to (lat, lon) in straight-line distance; (None, 1e18) without dealers."""
+    best_name = None
+    best_dist = 1e18
+    for name, dlat, dlon in dealers:
+        dist = haversine_distance(dlat, dlon, lat, lon)
+        if dist < best_dist:
+            best_dist = dist
+            best_name = name
+    return best_name, best_dist
+
+def dealer_points() -> list:
+    """[(index, dealer, lat, lon)] for every DEALER_LOCATIONS entry with coordinates (built once)."""
+    global _DEALER_POINTS
+    if _DEALER_POINTS is None:
+        points = []
+        for idx, dealer in enumerate(DEALER_LOCATIONS):
+            if dealer.get("Latitude") is None or dealer.get("Longitude") is None:
+                continue
+            points.append((idx, dealer, float(dealer["Latitude"]), float(dealer["Longitude"])))
+        _DEALER_POINTS = points
+    return _DEALER_POINTS
+
+
 def _route_key(lat1: float, lon1: float, lat2: float, lon2: float) -> str:
-    return f"{lat1:.6f},{lon1:.6f}->{lat2:.6f},{lon2:.6f}"
+    return route_cache.route_key(lat1, lon1, lat2, lon2)
 
 
 def _load_route_cache() -> dict:
-    if not ROUTE_CACHE_PATH.exists():
-        return {}
     try:
-        raw = json.loads(ROUTE_CACHE_PATH.read_text(encoding="utf-8"))
-        return raw if isinstance(raw, dict) else {}
-    except Exception:
+        return route_cache.load_route_cache(ROUTE_CACHE_PATH)
+    except Exception as e:
+        print(f"WARNING: Failed to load route cache: {e}")
         return {}
 
 
 def _save_route_cache(cache: dict) -> None:
     try:
-        ROUTE_CACHE_PATH.write_text(json.dumps(cache, indent=2, ensure_ascii=False), encoding="utf-8")
+        route_cache.save_route_cache(cache)
     except Exception as e:
         print(f"WARNING: Failed to save route cache: {e}")
 
 
 def _osrm_route_metrics(lat1: float, lon1: float, lat2: float, lon2: float, cache: dict) -> Optional[dict]:
     key = _route_key(lat1, lon1, lat2, lon2)
-    if key in cache:
-        entry = cache[key] or {}
-        if entry.get("duration_s") is not None and entry.get("distance_m") is not None:
-            return entry
+    if route_cache.is_complete(cache.get(key)):
+        return cache[key]
 
-    coords = f"{lon1},{lat1};{lon2},{lat2}"
-    url = f"{OSRM_BASE_URL}/route/v1/driving/{coords}"
-    params = urllib.parse.urlencode({"overview": "false", "alternatives": "false"})
     try:
-        with urllib.request.urlopen(f"{url}?{params}", timeout=OSRM_ROUTE_TIMEOUT_S) as resp:
+        with span("osrm.route"), urllib.request.urlopen(_osrm_route_url(lat1, lon1, lat2, lon2), timeout=OSRM_ROUTE_TIMEOUT_S) as resp:
             payload = json.loads(resp.read().decode("utf-8"))
-        routes = payload.get("routes") or []
-        if not routes:
+        entry = _osrm_route_entry(payload)
+        if entry is None:
             return None
-        route = routes[0]
-        duration_s = float(route.get("duration"))
-        distance_m = float(route.get("distance"))
-        cache[key] = {"duration_s": duration_s, "distance_m": distance_m}
+        cache[key] = entry
         return cache[key]
     except Exception:
         return None
 
 
+def _osrm_route_url(lat1: float, lon1: float, lat2: float, lon2: float) -> str:
+    coords = f"{lon1},{lat1};{lon2},{lat2}"
+    params = urllib.parse.urlencode({"overview": "false", "alternatives": "false"})
+    return f"{OSRM_BASE_URL}/route/v1/driving/{coords}?{params}"
+
+
+def _osrm_route_entry(payload: dict) -> Optional[dict]:
+    """Route cache entry from an OSRM route response, or None when it has no route."""
+    routes = payload.get("routes") or []
+    if not routes:
+        return None
+    route = routes[0]
+    return route_cache.make_entry(float(route.get("duration")), float(route.get("distance")))
+
+
 def _osrm_table_metrics_one_to_many(
     src_lat: float,
     src_lon: float,
@@ -766,6 +886,14 @@ def _osrm_table_metrics_one_to_many(
     if not dests:
         return {}
 
+    with span("osrm.table", coords=len(dests) + 1), urllib.request.urlopen(
+        _osrm_table_url_one_to_many(src_lat, src_lon, dests), timeout=OSRM_TABLE_TIMEOUT_S
+    ) as resp:
+        payload = json.loads(resp.read().decode("utf-8"))
+    return _osrm_table_metrics_from_payload(payload, dests)
+
+
+def _osrm_table_url_one_to_many(src_lat: float, src_lon: float, dests: list) -> str:
     # coords: source first, then destinations
     coord_parts = [f"{src_lon},{src_lat}"] + [f"{lon},{lat}" for _, lat, lon in dests]
     coords = ";".join(coord_parts)
@@ -777,9 +905,11 @@ def _osrm_table_metrics_one_to_many(
             "annotations": "duration,distance",
         }
     )
-    url = f"{OSRM_BASE_URL}/table/v1/driving/{coords}?{params}"
-    with urllib.request.urlopen(url, timeout=OSRM_TABLE_TIMEOUT_S) as resp:
-        payload = json.loads(resp.read().decode("utf-8"))
+    return f"{OSRM_BASE_URL}/table/v1/driving/{coords}?{params}"
+
+
+def _osrm_table_metrics_from_payload(payload: dict, dests: list) -> Dict[int, dict]:
+    """{idx: {"duration_s", "distance_m"}} from a one-source OSRM table response (unroutable dests omitted)."""
     durations = (payload.get("durations") or [[]])[0]
     distances = (payload.get("distances") or [[]])[0]
     out = {}
@@ -792,6 +922,70 @@ def _osrm_table_metrics_one_to_many(
     return out
 
 
+def _osrm_table_metrics_many_to_many(
+    sources: list,
+    dests: list,
+    timeout_s: float = OSRM_TABLE_TIMEOUT_S,
+) -> Dict[tuple, dict]:
+    """
+    Fetch drive duration/distance for every source x destination pair in one OSRM table call.
+    sources/dests: lists of tuples (idx, lat, lon); len(sources) + len(dests) must stay <= OSRM_TABLE_MAX_COORDS.
+    Returns: {(src_idx, dest_idx): {"duration_s": float, "distance_m": float}} (unroutable pairs omitted)
+    """
+    if not sources or not dests:
+        return {}
+
+    coord_parts = [f"{lon},{lat}" for _, lat, lon in sources] + [f"{lon},{lat}" for _, lat, lon in dests]
+    coords = ";".join(coord_parts)
+    params = urllib.parse.urlencode(
+        {
+            "sources": ";".join(str(i) for i in range(len(sources))),
+            "destinations": ";".join(str(i) for i in range(len(sources), len(coord_parts))),
+            "annotations": "duration,distance",
+        }
+    )
+    url = f"{OSRM_BASE_URL}/table/v1/driving/{coords}?{params}"
+    with span("osrm.table", coords=len(coord_parts)), urllib.request.urlopen(url, timeout=timeout_s) as resp:
+        payload = json.loads(resp.read().decode("utf-8"))
+    durations = payload.get("durations") or []
+    distances = payload.get("distances") or []
+    out = {}
+    for si, (s_idx, _, _) in enumerate(sources):
+        dur_row = durations[si] if si < len(durations) else []
+        dist_row = distances[si] if si < len(distances) else []
+        for di, (d_idx, _, _) in enumerate(dests):
+            dur = dur_row[di] if di < len(dur_row) else None
+            dist = dist_row[di] if di < len(dist_row) else None
+            if dur is None or dist is None:
+                continue
+            out[(s_idx, d_idx)] = {"duration_s": float(dur), "distance_m": float(dist)}
+    return out
+
+
+def _matrix_chunks(
+    wanted: Dict[Tuple[float, float], set],
+    max_coords: int = OSRM_TABLE_MAX_COORDS,
+) -> List[Tuple[List[Tuple[float, float]], List[Tuple[float, float]]]]:
+    """
+    Group source coordinates (leads/customers) with the dealers they need (destinations)
+    into table requests of at most max_coords coordinates. Sources are taken in lat/lon
+    order, so neighbouring sources share most of their candidate dealers.
+    """
+    chunks = []
+    srcs: List[Tuple[float, float]] = []
+    dests: set = set()
+    for src in sorted(wanted):
+        need = wanted[src]
+        if srcs and len(srcs) + 1 + len(dests | need) > max_coords:
+            chunks.append((srcs, sorted(dests)))
+            srcs, dests = [], set()
+        srcs.append(src)
+        dests |= need
+    if srcs:
+        chunks.append((srcs, sorted(dests)))
+    return chunks
+
+
 def _norm_key(s: str) -> str:
     return re.sub(r"\s+", " ", (s or "").strip()).casefold()
 
@@ -834,44 +1028,59 @@ def _match_dealer_option_value_by_location(selection_options: list, dealer_locat
     return None
 
 
-def _jsonrpc_call(service: str, method: str, *args):
+def _jsonrpc_post(service: str, method: str, *args):
+    """One /jsonrpc call; returns (result, request bytes, response bytes)."""
     payload = {
         "jsonrpc": "2.0",
         "method": "call",
         "params": {"service": service, "method": method, "args": list(args)},
         "id": 1,
     }
+    body = json.dumps(payload).encode("utf-8")
     req = urllib.request.Request(
         f"{ODOO_URL.rstrip('/')}/jsonrpc",
-        data=json.dumps(payload).encode("utf-8"),
+        data=body,
         headers={"Content-Type": "application/json"},
     )
-    with urllib.request.urlopen(req, timeout=30) as resp:
-        data = json.loads(resp.read().decode("utf-8"))
+    with urllib.request.urlopen(req, timeout=odoo_rpc.ODOO_RPC_TIMEOUT_S) as resp:
+        raw = resp.read()
+    data = json.loads(raw.decode("utf-8"))
     if data.get("error"):
         raise RuntimeError(data["error"])
-    return data["result"]
+    return data["result"], len(body), len(raw)
 
 
-def _jsonrpc_execute_kw(model: str, method: str, args: list, kwargs: Optional[dict] = None):
+def _jsonrpc_call(service: str, method: str, *args):
+    return _jsonrpc_post(service, method, *args)[0]
+
+
+def _jsonrpc_uid() -> int:
+    """JSON-RPC login, once per process."""
+    global _JSONRPC_UID
+    if _JSONRPC_UID is None:
+        with _ODOO_AUTH_LOCK:
+            if _JSONRPC_UID is None:
+                uid = _jsonrpc_call("common", "login", ODOO_DB, ODOO_USERNAME, ODOO_PASSWORD)
+                if not uid:
+                    raise RuntimeError("JSON-RPC authentication failed.")
+                _JSONRPC_UID = uid
+    return _JSONRPC_UID
+
+
+def _jsonrpc_execute_kw(model: str, method: str, args: list, kwargs: Optional[dict] = None, idempotent: bool = False):
     if kwargs is None:
         kwargs = {}
-    uid = _jsonrpc_call("common", "login", ODOO_DB, ODOO_USERNAME, ODOO_PASSWORD)
-    if not uid:
-        raise RuntimeError("JSON-RPC authentication failed.")
-    return _jsonrpc_call(
-        "object",
-        "execute_kw",
-        ODOO_DB,
-        uid,
-        ODOO_PASSWORD,
+    uid = _jsonrpc_uid()
+    return odoo_rpc.execute(
         model,
         method,
-        args,
-        kwargs,
+        lambda: _jsonrpc_post("object", "execute_kw", ODOO_DB, uid, ODOO_PASSWORD, model, method, args, kwargs),
+        idempotent=idempotent,
+        transport="jsonrpc",
     )
 
 
+@traced()
 def find_closest_dealer(customer_lat, customer_lon, max_drive_hours: float = MAX_DEALER_DRIVE_HOURS):
     """
     Find the closest dealer by DRIVING distance, but only among dealers within max_drive_hours.
@@ -883,59 +1092,15 @@ def find_closest_dealer(customer_lat, customer_lon, max_drive_hours: float = MAX
         print("No dealer locations defined.")
         return None
 
-    max_duration_s = max_drive_hours * 3600.0
     cache = _load_route_cache()
     cache_dirty = False
-    candidates = []
-    print(
-        f"DEBUG dealer: start lookup lat={customer_lat}, lon={customer_lon}, "
-        f"max_hours={max_drive_hours}",
-        flush=True,
-    )
-
-    direct_rows = []
-    for idx, dealer in enumerate(DEALER_LOCATIONS):
-        dealer_lat = dealer.get("Latitude")
-        dealer_lon = dealer.get("Longitude")
-        if dealer_lat is None or dealer_lon is None:
-            continue
-        direct_km = haversine_distance(
-            float(customer_lat), float(customer_lon), float(dealer_lat), float(dealer_lon)
-        )
-        direct_rows.append((direct_km, idx, dealer, float(dealer_lat), float(dealer_lon)))
-
+    direct_rows, all_rows, missing = _dealer_route_candidates(customer_lat, customer_lon, max_drive_hours, cache)
     if not direct_rows:
-        print("No dealers with coordinates available.", flush=True)
         return None
 
-    # Pre-filter candidates by direct distance so first-lookups are fast.
-    # We still use routing for final winner among this subset.
-    direct_rows.sort(key=lambda row: row[0])
-    radius_km = (max_drive_hours * DIRECT_DISTANCE_RADIUS_PER_HOUR_KM) + DIRECT_DISTANCE_BUFFER_KM
-    subset = [row for row in direct_rows if row[0] <= radius_km]
-    if len(subset) < MAX_ROUTE_CANDIDATES:
-        subset = direct_rows[:MAX_ROUTE_CANDIDATES]
-    elif len(subset) > MAX_ROUTE_CANDIDATES:
-        subset = subset[:MAX_ROUTE_CANDIDATES]
-
-    missing = []
-    all_rows = []
-    for _direct_km, idx, dealer, dealer_lat, dealer_lon in subset:
-        key = _route_key(float(customer_lat), float(customer_lon), float(dealer_lat), float(dealer_lon))
-        entry = cache.get(key)
-        if entry and entry.get("duration_s") is not None and entry.get("distance_m") is not None:
-            all_rows.append((idx, dealer, key, float(entry["duration_s"]), float(entry["distance_m"])))
-        else:
-            missing.append((idx, dealer, key, dealer_lat, dealer_lon))
-    print(
-        f"DEBUG dealer: candidates={len(subset)} routes_cached={len(all_rows)} uncached={len(missing)}",
-        flush=True,
-    )
-
     # Batch request uncached routes to avoid N requests per lead.
-    BATCH = 40
-    for i in range(0, len(missing), BATCH):
-        chunk = missing[i:i + BATCH]
+    for i in range(0, len(missing), OSRM_TABLE_BATCH):
+        chunk = missing[i:i + OSRM_TABLE_BATCH]
         dests = [(idx, lat, lon) for idx, _, _, lat, lon in chunk]
         try:
             metrics_by_idx = _osrm_table_metrics_one_to_many(float(customer_lat), float(customer_lon), dests)
@@ -948,9 +1113,8 @@ def find_closest_dealer(customer_lat, customer_lon, max_drive_hours: float = MAX
 
             # Retry table in smaller chunks. Some servers reject/timeout larger matrices.
             if len(chunk) > 1:
-                SMALL_BATCH = 10
-                for j in range(0, len(chunk), SMALL_BATCH):
-                    small_chunk = chunk[j:j + SMALL_BATCH]
+                for j in range(0, len(chunk), OSRM_TABLE_SMALL_BATCH):
+                    small_chunk = chunk[j:j + OSRM_TABLE_SMALL_BATCH]
                     small_dests = [(idx, lat, lon) for idx, _, _, lat, lon in small_chunk]
                     try:
                         small_metrics = _osrm_table_metrics_one_to_many(
@@ -986,7 +1150,7 @@ def find_closest_dealer(customer_lat, customer_lon, max_drive_hours: float = MAX
             m = metrics_by_idx.get(idx)
             if not m:
                 continue
-            cache[key] = {"duration_s": m["duration_s"], "distance_m": m["distance_m"]}
+            cache[key] = route_cache.make_entry(m["duration_s"], m["distance_m"])
             cache_dirty = True
             all_rows.append((idx, dealer, key, float(m["duration_s"]), float(m["distance_m"])))
     print(
@@ -994,13 +1158,70 @@ def find_closest_dealer(customer_lat, customer_lon, max_drive_hours: float = MAX
         flush=True,
     )
 
+    if cache_dirty:
+        _save_route_cache(cache)
+    return _pick_closest_dealer(customer_lat, customer_lon, max_drive_hours, direct_rows, all_rows)
+
+
+def _dealer_route_candidates(customer_lat, customer_lon, max_drive_hours: float, cache):
+    """
+    First half of find_closest_dealer (shared with the async server): direct-distance
+    pre-filter, then split the subset into cached routes and routes still to fetch.
+    Returns (direct_rows, all_rows, missing); direct_rows is empty when no dealer has coordinates.
+    """
+    print(
+        f"DEBUG dealer: start lookup lat={customer_lat}, lon={customer_lon}, "
+        f"max_hours={max_drive_hours}",
+        flush=True,
+    )
+
+    direct_rows = []
+    for idx, dealer, dealer_lat, dealer_lon in dealer_points():
+        direct_km = haversine_distance(
+            float(customer_lat), float(customer_lon), dealer_lat, dealer_lon
+        )
+        direct_rows.append((direct_km, idx, dealer, float(dealer_lat), float(dealer_lon)))
+
+    if not direct_rows:
+        print("No dealers with coordinates available.", flush=True)
+        return [], [], []
+
+    # Pre-filter candidates by direct distance so first-lookups are fast.
+    # We still use routing for final winner among this subset.
+    direct_rows.sort(key=lambda row: row[0])
+    radius_km = (max_drive_hours * DIRECT_DISTANCE_RADIUS_PER_HOUR_KM) + DIRECT_DISTANCE_BUFFER_KM
+    subset = [row for row in direct_rows if row[0] <= radius_km]
+    if len(subset) < MAX_ROUTE_CANDIDATES:
+        subset = direct_rows[:MAX_ROUTE_CANDIDATES]
+    elif len(subset) > MAX_ROUTE_CANDIDATES:
+        subset = subset[:MAX_ROUTE_CANDIDATES]
+
+    missing = []
+    all_rows = []
+    for _direct_km, idx, dealer, dealer_lat, dealer_lon in subset:
+        key = _route_key(float(customer_lat), float(customer_lon), float(dealer_lat), float(dealer_lon))
+        entry = cache.get(key)
+        if route_cache.is_complete(entry):
+            all_rows.append((idx, dealer, key, float(entry["duration_s"]), float(entry["distance_m"])))
+        else:
+            missing.append((idx, dealer, key, dealer_lat, dealer_lon))
+    metrics.inc("route_cache_total", len(all_rows), result="hit")
+    metrics.inc("route_cache_total", len(missing), result="miss")
+    print(
+        f"DEBUG dealer: candidates={len(subset)} routes_cached={len(all_rows)} uncached={len(missing)}",
+        flush=True,
+    )
+    return direct_rows, all_rows, missing
+
+
+def _pick_closest_dealer(customer_lat, customer_lon, max_drive_hours: float, direct_rows: list, all_rows: list):
+    """Second half of find_closest_dealer: shortest drive within max_drive_hours, else the direct-distance fallback."""
+    max_duration_s = max_drive_hours * 3600.0
+    candidates = []
     for _idx, dealer, _key, duration_s, distance_m in all_rows:
         if duration_s <= max_duration_s:
             candidates.append((distance_m, duration_s, dealer))
 
-    if cache_dirty:
-        _save_route_cache(cache)
-
     if not candidates:
         if not all_rows and direct_rows:
             fallback_max_km = max_drive_hours * DIRECT_DISTANCE_FALLBACK_KMH
@@ -1010,6 +1231,7 @@ def find_closest_dealer(customer_lat, customer_lon, max_drive_hours: float = MAX
                 result["Distance_km"] = round(direct_km, 2)
                 result["Drive_time_hr"] = round(direct_km / DIRECT_DISTANCE_FALLBACK_KMH, 2)
                 result["route_mode"] = "distance_fallback"
+                metrics.inc("dealer_lookups_total", mode="distance_fallback")
                 print(
                     f"WARNING dealer: OSRM unavailable; using direct-distance fallback "
                     f"selected='{result.get('Location')}' distance_km={result['Distance_km']} "
@@ -1027,9 +1249,11 @@ def find_closest_dealer(customer_lat, customer_lon, max_drive_hours: float = MAX
             f"INFO: No dealer found within {max_drive_hours:.1f}h driving "
             f"for ({customer_lat}, {customer_lon})."
         )
+        metrics.inc("dealer_lookups_total", mode="none")
         return None
 
     candidates.sort(key=lambda row: (row[0], row[1]))
+    metrics.inc("dealer_lookups_total", mode="osrm")
     distance_m, duration_s, dealer = candidates[0]
     result = dict(dealer)
     result["Distance_km"] = round(distance_m / 1000.0, 2)
@@ -1042,58 +1266,301 @@ def find_closest_dealer(customer_lat, customer_lon, max_drive_hours: float = MAX
     return result
 
 
-def set_dealer_property_on_lead(models, uid, lead_id: int, dealer_location: str, property_label: str = "Dealer") -> bool:
+@traced()
+def find_closest_dealers(points, max_drive_hours: float = MAX_DEALER_DRIVE_HOURS) -> Dict[Tuple[float, float], Optional[dict]]:
     """
-    Set only the Dealer property value on crm.lead.lead_properties.
-    Does not modify any other lead fields.
+    find_closest_dealer() for many (lat, lon) points in one pass: the uncached routes of all
+    points are fetched together with many-to-many OSRM table requests instead of per point.
+    A point whose table request fails is picked from its cached routes, or by the
+    direct-distance fallback when it has none (no per-pair retries, so the cost stays bounded).
+    Returns {(lat, lon): dealer dict or None}.
     """
+    points = [(float(lat), float(lon)) for lat, lon in dict.fromkeys(points)]
+    if not DEALER_LOCATIONS:
+        print("No dealer locations defined.")
+        return {p: None for p in points}
+
+    cache = _load_route_cache()
+    plans = {}
+    wanted: Dict[Tuple[float, float], set] = {}
+    for lat, lon in points:
+        plans[(lat, lon)] = _dealer_route_candidates(lat, lon, max_drive_hours, cache)
+        for _idx, _dealer, _key, dlat, dlon in plans[(lat, lon)][2]:
+            wanted.setdefault((lat, lon), set()).add((float(dlat), float(dlon)))
+
+    fetched = {}
+    chunks = _matrix_chunks(wanted)
+    if chunks:
+        n_pairs = sum(len(v) for v in wanted.values())
+        print(f"DEBUG dealer: batch routing {n_pairs} pairs with {len(chunks)} OSRM table request(s)", flush=True)
+    for srcs, dests in chunks:
+        try:
+            table = _osrm_table_metrics_many_to_many(
+                [(i, lat, lon) for i, (lat, lon) in enumerate(srcs)],
+                [(j, lat, lon) for j, (lat, lon) in enumerate(dests)],
+            )
+        except Exception as e:
+            print(f"WARNING dealer: OSRM table request failed ({len(srcs)}x{len(dests)}). error={e}", flush=True)
+            continue
+        dest_idx = {d: j for j, d in enumerate(dests)}
+        for i, src in enumerate(srcs):
+            for dest in wanted[src]:
+                m = table.get((i, dest_idx[dest]))
+                if m is not None:
+                    key = _route_key(src[0], src[1], dest[0], dest[1])
+                    fetched[key] = cache[key] = route_cache.make_entry(m["duration_s"], m["distance_m"])
+    if fetched:
+        _save_route_cache(cache)
+
+    out = {}
+    for (lat, lon), (direct_rows, all_rows, missing) in plans.items():
+        if not direct_rows:
+            out[(lat, lon)] = None
+            continue
+        for idx, dealer, key, _dlat, _dlon in missing:
+            entry = fetched.get(key)
+            if entry is not None:
+                all_rows.append((idx, dealer, key, float(entry["duration_s"]), float(entry["distance_m"])))
+        out[(lat, lon)] = _pick_closest_dealer(lat, lon, max_drive_hours, direct_rows, all_rows)
+    return out
+
+
+def _get_lead_property_definition(
+    property_label: str = "Dealer",
+    property_type: str = "selection",
+    refresh: bool = False,
+) -> Optional[dict]:
+    """
+    Return the crm.team lead property definition matching property_label, cached per process
+    for LEAD_PROPERTY_DEFINITION_TTL_S (refresh=True refetches now).
+    The returned dict is the Odoo definition plus the owning "team_id".
+    """
+    cache_key = (ODOO_DB, _norm_key(property_label), property_type)
+    cached = _LEAD_PROPERTY_DEFINITION_CACHE.get(cache_key)
+    if cached and not refresh and time.monotonic() - cached[0] < LEAD_PROPERTY_DEFINITION_TTL_S:
+        return cached[1]
+
     try:
-        # Use JSON-RPC for properties payloads; XML-RPC can fail if None is nested in lead_properties.
-        print(
-            f"DEBUG dealer_property: lead_id={lead_id} target_dealer='{dealer_location}'",
-            flush=True,
+        # JSON-RPC for the same reason as lead_properties: definitions can carry nested None.
+        teams = _jsonrpc_execute_kw(
+            "crm.team",
+            "search_read",
+            [[]],
+            {"fields": ["id", "lead_properties_definition"], "order": "id asc"},
         )
-        rows = _jsonrpc_execute_kw(
-            "crm.lead",
-            "read",
-            [[int(lead_id)]],
-            {"fields": ["lead_properties"]},
-        )
-        if not rows:
-            return False
-        props = rows[0].get("lead_properties") or []
+    except Exception as e:
+        print(f"WARNING: Could not read lead property definitions: {e}", flush=True)
+        return cached[1] if cached else None
 
-        changed = False
-        for item in props:
-            if not isinstance(item, dict):
+    definition = None
+    for team in teams or []:
+        for item in team.get("lead_properties_definition") or []:
+            if not isinstance(item, dict) or not item.get("name"):
                 continue
-            if item.get("type") != "selection":
+            if item.get("type") != property_type:
                 continue
             if _norm_key(item.get("string") or "") != _norm_key(property_label):
                 continue
-            opt_value = _match_dealer_option_value_by_location(item.get("selection") or [], dealer_location)
-            if not opt_value:
-                print(f"WARNING: Could not map dealer '{dealer_location}' to a Dealer property option.")
-                return False
-            print(
-                f"DEBUG dealer_property: mapped dealer='{dealer_location}' -> option_value='{opt_value}'",
-                flush=True,
-            )
-            if str(item.get("value") or "") == str(opt_value):
-                print("DEBUG dealer_property: already set; no write required.", flush=True)
-                return True
-            item["value"] = str(opt_value)
-            changed = True
+            definition = dict(item)
+            definition["team_id"] = team.get("id")
+            break
+        if definition:
             break
 
-        if not changed:
-            print(f"WARNING: Dealer property '{property_label}' not found on lead {lead_id}.")
+    _LEAD_PROPERTY_DEFINITION_CACHE[cache_key] = (time.monotonic(), definition)
+    return definition
+
+
+def lead_create_team():
+    """
+    The team Odoo put the newest lead created by this API user on (crm.lead team_id value), i.e. the
+    team a create without team_id will get; cached for LEAD_PROPERTY_DEFINITION_TTL_S.
+    None when no such lead exists or it cannot be read.
+    """
+    cached = _LEAD_CREATE_TEAM_CACHE.get(ODOO_DB)
+    if cached and time.monotonic() - cached[0] < LEAD_PROPERTY_DEFINITION_TTL_S:
+        return cached[1]
+    try:
+        rows = _jsonrpc_execute_kw(
+            "crm.lead",
+            "search_read",
+            [[("create_uid", "=", _jsonrpc_uid())]],
+            {"fields": ["team_id"], "order": "id desc", "limit": 1, "context": {"active_test": False}},
+        )
+    except Exception as e:
+        print(f"WARNING: Could not read the team of the newest lead: {e}", flush=True)
+        return cached[1] if cached else None
+    if not rows:
+        return None  # nothing to learn from until the first lead is created
+    _LEAD_CREATE_TEAM_CACHE[ODOO_DB] = (time.monotonic(), rows[0].get("team_id"))
+    return rows[0].get("team_id")
+
+
+def warm_odoo_session() -> bool:
+    """
+    Authenticate (XML-RPC and JSON-RPC) and load the reference data webhook requests look up:
+    model fields, the Dealer property definition and new-lead team, crm.lead model ID, country and
+    state IDs.
+    Returns False when Odoo is unreachable; the lookups then happen lazily as before.
+    """
+    uid, models = connect_odoo()
+    if not uid:
+        return False
+    try:
+        _jsonrpc_uid()
+        for model_name in ("res.partner", "crm.lead"):
+            _get_model_field_names(models, uid, model_name)
+        get_model_id(models, uid, "crm.lead")
+        _get_lead_property_definition("Dealer")
+        lead_create_team()
+
+        country_names = sorted({c for c in STATE_TO_COUNTRY_MAP.values() if isinstance(c, str)})
+        countries = models.execute_kw(ODOO_DB, uid, ODOO_PASSWORD,
+            'res.country', 'search_read',
+            [[('name', 'in', country_names)]], {'fields': ['id', 'name']})
+        for c in countries or []:
+            _COUNTRY_ID_CACHE[(ODOO_DB, c['name'])] = c['id']
+        country_ids = [c['id'] for c in countries or []]
+        if country_ids:
+            states = models.execute_kw(ODOO_DB, uid, ODOO_PASSWORD,
+                'res.country.state', 'search_read',
+                [[('country_id', 'in', country_ids)]], {'fields': ['id', 'code', 'country_id']})
+            for st in states or []:
+                code = str(st.get('code') or '').strip().upper()
+                country = st.get('country_id')
+                if code and country:
+                    _STATE_ID_CACHE.setdefault((ODOO_DB, code, country[0]), st['id'])
+    except Exception as e:
+        print(f"WARNING: Odoo reference data warm-up incomplete: {e}", flush=True)
+    return True
+
+
+def _lead_on_definition_team(definition: Optional[dict], lead_team) -> bool:
+    """True when lead_team (a crm.lead team_id value: [id, name], id or False) owns definition."""
+    if isinstance(lead_team, (list, tuple)):
+        lead_team = lead_team[0] if lead_team else False
+    return bool(definition and lead_team and definition.get("team_id") == lead_team)
+
+
+def build_dealer_property_vals(dealer_location: str, lead_team, property_label: str = "Dealer") -> Optional[dict]:
+    """
+    Build crm.lead write vals that set only the Dealer property, for inclusion in a write payload.
+    Properties are sent as {property_name: value}, so other property values are left untouched.
+    lead_team is the lead's team_id: the property name belongs to the team the definition was
+    read from, and Odoo silently drops it on a lead of another team, so None is returned then.
+    Returns None as well when the property definition or dealer option cannot be resolved.
+    """
+    definition = _get_lead_property_definition(property_label)
+    opt_value = _match_dealer_option_value_by_location((definition or {}).get("selection") or [], dealer_location)
+    miss_key = (ODOO_DB, _norm_key(property_label), _norm_key(dealer_location))
+    missed_at = _DEALER_OPTION_MISS_CACHE.get(miss_key)
+    if not opt_value and not (missed_at and time.monotonic() - missed_at < LEAD_PROPERTY_DEFINITION_TTL_S):
+        # The option (or the property) may have been added in Odoo since the definition was cached;
+        # refetch once per location and TTL.
+        definition = _get_lead_property_definition(property_label, refresh=True)
+        opt_value = _match_dealer_option_value_by_location((definition or {}).get("selection") or [], dealer_location)
+        if opt_value:
+            _DEALER_OPTION_MISS_CACHE.pop(miss_key, None)
+        else:
+            _DEALER_OPTION_MISS_CACHE[miss_key] = time.monotonic()
+    if not _lead_on_definition_team(definition, lead_team):
+        return None
+    if not opt_value:
+        print(f"WARNING: Could not map dealer '{dealer_location}' to a Dealer property option.")
+        return None
+    print(
+        f"DEBUG dealer_property: mapped dealer='{dealer_location}' -> option_value='{opt_value}'",
+        flush=True,
+    )
+    return {"lead_properties": {definition["name"]: str(opt_value)}}
+
+
+def _set_dealer_property_read_modify_write(lead_id: int, dealer_location: str, property_label: str) -> bool:
+    """Legacy path: read the full lead_properties blob, change the Dealer value, write it back."""
+    rows = _jsonrpc_execute_kw(
+        "crm.lead",
+        "read",
+        [[int(lead_id)]],
+        {"fields": ["lead_properties"]},
+    )
+    if not rows:
+        return False
+    props = rows[0].get("lead_properties") or []
+
+    changed = False
+    for item in props:
+        if not isinstance(item, dict):
+            continue
+        if item.get("type") != "selection":
+            continue
+        if _norm_key(item.get("string") or "") != _norm_key(property_label):
+            continue
+        opt_value = _match_dealer_option_value_by_location(item.get("selection") or [], dealer_location)
+        if not opt_value:
+            print(f"WARNING: Could not map dealer '{dealer_location}' to a Dealer property option.")
+            return False
+        print(
+            f"DEBUG dealer_property: mapped dealer='{dealer_location}' -> option_value='{opt_value}'",
+            flush=True,
+        )
+        if str(item.get("value") or "") == str(opt_value):
+            print("DEBUG dealer_property: already set; no write required.", flush=True)
+            return True
+        item["value"] = str(opt_value)
+        changed = True
+        break
+
+    if not changed:
+        print(f"WARNING: Dealer property '{property_label}' not found on lead {lead_id}.")
+        return False
+
+    ok = _jsonrpc_execute_kw(
+        "crm.lead",
+        "write",
+        [[int(lead_id)], {"lead_properties": props}],
+    )
+    print(f"DEBUG dealer_property: write result={ok}", flush=True)
+    return bool(ok)
+
+
+@traced()
+def set_dealer_property_on_lead(
+    models,
+    uid,
+    lead_id: int,
+    dealer_location: str,
+    property_label: str = "Dealer",
+    lead_team=None,
+) -> bool:
+    """
+    Set only the Dealer property value on crm.lead.lead_properties.
+    Does not modify any other lead fields.
+
+    Sends only the Dealer value ({property_name: value}) using the cached property definition
+    when the lead is on the definition's team; otherwise (another team, or no definition found)
+    falls back to a read-modify-write of the lead's own lead_properties blob.
+    lead_team: the lead's team_id when the caller already has it (skips reading it).
+    """
+    try:
+        # Use JSON-RPC for properties payloads; XML-RPC can fail if None is nested in lead_properties.
+        print(
+            f"DEBUG dealer_property: lead_id={lead_id} target_dealer='{dealer_location}'",
+            flush=True,
+        )
+        definition = _get_lead_property_definition(property_label) or _get_lead_property_definition(property_label, refresh=True)
+        if definition and lead_team is None:
+            rows = _jsonrpc_execute_kw("crm.lead", "read", [[int(lead_id)]], {"fields": ["team_id"]})
+            lead_team = rows[0].get("team_id") if rows else None
+        if not _lead_on_definition_team(definition, lead_team):
+            return _set_dealer_property_read_modify_write(lead_id, dealer_location, property_label)
+        vals = build_dealer_property_vals(dealer_location, lead_team, property_label)
+        if not vals:
             return False
 
         ok = _jsonrpc_execute_kw(
             "crm.lead",
             "write",
-            [[int(lead_id)], {"lead_properties": props}],
+            [[int(lead_id)], vals],
         )
         print(f"DEBUG dealer_property: write result={ok}", flush=True)
         return bool(ok)
@@ -1428,6 +1895,7 @@ def create_odoo_opportunity(opportunity_data):
     """
     Creates a new opportunity in Odoo, ensuring proper country/state resolution.
     opportunity_data may include: name, partner_id, city, Prov/State, description, etc.
+    Returns the new ID; False when Odoo rejected the values (Fault), None on any other failure.
     """
     uid, models = connect_odoo()
     if not uid:
@@ -1498,7 +1966,7 @@ def create_odoo_opportunity(opportunity_data):
         print(
             f"🚨 Odoo RPC Error creating opportunity: Code={fault.faultCode}, Message={fault.faultString}"
         )
-        return None
+        return False
     except Exception as e:
         print("❌ Unexpected error creating opportunity in Odoo:", flush=True)
         traceback.print_exc()
@@ -1510,12 +1978,16 @@ def find_odoo_user_id(models, uid, user_name):
     """
     Finds the Odoo user ID by name.
     """
+    cache_key = (ODOO_DB, user_name)
+    if cache_key in _USER_ID_CACHE:
+        return _USER_ID_CACHE[cache_key]
     try:
         user = models.execute_kw(ODOO_DB, uid, ODOO_PASSWORD,
             'res.users', 'search_read',
             [[('name', '=', user_name)]], {'fields': ['id'], 'limit': 1})
         if user:
             print(f"DEBUG (connector): Found user '{user_name}' with ID: {user[0]['id']}")
+            _USER_ID_CACHE[cache_key] = user[0]['id']
             return user[0]['id']
         else:
             print(f"DEBUG (connector): User '{user_name}' not found in Odoo.")
@@ -1696,7 +2168,7 @@ def schedule_activity_for_lead(models, uid, lead_id, user_id, summary, note, dea
 def find_existing_opportunity(opportunity_name):
     """
     Finds an existing opportunity in Odoo by its name.
-    Returns a dictionary of the opportunity's info (id, name) or None.
+    Returns a dictionary of the opportunity's info (id, name, team_id, write_date) or None.
     Handles extra spaces, Unicode whitespace, trailing spaces, and case differences.
     Returns the closest match if no exact match is found.
     """
@@ -1726,7 +2198,7 @@ def find_existing_opportunity(opportunity_name):
             ODOO_DB, uid, ODOO_PASSWORD,
             'crm.lead', 'search_read',
             [domain],
-            {'fields': ['id', 'name']}
+            {'fields': ['id', 'name', 'team_id', 'write_date']}
         )
         
         closest_match = None
@@ -1759,6 +2231,27 @@ def find_existing_opportunity(opportunity_name):
 
 
 
+def lead_unmodified_since(lead_id: int, write_date) -> bool:
+    """
+    True when the lead's write_date is still <= write_date (as read earlier, e.g. by
+    find_existing_opportunity); True as well when write_date is empty. Best-effort optimistic
+    concurrency: it narrows the window for overwriting someone's edit but a write can still land
+    between this search and the caller's write. False when the check itself fails.
+    """
+    if not write_date:
+        return True
+    try:
+        return bool(_jsonrpc_execute_kw(
+            "crm.lead",
+            "search_count",
+            [[("id", "=", int(lead_id)), ("write_date", "<=", write_date)]],
+            {"context": {"active_test": False}},
+        ))
+    except Exception as e:
+        print(f"WARNING: Could not check write_date of lead {lead_id}: {e}", flush=True)
+        return False
+
+
 def update_odoo_opportunity(opportunity_id, opportunity_data):
     """
     Updates an existing opportunity in Odoo.
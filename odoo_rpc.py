@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+"""
+odoo_rpc.py
+
+One transport policy for every Odoo execute_kw (odoo_connector, the webhook servers, the scripts):
+
+- OdooModels: drop-in for the XML-RPC object proxy (models.execute_kw(db, uid, password,
+  model, method, args, kwargs)); server_proxy() for the other endpoints (authenticate).
+  Sockets get a timeout (ODOO_RPC_TIMEOUT_S, default 30).
+- execute(): the policy around one call, for any transport (odoo_connector's JSON-RPC calls
+  and one_time_assign_dealer_from_tabs use it directly):
+    * span "odoo.<model>.<method>" (tracing.py; latency histograms and /metrics),
+    * request/response bytes,
+    * reads (READ_METHODS) that fail in transport (connection refused/reset, 429/502/503/504)
+      are retried with exponential backoff (ODOO_RPC_READ_RETRIES, default 2). Writes are
+      not retried (a write whose response was lost may already have been applied) unless
+      the caller passes idempotent=True, e.g. setting a field to a fixed value.
+- rpc_budget(name, limit): counts the calls made inside it (calls, time, bytes, retries, per
+  model.method); with limit > 0 the call after the limit raises RPCBudgetExceeded. The webhook
+  servers open one per request and log report() with the request's trace line.
+  PROCESS_RPC is the running total for this process (scripts print summary() at exit).
+"""
+
+from __future__ import annotations
+
+import contextvars
+import http.client
+import os
+import threading
+import time
+import urllib.error
+import xmlrpc.client
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+import metrics
+from tracing import span
+
+ODOO_RPC_TIMEOUT_S = float(os.getenv("ODOO_RPC_TIMEOUT_S", "30"))
+ODOO_RPC_READ_RETRIES = int(os.getenv("ODOO_RPC_READ_RETRIES", "2"))
+ODOO_RPC_BACKOFF_S = 0.5  # 0.5 s, 1 s, 2 s, ...
+RETRY_HTTP_STATUSES = frozenset({429, 502, 503, 504})
+READ_METHODS = frozenset({
+    "search", "search_read", "search_count", "read", "read_group",
+    "fields_get", "name_search", "name_get", "default_get", "check_access_rights",
+})
+
+
+class RPCBudgetExceeded(RuntimeError):
+    pass
+
+
+class RPCBudget:
+    """Odoo RPC accounting for one request/job (thread-safe: pool threads may share it)."""
+
+    def __init__(self, name: str, limit: int = 0):
+        self.name = name
+        self.limit = limit
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.ms = 0.0
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.by_method: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def charge(self, call: str) -> None:
+        """Count one call about to be made; raises RPCBudgetExceeded past the limit."""
+        with self._lock:
+            if self.limit and self.calls >= self.limit:
+                raise RPCBudgetExceeded(f"Odoo RPC budget of {self.limit} calls used up by {self.name} (next: {call})")
+            self.calls += 1
+            self.by_method[call] = self.by_method.get(call, 0) + 1
+
+    def record(self, ms: float, bytes_out: int, bytes_in: int, retries: int, ok: bool) -> None:
+        with self._lock:
+            self.ms += ms
+            self.bytes_out += bytes_out
+            self.bytes_in += bytes_in
+            self.retries += retries
+            if not ok:
+                self.errors += 1
+
+    def report(self) -> dict:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "ms": round(self.ms, 1),
+                "bytes_out": self.bytes_out,
+                "bytes_in": self.bytes_in,
+                "retries": self.retries,
+                "errors": self.errors,
+                "by_method": dict(sorted(self.by_method.items(), key=lambda kv: -kv[1])),
+            }
+
+    def summary(self) -> str:
+        r = self.report()
+        top = ", ".join(f"{k} ×{n}" for k, n in list(r["by_method"].items())[:5])
+        return (
+            f"📊 Odoo RPC ({self.name}): {r['calls']} calls in {r['ms'] / 1000:.1f}s, "
+            f"{r['bytes_out'] / 1024:.0f} KB sent / {r['bytes_in'] / 1024:.0f} KB received, "
+            f"{r['retries']} retries, {r['errors']} errors" + (f" — {top}" if top else "")
+        )
+
+
+PROCESS_RPC = RPCBudget("process")
+_BUDGET: contextvars.ContextVar[Optional[RPCBudget]] = contextvars.ContextVar("wavcor_rpc_budget", default=None)
+
+
+@contextmanager
+def rpc_budget(name: str, limit: int = 0) -> Iterator[RPCBudget]:
+    """Account the Odoo calls made in this context (and work handed off with copy_context())."""
+    budget = RPCBudget(name, limit)
+    token = _BUDGET.set(budget)
+    try:
+        yield budget
+    finally:
+        _BUDGET.reset(token)
+
+
+def _retryable(e: BaseException) -> bool:
+    if isinstance(e, xmlrpc.client.Fault):
+        return False  # raised by Odoo itself; the same call fails the same way
+    if isinstance(e, xmlrpc.client.ProtocolError):
+        return e.errcode in RETRY_HTTP_STATUSES
+    if isinstance(e, urllib.error.HTTPError):
+        return e.code in RETRY_HTTP_STATUSES
+    if isinstance(e, TimeoutError) or isinstance(getattr(e, "reason", None), TimeoutError):
+        return False  # already waited the full timeout; retrying would multiply it
+    return isinstance(e, (OSError, http.client.HTTPException))
+
+
+def execute(
+    model: str,
+    method: str,
+    send: Callable[[], Tuple[Any, int, int]],
+    idempotent: bool = False,
+    **span_attrs,
+) -> Any:
+    """
+    Run one execute_kw under the policy above. send() makes the call and returns
+    (result, request bytes, response bytes); it is called again for a retried read
+    (or write, when idempotent=True: repeating it leaves the same result).
+    """
+    call = f"{model}.{method}"
+    budget = _BUDGET.get()
+    if budget is not None:
+        budget.charge(call)
+    PROCESS_RPC.charge(call)
+
+    attempts = 1 + (ODOO_RPC_READ_RETRIES if method in READ_METHODS or idempotent else 0)
+    bytes_out = bytes_in = retries = 0
+    ok = False
+    t0 = time.perf_counter()
+    try:
+        with span(f"odoo.{call}", **span_attrs):
+            for attempt in range(1, attempts + 1):
+                try:
+                    result, sent, received = send()
+                except Exception as e:
+                    if attempt == attempts or not _retryable(e):
+                        raise
+                    delay = ODOO_RPC_BACKOFF_S * 2 ** (attempt - 1)
+                    print(f"WARNING odoo rpc: {call} failed ({e}); retry {attempt}/{attempts - 1} in {delay:.1f}s", flush=True)
+                    retries += 1
+                    time.sleep(delay)
+                    continue
+                bytes_out, bytes_in, ok = sent, received, True
+                return result
+    finally:
+        ms = (time.perf_counter() - t0) * 1000.0
+        for b in (budget, PROCESS_RPC):
+            if b is not None:
+                b.record(ms, bytes_out, bytes_in, retries, ok)
+        metrics.inc("odoo_rpc_bytes_total", bytes_out, direction="sent")
+        metrics.inc("odoo_rpc_bytes_total", bytes_in, direction="received")
+        if retries:
+            metrics.inc("odoo_rpc_retries_total", retries, model=model, method=method)
+
+
+# --------------------------------------------------------------------
+# XML-RPC transport
+# --------------------------------------------------------------------
+class _CountingResponse:
+    def __init__(self, response):
+        self._response = response
+        self.nbytes = 0
+
+    def read(self, *args):
+        data = self._response.read(*args)
+        self.nbytes += len(data)
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+
+class _MeteredTransportMixin:
+    """Socket timeout + size of the last request/response (one transport per proxy, per thread)."""
+
+    def __init__(self, *args, timeout: float = ODOO_RPC_TIMEOUT_S, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.timeout = timeout
+        self.last_sent = 0
+        self.last_received = 0
+
+    def make_connection(self, host):
+        conn = super().make_connection(host)
+        conn.timeout = self.timeout
+        return conn
+
+    def send_content(self, connection, request_body):
+        self.last_sent = len(request_body)
+        super().send_content(connection, request_body)
+
+    def parse_response(self, response):
+        counted = _CountingResponse(response)
+        try:
+            return super().parse_response(counted)
+        finally:
+            self.last_received = counted.nbytes
+
+
+class _MeteredTransport(_MeteredTransportMixin, xmlrpc.client.Transport):
+    pass
+
+
+class _MeteredSafeTransport(_MeteredTransportMixin, xmlrpc.client.SafeTransport):
+    pass
+
+
+def _transport(url: str, timeout: float, use_datetime: bool):
+    cls = _MeteredSafeTransport if url.lower().startswith("https") else _MeteredTransport
+    return cls(timeout=timeout, use_datetime=use_datetime)
+
+
+def server_proxy(url: str, timeout: float = ODOO_RPC_TIMEOUT_S, use_datetime: bool = False) -> xmlrpc.client.ServerProxy:
+    """xmlrpc.client.ServerProxy with a socket timeout."""
+    return xmlrpc.client.ServerProxy(url, transport=_transport(url, timeout, use_datetime), allow_none=True)
+
+
+class OdooModels:
+    """
+    /xmlrpc/2/object proxy whose execute_kw goes through execute(). Not thread-safe
+    (neither is ServerProxy): give each thread its own.
+    """
+
+    def __init__(self, base_url: str, timeout: float = ODOO_RPC_TIMEOUT_S, use_datetime: bool = False):
+        url = f"{base_url.rstrip('/')}/xmlrpc/2/object"
+        self._transport = _transport(url, timeout, use_datetime)
+        self._proxy = xmlrpc.client.ServerProxy(url, transport=self._transport, allow_none=True)
+
+    def execute_kw(self, db, uid, password, model, method, *args, **kwargs):
+        def send():
+            result = self._proxy.execute_kw(db, uid, password, model, method, *args, **kwargs)
+            return result, self._transport.last_sent, self._transport.last_received
+
+        return execute(model, method, send)
+
+    def __getattr__(self, name):
+        return getattr(self._proxy, name)
+
+
+metrics.describe("odoo_rpc_bytes_total", "Odoo RPC payload bytes (sent/received).")
+metrics.describe("odoo_rpc_retries_total", "Odoo read calls retried after a transport error.")
@@ -1,23 +1,37 @@
 #!/usr/bin/env python3
-"""One-time tool: assign Dealer property on CRM leads from Excel tabs (excluding first tab)."""
+"""One-time tool: assign Dealer property on CRM leads from Excel tabs (excluding first tab).
+
+--apply writes only the Dealer value ({property: value}), so leads getting the same dealer share
+one multi-id write (--write-batch ids per call, --workers calls in flight, transport errors retried
+with backoff). Written leads are recorded in --progress after every call; a re-run of the same
+workbook skips them, and the file is removed once every write succeeded.
+"""
 
 import argparse
+import hashlib
 import json
 import os
 import re
 import sys
 import urllib.request
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dataclasses import dataclass
 from typing import Dict, List, Optional, Tuple
 
 from openpyxl import Workbook, load_workbook
 
+import odoo_rpc
+from cache_store import atomic_write_json, read_json
+
 GENERIC_TOKENS = {
     "agro", "centre", "center", "home", "farm", "supply", "hardware",
     "coop", "co", "op", "cooperative", "and", "gas", "bar", "bulk",
     "petroleum", "cardlock", "food", "store",
 }
+DEFAULT_PROGRESS_PATH = "assign_dealer_progress.json"
+DEFAULT_WRITE_BATCH = 200
+DEFAULT_WORKERS = 4
 
 
 def _normalize_text(value: Optional[str]) -> str:
@@ -95,37 +109,39 @@ class JsonRpcClient:
         if not self.uid:
             raise RuntimeError("Authentication failed.")
 
-    def _call(self, service: str, method: str, *args):
+    def _post(self, service: str, method: str, *args):
+        """One /jsonrpc call; returns (result, request bytes, response bytes)."""
         payload = {
             "jsonrpc": "2.0",
             "method": "call",
             "params": {"service": service, "method": method, "args": list(args)},
             "id": 1,
         }
+        body = json.dumps(payload).encode()
         request = urllib.request.Request(
             self.url,
-            data=json.dumps(payload).encode(),
+            data=body,
             headers={"Content-Type": "application/json"},
         )
         with urllib.request.urlopen(request, timeout=60) as response:
-            data = json.loads(response.read().decode())
+            raw = response.read()
+        data = json.loads(raw.decode())
         if data.get("error"):
             raise RuntimeError(data["error"])
-        return data["result"]
+        return data["result"], len(body), len(raw)
+
+    def _call(self, service: str, method: str, *args):
+        return self._post(service, method, *args)[0]
 
-    def execute_kw(self, model: str, method: str, args: list, kwargs: Optional[dict] = None):
+    def execute_kw(self, model: str, method: str, args: list, kwargs: Optional[dict] = None, idempotent: bool = False):
         if kwargs is None:
             kwargs = {}
-        return self._call(
-            "object",
-            "execute_kw",
-            self.db,
-            self.uid,
-            self.password,
+        return odoo_rpc.execute(
             model,
             method,
-            args,
-            kwargs,
+            lambda: self._post("object", "execute_kw", self.db, self.uid, self.password, model, method, args, kwargs),
+            idempotent=idempotent,
+            transport="jsonrpc",
         )
 
 
@@ -172,13 +188,15 @@ def read_rows_from_tabs(excel_path: str) -> List[RowItem]:
         if sheet_idx == 0:
             continue  # ignore first tab
         ws = wb[sheet_name]
-        for r in range(2, ws.max_row + 1):
-            dealer = _normalize_text(ws.cell(row=r, column=1).value)
-            name = _normalize_text(ws.cell(row=r, column=3).value)
-            phone = _norm_phone(ws.cell(row=r, column=4).value)
-            mobile = _norm_phone(ws.cell(row=r, column=5).value)
-            city = _normalize_text(ws.cell(row=r, column=6).value)
-            email = _normalize_text(ws.cell(row=r, column=8).value).lower()
+        # One streaming pass: ws.cell() on a read-only sheet re-parses the sheet up to that row.
+        for r, values in enumerate(ws.iter_rows(min_row=2, max_col=8, values_only=True), start=2):
+            values = tuple(values) + (None,) * (8 - len(values))
+            dealer = _normalize_text(values[0])
+            name = _normalize_text(values[2])
+            phone = _norm_phone(values[3])
+            mobile = _norm_phone(values[4])
+            city = _normalize_text(values[5])
+            email = _normalize_text(values[7]).lower()
             if not any([dealer, name, phone, mobile, email]):
                 continue
             rows.append(
@@ -369,7 +387,8 @@ def build_updates(
     rpc: JsonRpcClient,
     matched: Dict[int, str],
     property_label: str,
-) -> Tuple[List[Tuple[int, list]], int]:
+) -> Tuple[List[Tuple[int, dict]], int]:
+    """(lead_id, write vals) for leads whose Dealer differs, and the count already set."""
     lead_ids = sorted(matched.keys())
     if not lead_ids:
         return [], 0
@@ -386,7 +405,7 @@ def build_updates(
         lead_id = row["id"]
         target_value = matched[lead_id]
         props = row.get("lead_properties") or []
-        changed = False
+        vals = None
         for item in props:
             if not isinstance(item, dict):
                 continue
@@ -396,16 +415,73 @@ def build_updates(
                 continue
             if str(item.get("value") or "") == target_value:
                 already += 1
-                changed = False
                 break
-            item["value"] = target_value
-            changed = True
+            # Only this property: the same vals for every lead moving to this dealer.
+            vals = {"lead_properties": {item["name"]: target_value}}
             break
-        if changed:
-            updates.append((lead_id, props))
+        if vals:
+            updates.append((lead_id, vals))
     return updates, already
 
 
+def group_updates(updates: List[Tuple[int, dict]], write_batch: int) -> List[Tuple[List[int], dict]]:
+    """Multi-id write calls: leads with identical vals together, at most write_batch ids per call."""
+    groups: Dict[str, Tuple[List[int], dict]] = {}
+    for lead_id, vals in updates:
+        key = json.dumps(vals, sort_keys=True)
+        groups.setdefault(key, ([], vals))[0].append(lead_id)
+    calls = []
+    for ids, vals in groups.values():
+        for i in range(0, len(ids), write_batch):
+            calls.append((ids[i:i + write_batch], vals))
+    return calls
+
+
+def plan_fingerprint(excel_path: str, matched: Dict[int, str]) -> str:
+    data = json.dumps([os.path.abspath(excel_path), sorted(matched.items())])
+    return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+
+def load_progress(path: str, fingerprint: str) -> Dict[int, str]:
+    """{lead_id: value} written by an earlier run of the same plan; {} otherwise."""
+    raw = read_json(path, default=None)
+    if not isinstance(raw, dict) or raw.get("fingerprint") != fingerprint:
+        return {}
+    return {int(k): str(v) for k, v in (raw.get("written") or {}).items()}
+
+
+def apply_updates(
+    rpc: JsonRpcClient,
+    calls: List[Tuple[List[int], dict]],
+    workers: int,
+    on_written,
+) -> Tuple[int, List[str]]:
+    """
+    Run the write calls on up to workers threads. on_written(ids, vals) is called in this thread
+    after each successful call. Returns (leads written, error messages of failed calls).
+    """
+    written = 0
+    errors: List[str] = []
+    if not calls:
+        return written, errors
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(calls)))) as pool:
+        futures = {
+            pool.submit(rpc.execute_kw, "crm.lead", "write", [ids, vals], None, True): (ids, vals)
+            for ids, vals in calls
+        }
+        for fut in as_completed(futures):
+            ids, vals = futures[fut]
+            try:
+                fut.result()
+            except Exception as exc:
+                errors.append(f"lead ids {ids[0]}..{ids[-1]} ({len(ids)}): {exc}")
+                continue
+            written += len(ids)
+            on_written(ids, vals)
+            print(f"  written: {written} leads", flush=True)
+    return written, errors
+
+
 def main() -> int:
     ap = argparse.ArgumentParser(
         description="Assign Dealer property values on leads from all tabs except first tab."
@@ -420,6 +496,9 @@ def main() -> int:
         default=None,
         help="Optional output .xlsx path for unresolved/skipped rows",
     )
+    ap.add_argument("--write-batch", type=int, default=DEFAULT_WRITE_BATCH, help="Lead ids per write call (default: %(default)s)")
+    ap.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Write calls in flight (default: %(default)s)")
+    ap.add_argument("--progress", default=DEFAULT_PROGRESS_PATH, help="Progress file for resuming --apply (default: %(default)s)")
     ap.add_argument("--odoo-url", default=None)
     ap.add_argument("--odoo-db", default=None)
     ap.add_argument("--odoo-username", default=None)
@@ -560,7 +639,13 @@ def main() -> int:
                 continue
             matched_lead_to_value[lead_id] = option_key
 
-        updates, already_set = build_updates(rpc, matched_lead_to_value, args.property_label)
+        fingerprint = plan_fingerprint(args.excel, matched_lead_to_value)
+        done = load_progress(args.progress, fingerprint) if args.apply else {}
+        if done:
+            print(f"Resuming: {len(done)} leads were written by an earlier run ({args.progress}).")
+        pending = {k: v for k, v in matched_lead_to_value.items() if done.get(k) != v}
+        updates, already_set = build_updates(rpc, pending, args.property_label)
+        already_set += len(matched_lead_to_value) - len(pending)
 
         print(f"Matched leads with a dealer option: {len(matched_lead_to_value)}")
         print(f"Updates required (dealer value differs): {len(updates)}")
@@ -594,11 +679,23 @@ def main() -> int:
             print("Dry run only. Re-run with --apply to write Dealer values.")
             return 0
 
-        changed = 0
-        for lead_id, props in updates:
-            rpc.execute_kw("crm.lead", "write", [[lead_id], {"lead_properties": props}])
-            changed += 1
+        calls = group_updates(updates, max(1, args.write_batch))
+        print(f"Writing {len(updates)} leads in {len(calls)} call(s), {args.workers} at a time.")
+
+        def record(ids: List[int], vals: dict) -> None:
+            for lead_id in ids:
+                done[lead_id] = matched_lead_to_value[lead_id]
+            atomic_write_json(args.progress, {"fingerprint": fingerprint, "written": done})
+
+        changed, errors = apply_updates(rpc, calls, args.workers, record)
         print(f"Leads updated: {changed}")
+        if errors:
+            print(f"ERROR: {len(errors)} write call(s) failed; re-run with --apply to retry them:")
+            for e in errors[:10]:
+                print(f"  {e}")
+            return 2
+        if os.path.exists(args.progress):
+            os.remove(args.progress)
         return 0
     except FileNotFoundError as exc:
         print(f"ERROR: Excel file not found: {exc}")
@@ -609,4 +706,7 @@ def main() -> int:
 
 
 if __name__ == "__main__":
-    sys.exit(main())
+    try:
+        sys.exit(main())
+    finally:
+        print(odoo_rpc.PROCESS_RPC.summary())
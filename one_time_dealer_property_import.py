@@ -11,6 +11,8 @@ from typing import Dict, List, Optional, Tuple
 
 from openpyxl import load_workbook
 
+from odoo_rpc import PROCESS_RPC, OdooModels, server_proxy
+
 
 def _normalize_text(value: str) -> str:
     return re.sub(r"\s+", " ", (value or "").strip())
@@ -56,12 +58,12 @@ def connect_odoo(
     db: str,
     username: str,
     password: str,
-) -> Tuple[int, xmlrpc.client.ServerProxy]:
-    common = xmlrpc.client.ServerProxy(f"{url}/xmlrpc/2/common", allow_none=True)
+) -> Tuple[int, OdooModels]:
+    common = server_proxy(f"{url}/xmlrpc/2/common")
     uid = common.authenticate(db, username, password, {})
     if not uid:
         raise RuntimeError("Authentication failed. Check Odoo credentials.")
-    models = xmlrpc.client.ServerProxy(f"{url}/xmlrpc/2/object", allow_none=True)
+    models = OdooModels(url)
     return uid, models
 
 
@@ -126,7 +128,7 @@ def _build_option_like(example_option, label: str):
 
 
 def get_target_teams(
-    models: xmlrpc.client.ServerProxy,
+    models: OdooModels,
     db: str,
     uid: int,
     password: str,
@@ -273,4 +275,7 @@ def main() -> int:
 
 
 if __name__ == "__main__":
-    sys.exit(main())
+    try:
+        sys.exit(main())
+    finally:
+        print(PROCESS_RPC.summary())
@@ -10,6 +10,8 @@ from typing import Dict, List, Optional, Tuple
 
 from openpyxl import load_workbook
 
+from odoo_rpc import PROCESS_RPC, OdooModels, server_proxy
+
 
 def _normalize_text(value: str) -> str:
     return re.sub(r"\s+", " ", (value or "").strip())
@@ -51,17 +53,17 @@ def connect_odoo(
     db: str,
     username: str,
     password: str,
-) -> Tuple[int, xmlrpc.client.ServerProxy]:
-    common = xmlrpc.client.ServerProxy(f"{url}/xmlrpc/2/common", allow_none=True)
+) -> Tuple[int, OdooModels]:
+    common = server_proxy(f"{url}/xmlrpc/2/common")
     uid = common.authenticate(db, username, password, {})
     if not uid:
         raise RuntimeError("Authentication failed. Check Odoo credentials.")
-    models = xmlrpc.client.ServerProxy(f"{url}/xmlrpc/2/object", allow_none=True)
+    models = OdooModels(url)
     return uid, models
 
 
 def find_target_selection_field(
-    models: xmlrpc.client.ServerProxy,
+    models: OdooModels,
     db: str,
     uid: int,
     password: str,
@@ -105,7 +107,7 @@ def find_target_selection_field(
 
 
 def fetch_existing_selections(
-    models: xmlrpc.client.ServerProxy,
+    models: OdooModels,
     db: str,
     uid: int,
     password: str,
@@ -133,7 +135,7 @@ def build_missing_values(excel_values: List[str], existing: List[dict]) -> List[
 
 
 def create_selection_options(
-    models: xmlrpc.client.ServerProxy,
+    models: OdooModels,
     db: str,
     uid: int,
     password: str,
@@ -319,4 +321,7 @@ def main() -> int:
 
 
 if __name__ == "__main__":
-    sys.exit(main())
+    try:
+        sys.exit(main())
+    finally:
+        print(PROCESS_RPC.summary())
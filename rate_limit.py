@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+rate_limit.py
+
+In-process request limiting for the public endpoints (webhook_server.py / webhook_asgi.py).
+
+- SlidingWindowLimiter: at most `limit` hits per key in any `window_s` seconds (exact
+  sliding log per key, bounded number of tracked keys). Thread-safe.
+- RateLimited: raised by the admission checks; carries the HTTP status (429 for a client
+  over budget, 503 when shedding load) and the Retry-After seconds.
+- client_id(): who to count a request against.
+"""
+
+from __future__ import annotations
+
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Hashable, Optional, Tuple
+
+MAX_TRACKED_KEYS = 50000
+
+
+class RateLimited(Exception):
+    def __init__(self, message: str, retry_after_s: float, status: int = 429):
+        super().__init__(message)
+        self.message = message
+        self.retry_after_s = max(1, int(math.ceil(retry_after_s)))
+        self.status = status
+
+    def response(self) -> Tuple[dict, int, dict]:
+        """(body, status, headers) for either server."""
+        body = {"status": "busy" if self.status == 503 else "error", "message": self.message}
+        return body, self.status, {"Retry-After": str(self.retry_after_s), "Cache-Control": "no-store"}
+
+
+class SlidingWindowLimiter:
+    def __init__(self, limit: int, window_s: float, max_keys: int = MAX_TRACKED_KEYS):
+        self.limit = limit
+        self.window_s = window_s
+        self.max_keys = max_keys
+        self._hits: "OrderedDict[Hashable, Deque[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def try_acquire(self, key: Hashable) -> float:
+        """Count one hit for key. Returns 0 if allowed, else seconds until a slot frees up (not counted)."""
+        if self.limit <= 0:
+            return 0.0
+        now = time.monotonic()
+        cutoff = now - self.window_s
+        with self._lock:
+            hits = self._hits.get(key)
+            if hits is None:
+                hits = self._hits[key] = deque()
+                while len(self._hits) > self.max_keys:
+                    self._hits.popitem(last=False)  # least recently active client
+            else:
+                self._hits.move_to_end(key)
+            while hits and hits[0] <= cutoff:
+                hits.popleft()
+            if len(hits) >= self.limit:
+                return hits[0] + self.window_s - now
+            hits.append(now)
+            return 0.0
+
+
+def client_id(remote_addr: Optional[str], forwarded_for: Optional[str], api_key: Optional[str], proxy_hops: int = 0) -> str:
+    """
+    Client IP (plus the API key, if one was sent). With proxy_hops > 0 the address is taken
+    from X-Forwarded-For as seen by the outermost trusted proxy; the rest of that header is
+    client-controlled and ignored.
+    """
+    ip = remote_addr or ""
+    if proxy_hops > 0 and forwarded_for:
+        hops = [h.strip() for h in forwarded_for.split(",") if h.strip()]
+        if hops:
+            ip = hops[-min(proxy_hops, len(hops))]
+    key = (api_key or "").strip()
+    return f"{ip}|{key}" if key else ip
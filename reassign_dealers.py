@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+"""
+reassign_dealers.py
+
+Recompute the Dealer lead property for every crm.lead, e.g. after a dealer was added, moved or
+removed in DEALER_LOCATIONS, and write only the leads whose dealer changes.
+
+    python reassign_dealers.py                                    # dry run: counts only
+    python reassign_dealers.py --changes-out dealer_changes.xlsx  # dry run + list of changes
+    python reassign_dealers.py --apply --changes-out dealer_changes.xlsx
+    python reassign_dealers.py --apply --only-unset               # only fill leads without a dealer
+
+Per page of lead ids (keyset paging on id, --page-size leads):
+1) read city/state/country/lead_properties/write_date over JSON-RPC (lead_properties can carry
+   nested None, which XML-RPC rejects),
+2) resolve coordinates from the geocode cache; cities not cached yet go through batch_geocode
+   (--no-geocode skips them),
+3) pick each location's dealer with find_closest_dealers (many-to-many OSRM tables, shared route
+   cache): the same rule the webhook applies to a new submission,
+4) diff against the lead's current Dealer value. Leads without a location, without a dealer in
+   reach, or without the Dealer property keep their value,
+5) with --apply, write the changes: leads moving to the same dealer share one multi-id write that
+   sends only {property: value} (other properties are untouched), --write-batch ids per call and
+   --workers calls in flight. Leads edited since they were read are left alone. The writes set a
+   fixed value, so they are retried on transport errors like reads.
+
+Progress is checkpointed after every page (--checkpoint); an interrupted run resumes after the
+last finished page. A checkpoint written for other dealers, another --max-hours or the other mode
+(dry run / --apply) is ignored, and it is removed when the run completes. --restart ignores it.
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from batch_geocode import batch_geocode
+from cache_store import atomic_write_json, read_json
+from geocoding import canonical_key, get_geo_cache
+from odoo_connector import (
+    DEALER_LOCATIONS,
+    MAX_DEALER_DRIVE_HOURS,
+    _get_lead_property_definition,
+    _jsonrpc_execute_kw,
+    _match_dealer_option_value_by_location,
+    find_closest_dealers,
+)
+from odoo_rpc import PROCESS_RPC
+from report_writer import open_report
+
+DEFAULT_CHECKPOINT_PATH = Path("reassign_checkpoint.json")
+DEFAULT_PAGE_SIZE = 500
+DEFAULT_WRITE_BATCH = 200
+DEFAULT_WORKERS = 4
+LEAD_FIELDS = ["id", "name", "city", "state_id", "country_id", "lead_properties", "write_date"]
+CHANGE_COLUMNS = ["lead_id", "name", "city", "province", "old_dealer", "new_dealer", "distance_km", "drive_time_hr", "status"]
+STAT_KEYS = [
+    "leads", "no_location", "no_property", "no_dealer", "no_option", "kept_existing",
+    "unchanged", "changed", "written", "skipped_edited",
+]
+
+
+def _m2o_name(v: Any) -> str:
+    if isinstance(v, (list, tuple)) and len(v) >= 2:
+        return str(v[1] or "")
+    return ""
+
+
+def dealer_fingerprint(max_hours: float, apply: bool, only_unset: bool) -> str:
+    """Identifies the inputs a checkpoint's decisions depend on."""
+    data = [[d.get("Location"), d.get("Latitude"), d.get("Longitude")] for d in DEALER_LOCATIONS]
+    data.append([max_hours, apply, only_unset])
+    return hashlib.sha1(json.dumps(data).encode("utf-8")).hexdigest()
+
+
+def load_checkpoint(path: Path, fingerprint: str) -> Tuple[int, Dict[str, int]]:
+    """(last finished lead id, stats so far); (0, zeros) without a usable checkpoint."""
+    raw = read_json(path, default=None)
+    if not isinstance(raw, dict):
+        return 0, dict.fromkeys(STAT_KEYS, 0)
+    if raw.get("fingerprint") != fingerprint:
+        print(f"⚠️ Ignoring {path}: written for other dealers/settings.")
+        return 0, dict.fromkeys(STAT_KEYS, 0)
+    stats = dict.fromkeys(STAT_KEYS, 0)
+    stats.update({k: int(v) for k, v in (raw.get("stats") or {}).items() if k in stats})
+    return int(raw.get("last_id") or 0), stats
+
+
+def iter_lead_id_pages(domain: list, page_size: int, after_id: int = 0) -> Iterator[List[int]]:
+    """Lead ids in ascending pages, keyset-paged on id, so the CRM is never listed in one call."""
+    last = after_id
+    while True:
+        ids = _jsonrpc_execute_kw(
+            "crm.lead", "search", [domain + [["id", ">", last]]], {"order": "id asc", "limit": page_size}
+        )
+        if not ids:
+            return
+        yield [int(i) for i in ids]
+        last = int(ids[-1])
+
+
+def resolve_lead_coords(rows: List[dict], default_country: str, geocode: bool) -> Dict[int, Tuple[float, float]]:
+    """{lead id: (lat, lon)} from the geocode cache, batch-geocoding uncached cities when geocode is set."""
+    cache = get_geo_cache()
+    keys: Dict[int, str] = {}
+    jobs: Dict[str, Tuple[str, str, str]] = {}
+    for row in rows:
+        city = (row.get("city") or "").strip()
+        prov = _m2o_name(row.get("state_id"))
+        country = _m2o_name(row.get("country_id")) or default_country
+        key = canonical_key(city, prov, country)
+        if not key:
+            continue
+        keys[int(row["id"])] = key
+        if key not in cache:
+            jobs[key] = (city, prov, country)
+    if jobs and geocode:
+        stats = batch_geocode(jobs, cache)
+        if stats["geocoded"] or stats["resumed"]:
+            cache.save()
+    coords = {}
+    for lead_id, key in keys.items():
+        c = cache.get(key)
+        if c is not None:
+            coords[lead_id] = c
+    return coords
+
+
+def current_dealer_value(row: dict, prop_name: str) -> Optional[str]:
+    """The lead's Dealer option key ("" when unset), or None when the lead has no such property."""
+    for item in row.get("lead_properties") or []:
+        if isinstance(item, dict) and item.get("name") == prop_name:
+            return str(item.get("value") or "")
+    return None
+
+
+def plan_page(
+    rows: List[dict],
+    definition: dict,
+    coords: Dict[int, Tuple[float, float]],
+    max_hours: float,
+    only_unset: bool,
+    stats: Dict[str, int],
+) -> List[dict]:
+    """Changes for one page of leads: [{lead_id, old, new, ...}], counting every outcome in stats."""
+    prop_name = definition["name"]
+    selection = definition.get("selection") or []
+    labels = {str(k): str(v) for k, v in selection if k is not None}
+    dealers = find_closest_dealers(set(coords.values()), max_drive_hours=max_hours) if coords else {}
+    option_by_location: Dict[str, Optional[str]] = {}
+
+    changes = []
+    for row in rows:
+        stats["leads"] += 1
+        lead_id = int(row["id"])
+        old = current_dealer_value(row, prop_name)
+        if old is None:
+            stats["no_property"] += 1
+            continue
+        if lead_id not in coords:
+            stats["no_location"] += 1
+            continue
+        dealer = dealers.get(tuple(map(float, coords[lead_id])))
+        if not dealer:
+            stats["no_dealer"] += 1
+            continue
+        location = dealer.get("Location") or ""
+        if location not in option_by_location:
+            option_by_location[location] = _match_dealer_option_value_by_location(selection, location)
+        new = option_by_location[location]
+        if not new:
+            stats["no_option"] += 1
+            continue
+        if old == new:
+            stats["unchanged"] += 1
+            continue
+        if only_unset and old:
+            stats["kept_existing"] += 1
+            continue
+        stats["changed"] += 1
+        changes.append({
+            "lead_id": lead_id,
+            "name": row.get("name") or "",
+            "city": row.get("city") or "",
+            "province": _m2o_name(row.get("state_id")),
+            "old": old,
+            "new": new,
+            "old_dealer": labels.get(old, old),
+            "new_dealer": labels.get(new, location),
+            "distance_km": dealer.get("Distance_km"),
+            "drive_time_hr": dealer.get("Drive_time_hr"),
+            "write_date": row.get("write_date"),
+            "status": "planned",
+        })
+    return changes
+
+
+def apply_changes(changes: List[dict], prop_name: str, write_batch: int, workers: int, stats: Dict[str, int]) -> None:
+    """Multi-id writes grouped by new value; leads edited since they were read are skipped."""
+    if not changes:
+        return
+    ids = [c["lead_id"] for c in changes]
+    # read, not search_read: a search would skip archived leads (active_test) under --include-archived.
+    current = _jsonrpc_execute_kw("crm.lead", "read", [ids], {"fields": ["write_date"]})
+    write_dates = {int(r["id"]): r.get("write_date") for r in current or []}
+
+    groups: Dict[str, List[int]] = {}
+    for c in changes:
+        if write_dates.get(c["lead_id"]) != c["write_date"]:
+            c["status"] = "skipped_edited"
+            stats["skipped_edited"] += 1
+            continue
+        c["status"] = "written"
+        groups.setdefault(c["new"], []).append(c["lead_id"])
+
+    calls = [(value, lead_ids[i:i + write_batch]) for value, lead_ids in groups.items() for i in range(0, len(lead_ids), write_batch)]
+    if not calls:
+        return
+
+    def write(call: Tuple[str, List[int]]) -> int:
+        value, lead_ids = call
+        _jsonrpc_execute_kw("crm.lead", "write", [lead_ids, {"lead_properties": {prop_name: value}}], idempotent=True)
+        return len(lead_ids)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(calls)))) as pool:
+        stats["written"] += sum(pool.map(write, calls))
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Recompute the Dealer property of every CRM lead from DEALER_LOCATIONS.")
+    ap.add_argument("--apply", action="store_true", help="Write changed leads to Odoo (default is a dry run)")
+    ap.add_argument("--only-unset", action="store_true", help="Only set leads that have no dealer yet")
+    ap.add_argument("--max-hours", type=float, default=MAX_DEALER_DRIVE_HOURS, help="Max driving hours to a dealer (default: %(default)s)")
+    ap.add_argument("--property-label", default="Dealer", help="Lead property label (default: %(default)s)")
+    ap.add_argument("--include-archived", action="store_true", help="Also reassign archived leads")
+    ap.add_argument("--default-country", default="Canada", help="Country for leads without one (default: %(default)s)")
+    ap.add_argument("--no-geocode", action="store_true", help="Skip cities missing from the geocode cache instead of geocoding them")
+    ap.add_argument("--page-size", type=int, default=DEFAULT_PAGE_SIZE, help="Leads per page (default: %(default)s)")
+    ap.add_argument("--write-batch", type=int, default=DEFAULT_WRITE_BATCH, help="Lead ids per write call (default: %(default)s)")
+    ap.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Write calls in flight (default: %(default)s)")
+    ap.add_argument("--limit", type=int, default=0, help="Stop after this many leads (0 = all)")
+    ap.add_argument("--changes-out", default=None, help="Write the changes of this run to .xlsx/.csv")
+    ap.add_argument("--checkpoint", default=str(DEFAULT_CHECKPOINT_PATH), help="Checkpoint file (default: %(default)s)")
+    ap.add_argument("--restart", action="store_true", help="Ignore an existing checkpoint")
+    args = ap.parse_args()
+
+    definition = _get_lead_property_definition(args.property_label)
+    if not definition:
+        print(f"ERROR: No '{args.property_label}' selection property found on any CRM team.")
+        return 2
+
+    checkpoint_path = Path(args.checkpoint)
+    fingerprint = dealer_fingerprint(args.max_hours, args.apply, args.only_unset)
+    last_id, stats = (0, dict.fromkeys(STAT_KEYS, 0)) if args.restart else load_checkpoint(checkpoint_path, fingerprint)
+    if last_id:
+        print(f"Resuming after lead id {last_id} ({stats['leads']} leads already processed).")
+
+    domain = [["active", "in", [True, False]]] if args.include_archived else []
+    rep = open_report(Path(args.changes_out).expanduser().resolve()) if args.changes_out else None
+    ws = rep.sheet("Changes", CHANGE_COLUMNS) if rep else None
+    mode = "Applying" if args.apply else "Dry run:"
+    print(f"{mode} Dealer property '{definition['name']}' for {len(DEALER_LOCATIONS)} dealers, max {args.max_hours}h driving.")
+
+    processed = 0
+    try:
+        for ids in iter_lead_id_pages(domain, max(1, args.page_size), after_id=last_id):
+            if args.limit and processed >= args.limit:
+                break
+            if args.limit:
+                ids = ids[: args.limit - processed]
+            rows = _jsonrpc_execute_kw("crm.lead", "read", [ids], {"fields": LEAD_FIELDS}) or []
+            coords = resolve_lead_coords(rows, args.default_country, geocode=not args.no_geocode)
+            changes = plan_page(rows, definition, coords, args.max_hours, args.only_unset, stats)
+            if args.apply:
+                apply_changes(changes, definition["name"], max(1, args.write_batch), args.workers, stats)
+            if ws is not None:
+                for c in changes:
+                    ws.append([c[col] if col in c else "" for col in CHANGE_COLUMNS])
+
+            processed += len(ids)
+            last_id = ids[-1]
+            atomic_write_json(checkpoint_path, {"fingerprint": fingerprint, "last_id": last_id, "stats": stats})
+            print(
+                f"  up to lead {last_id}: {stats['leads']} leads, {stats['changed']} to change, "
+                f"{stats['written']} written, {stats['unchanged']} unchanged",
+                flush=True,
+            )
+        else:
+            if checkpoint_path.exists():
+                checkpoint_path.unlink()  # full pass done
+    finally:
+        if rep is not None:
+            rep.close()
+
+    print(f"Leads processed: {stats['leads']}")
+    print(f"Dealer unchanged: {stats['unchanged']}")
+    print(f"Dealer changes: {stats['changed']}" + (f" (written: {stats['written']}, skipped as edited meanwhile: {stats['skipped_edited']})" if args.apply else ""))
+    print(f"Kept existing dealer (--only-unset): {stats['kept_existing']}")
+    print(f"No location: {stats['no_location']}; no dealer within {args.max_hours}h: {stats['no_dealer']}; "
+          f"dealer without a property option: {stats['no_option']}; lead without the property: {stats['no_property']}")
+    if rep is not None:
+        for p in rep.outputs:
+            print(f"Wrote: {p}")
+    if not args.apply:
+        print("Dry run only. Re-run with --apply to write Dealer values.")
+    return 0
+
+
+if __name__ == "__main__":
+    try:
+        sys.exit(main())
+    finally:
+        print(PROCESS_RPC.summary())
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+report_writer.py
+
+Streaming sheet writer shared by the Excel reports (dealer_radius_report,
+lead_nearest_dealer_report, lead_nearest_dealer_report_v3).
+
+- .xlsx output uses openpyxl write-only mode: rows are serialized as they are appended
+  instead of being held as cell objects until save, so memory stays flat.
+- .csv output writes one file per sheet next to the requested path
+  (report.csv -> report_Summary.csv, report_Assigned.csv, ...).
+
+Usage:
+    with open_report(out_path) as rep:
+        summary = rep.sheet("Summary", ["Dealer", "Leads"])
+        matches = rep.sheet("Matches", ["Dealer", "distance_km", ...])
+        matches.append([...])      # stream rows as they are produced
+        summary.append([...])      # sheets can be filled in any order
+"""
+
+from __future__ import annotations
+
+import csv
+from pathlib import Path
+from typing import Any, Iterable, List, Optional, Sequence, Union
+
+PathLike = Union[str, Path]
+
+FORMAT_XLSX = "xlsx"
+FORMAT_CSV = "csv"
+
+
+def cell_value(v: Any) -> Any:
+    """Excel/CSV-friendly cell: dict/list values are written as their str()."""
+    if isinstance(v, (dict, list)):
+        return str(v)
+    return v
+
+
+def row_values(record: dict, columns: Iterable[str]) -> List[Any]:
+    return [cell_value(record.get(c, "")) for c in columns]
+
+
+class _XlsxSheet:
+    def __init__(self, ws):
+        self._ws = ws
+        self.rows = 0
+
+    def append(self, row: Sequence[Any]) -> None:
+        self._ws.append([cell_value(v) for v in row])
+        self.rows += 1
+
+
+class _CsvSheet:
+    def __init__(self, path: Path):
+        self.path = path
+        self._f = open(path, "w", encoding="utf-8", newline="")
+        self._w = csv.writer(self._f)
+        self.rows = 0
+
+    def append(self, row: Sequence[Any]) -> None:
+        self._w.writerow([cell_value(v) for v in row])
+        self.rows += 1
+
+    def close(self) -> None:
+        self._f.close()
+
+
+class ReportWriter:
+    """Named sheets with a header row, frozen below the header in Excel."""
+
+    def __init__(self, path: PathLike, fmt: Optional[str] = None):
+        self.path = Path(path)
+        self.fmt = fmt or (FORMAT_CSV if self.path.suffix.lower() == ".csv" else FORMAT_XLSX)
+        self._sheets: dict = {}
+        self.outputs: List[Path] = []
+        if self.fmt == FORMAT_XLSX:
+            from openpyxl import Workbook
+
+            self._wb = Workbook(write_only=True)
+        elif self.fmt == FORMAT_CSV:
+            self._wb = None
+        else:
+            raise ValueError(f"Unknown report format: {self.fmt!r}")
+
+    def sheet(self, title: str, header: Optional[Sequence[Any]] = None):
+        """Create a sheet (in workbook order) and write its header row."""
+        if title in self._sheets:
+            raise ValueError(f"Sheet already exists: {title}")
+        if self.fmt == FORMAT_XLSX:
+            ws = self._wb.create_sheet(title)
+            if header:
+                ws.freeze_panes = "A2"
+            sh = _XlsxSheet(ws)
+        else:
+            p = self.path.with_name(f"{self.path.stem}_{title}{self.path.suffix or '.csv'}")
+            sh = _CsvSheet(p)
+            self.outputs.append(p)
+        if header:
+            sh.append(header)
+        self._sheets[title] = sh
+        return sh
+
+    def close(self) -> None:
+        if self.fmt == FORMAT_XLSX:
+            self._wb.save(self.path)
+            self.outputs.append(self.path)
+        else:
+            for sh in self._sheets.values():
+                sh.close()
+
+    def __enter__(self) -> "ReportWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.close()
+        elif self.fmt == FORMAT_CSV:
+            for sh in self._sheets.values():
+                sh.close()
+
+
+def open_report(path: PathLike, fmt: Optional[str] = None) -> ReportWriter:
+    """Open a streaming report; format follows the extension (.csv -> CSV, otherwise .xlsx)."""
+    return ReportWriter(path, fmt=fmt)
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+route_cache.py
+
+The one route cache shared by the webhook (odoo_connector.find_closest_dealer) and the
+report tools (lead_nearest_dealer_report_v3 --use-driving).
+
+Entries live in the route table of the shared SQLite cache (cache_db.py):
+
+    key "<lat>,<lon>-><lat>,<lon>"  ->  {"duration_s": 1523.4, "distance_m": 21877.0}
+
+Keys are source->destination with 6 decimals (lead/customer first, dealer second).
+distance_m may be null for entries written by older report versions, which only stored
+duration; is_complete() tells callers that need both values to refetch those, and the
+refetched entry replaces the partial one. A complete entry is never downgraded.
+
+load_route_cache() returns a RouteCache: dict-style access with point lookups against the
+database, so no process loads the whole cache. New entries are buffered in memory and
+written in one transaction by save_route_cache().
+
+route_duration_cache.json (schema v2 {"schema_version": 2, "routes": {...}}, or the flat
+v1 layout) is imported on first use and re-imported if the file changes.
+"""
+
+from __future__ import annotations
+
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional, Set, Tuple, Union
+
+from cache_db import CACHE_DB_PATH, get_cache_db, import_once
+from cache_store import read_json
+
+ROUTE_CACHE_PATH = Path("route_duration_cache.json")
+SCHEMA_VERSION = 2
+
+RouteEntry = Dict[str, Optional[float]]
+PathLike = Union[str, Path]
+
+
+def route_key(lat1: float, lon1: float, lat2: float, lon2: float) -> str:
+    return f"{lat1:.6f},{lon1:.6f}->{lat2:.6f},{lon2:.6f}"
+
+
+def _clean_entry(v: Any) -> Optional[RouteEntry]:
+    if not isinstance(v, dict) or v.get("duration_s") is None:
+        return None
+    try:
+        duration_s = float(v["duration_s"])
+        distance_m = float(v["distance_m"]) if v.get("distance_m") is not None else None
+    except (TypeError, ValueError):
+        return None
+    return {"duration_s": duration_s, "distance_m": distance_m}
+
+
+def _routes_from_raw(raw: Any) -> Dict[str, RouteEntry]:
+    """Routes from any known JSON layout (v2 wrapper or v1 flat dict)."""
+    if not isinstance(raw, dict):
+        return {}
+    if raw.get("schema_version") == SCHEMA_VERSION and isinstance(raw.get("routes"), dict):
+        items = raw["routes"].items()
+    else:
+        items = raw.items()  # v1: flat {key: {"duration_s", ["distance_m"]}}
+    routes: Dict[str, RouteEntry] = {}
+    for k, v in items:
+        entry = _clean_entry(v)
+        if entry is not None:
+            routes[k] = entry
+    return routes
+
+
+def is_complete(entry: Optional[dict]) -> bool:
+    """True when an entry has both duration and distance."""
+    return bool(entry) and entry.get("duration_s") is not None and entry.get("distance_m") is not None
+
+
+def make_entry(duration_s: float, distance_m: Optional[float] = None) -> RouteEntry:
+    return {"duration_s": float(duration_s), "distance_m": float(distance_m) if distance_m is not None else None}
+
+
+class RouteCache:
+    """Dict-style view of the route table; writes are buffered until save_route_cache()."""
+
+    def __init__(self, db_path: PathLike = CACHE_DB_PATH):
+        self.db = get_cache_db(db_path)
+        self._pending: Dict[str, RouteEntry] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str, default=None):
+        entry = self._pending.get(key)
+        if entry is None:
+            entry = self.db.route_get(key)
+        return default if entry is None else entry
+
+    def __contains__(self, key: object) -> bool:
+        return isinstance(key, str) and self.get(key) is not None
+
+    def __getitem__(self, key: str) -> RouteEntry:
+        entry = self.get(key)
+        if entry is None:
+            raise KeyError(key)
+        return entry
+
+    def __setitem__(self, key: str, entry: RouteEntry) -> None:
+        entry = _clean_entry(entry)
+        if entry is None:
+            return
+        with self._lock:
+            old = self._pending.get(key)
+            if not (is_complete(old) and not is_complete(entry)):
+                self._pending[key] = entry
+
+    def __len__(self) -> int:
+        return self.db.route_count() + sum(1 for k in list(self._pending) if self.db.route_get(k) is None)
+
+    def __iter__(self) -> Iterator[str]:
+        raise TypeError("RouteCache does not support iteration; look entries up by key")
+
+    def get_many(self, keys) -> Dict[str, RouteEntry]:
+        """Entries for all cached keys among keys (one query per few hundred keys)."""
+        found = self.db.route_get_many([k for k in keys if k not in self._pending])
+        found.update({k: self._pending[k] for k in keys if k in self._pending})
+        return found
+
+    def flush(self) -> int:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        try:
+            return self.db.route_put_many(pending.items())
+        except BaseException:
+            with self._lock:
+                for k, v in pending.items():
+                    self._pending.setdefault(k, v)
+            raise
+
+
+def _import_route_json(db_path: PathLike, path: PathLike) -> int:
+    return get_cache_db(db_path).route_put_many(_routes_from_raw(read_json(path, default={})).items(), overwrite=False)
+
+
+_IMPORTED: Set[Tuple[Path, Path]] = set()
+_IMPORT_LOCK = threading.Lock()
+
+
+def load_route_cache(
+    path: Optional[PathLike] = ROUTE_CACHE_PATH, db_path: PathLike = CACHE_DB_PATH
+) -> RouteCache:
+    """Route cache on the shared database; path is the legacy JSON file to import (once per process)."""
+    if path is not None:
+        tag = (Path(path).resolve(), Path(db_path).resolve())
+        with _IMPORT_LOCK:
+            if tag not in _IMPORTED:
+                n = import_once(get_cache_db(db_path), path, lambda p: _import_route_json(db_path, p))
+                if n:
+                    print(f"Imported {n} route cache entries from {path}")
+                _IMPORTED.add(tag)
+    return RouteCache(db_path)
+
+
+def save_route_cache(routes, db_path: PathLike = CACHE_DB_PATH) -> None:
+    """Write new entries: a RouteCache flushes its buffer, a plain dict is upserted as is."""
+    if isinstance(routes, RouteCache):
+        routes.flush()
+        return
+    cleaned = {k: e for k, e in ((k, _clean_entry(v)) for k, v in routes.items()) if e is not None}
+    get_cache_db(db_path).route_put_many(cleaned.items())
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+tracing.py
+
+Lightweight timing spans for the webhook pipeline.
+
+- span(name, **attrs) / @traced(name): time a block or function. Every span feeds the
+  per-stage latency histogram STAGES (always on, also in scripts).
+- request_trace(name, request_id): one trace per HTTP request. Spans opened inside it
+  (same thread/task, or work handed off with contextvars.copy_context()) are collected
+  and printed as one JSON line when the request finishes:
+
+    {"event": "trace", "request_id": "3f9c...", "name": "wix_form_webhook", "ms": 2143.2,
+     "ok": true, "spans": [{"span": "get_lat_lon_from_address", "parent": "build_dealer_info",
+     "ms": 412.5, "ok": true}, ...]}
+
+TRACE_LOG=0 turns the JSON lines off (histograms keep recording).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+TRACE_LOG = os.getenv("TRACE_LOG", "1") != "0"
+MAX_SPANS_PER_TRACE = 500
+
+# Upper bounds (ms) of the latency buckets; one more bucket catches everything above.
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+
+class LatencyHistogram:
+    """Fixed-bucket latency histogram (thread-safe)."""
+
+    def __init__(self, bounds_ms=LATENCY_BUCKETS_MS):
+        self.bounds_ms = tuple(bounds_ms)
+        self.counts = [0] * (len(self.bounds_ms) + 1)
+        self.count = 0
+        self.sum_ms = 0.0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def observe(self, ms: float, ok: bool = True) -> None:
+        i = bisect_left(self.bounds_ms, ms)
+        with self._lock:
+            self.counts[i] += 1
+            self.count += 1
+            self.sum_ms += ms
+            if not ok:
+                self.errors += 1
+
+    def snapshot(self) -> dict:
+        """{"buckets": [(le_ms, cumulative count), ..., ("+Inf", count)], "count", "sum_ms", "errors"}."""
+        with self._lock:
+            counts, count, sum_ms, errors = list(self.counts), self.count, self.sum_ms, self.errors
+        cumulative, buckets = 0, []
+        for le, n in zip(list(self.bounds_ms) + ["+Inf"], counts):
+            cumulative += n
+            buckets.append((le, cumulative))
+        return {"buckets": buckets, "count": count, "sum_ms": sum_ms, "errors": errors}
+
+
+class StageHistograms:
+    """One LatencyHistogram per stage name."""
+
+    def __init__(self):
+        self._stages: Dict[str, LatencyHistogram] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, ms: float, ok: bool = True) -> None:
+        hist = self._stages.get(name)
+        if hist is None:
+            with self._lock:
+                hist = self._stages.setdefault(name, LatencyHistogram())
+        hist.observe(ms, ok)
+
+    def snapshot(self) -> Dict[str, dict]:
+        with self._lock:
+            stages = dict(self._stages)
+        return {name: hist.snapshot() for name, hist in sorted(stages.items())}
+
+
+STAGES = StageHistograms()
+
+
+class Trace:
+    __slots__ = ("request_id", "name", "attrs", "spans", "dropped")
+
+    def __init__(self, name: str, request_id: str, attrs: Optional[dict] = None):
+        self.request_id = request_id
+        self.name = name
+        self.attrs = dict(attrs or {})  # logged with the trace; handlers may add e.g. "status"
+        self.spans: List[dict] = []
+        self.dropped = 0
+
+    def add(self, record: dict) -> None:
+        if len(self.spans) < MAX_SPANS_PER_TRACE:
+            self.spans.append(record)
+        else:
+            self.dropped += 1
+
+
+_TRACE: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("wavcor_trace", default=None)
+_SPAN: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("wavcor_span", default=None)
+
+
+def current_request_id() -> Optional[str]:
+    trace = _TRACE.get()
+    return trace.request_id if trace is not None else None
+
+
+@contextmanager
+def span(name: str, **attrs) -> Iterator[None]:
+    """Time the block as stage `name`; attrs are added to the span's trace record."""
+    parent = _SPAN.get()
+    token = _SPAN.set(name)
+    t0 = time.perf_counter()
+    ok = True
+    try:
+        yield
+    except BaseException:
+        ok = False
+        raise
+    finally:
+        ms = (time.perf_counter() - t0) * 1000.0
+        _SPAN.reset(token)
+        STAGES.observe(name, ms, ok)
+        trace = _TRACE.get()
+        if trace is not None:
+            trace.add({"span": name, "parent": parent, "ms": round(ms, 2), "ok": ok, **attrs})
+
+
+def traced(name: Optional[str] = None):
+    """Decorator form of span(); works on plain and async functions."""
+
+    def decorate(fn):
+        stage = name or fn.__name__
+        if asyncio.iscoroutinefunction(fn):
+
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(stage):
+                    return await fn(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+
+def new_request_id(incoming: Optional[str] = None) -> str:
+    """Keep a sane caller-supplied X-Request-ID, else make one."""
+    incoming = (incoming or "").strip()
+    if incoming and len(incoming) <= 64 and all(c.isalnum() or c in "-_." for c in incoming):
+        return incoming
+    return uuid.uuid4().hex[:16]
+
+
+@contextmanager
+def request_trace(name: str, request_id: Optional[str] = None, **attrs) -> Iterator[Trace]:
+    """Collect the spans of one request (stage `name`) and log them as one JSON line at the end."""
+    trace = Trace(name, new_request_id(request_id), attrs)
+    trace_token = _TRACE.set(trace)
+    span_token = _SPAN.set(name)
+    t0 = time.perf_counter()
+    ok = True
+    try:
+        yield trace
+    except BaseException:
+        ok = False
+        raise
+    finally:
+        ms = (time.perf_counter() - t0) * 1000.0
+        _SPAN.reset(span_token)
+        _TRACE.reset(trace_token)
+        STAGES.observe(name, ms, ok)
+        if TRACE_LOG:
+            record = {"event": "trace", "request_id": trace.request_id, "name": name, "ms": round(ms, 2), "ok": ok, **trace.attrs}
+            record["spans"] = trace.spans
+            if trace.dropped:
+                record["spans_dropped"] = trace.dropped
+            print(json.dumps(record, ensure_ascii=False, default=str), flush=True)
@@ -0,0 +1,373 @@
+#!/usr/bin/env python3
+"""
+webhook_asgi.py
+
+asyncio serving mode for the webhook: /nearest_dealer and /wix_form_webhook with the same
+request/response contract as webhook_server.py (Flask, gunicorn), for traffic spikes where
+most requests are waiting on OSRM, the geocoders or Odoo rather than using CPU.
+
+- /nearest_dealer runs entirely on the event loop: geo cache / route cache lookups, then
+  async geocoding and OSRM calls over one pooled httpx client (async_clients.py).
+- /wix_form_webhook dedups on the loop, then hands the Odoo sync (webhook_server.handle_form,
+  a long chain of dependent Odoo calls) to a bounded thread pool. Submissions beyond the pool
+  size wait as cheap queued tasks instead of each holding a server thread.
+
+Run (pip install uvicorn httpx):
+
+    uvicorn webhook_asgi:app --host 0.0.0.0 --port 8080 --workers 2
+
+ODOO_SYNC_THREADS sets the pool size per process (default 16). GET /metrics serves the same
+Prometheus metrics as the Flask app, plus the Odoo pool's queue depth.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import functools
+import json
+import os
+import traceback
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import async_clients
+import metrics
+import webhook_server
+from rate_limit import RateLimited
+from response_cache import AsyncSingleFlight, etag_matches
+from odoo_rpc import rpc_budget
+from tracing import request_trace
+from webhook_server import (
+    _HTTP_IN_FLIGHT,
+    _NEAREST_DEALER_CACHE,
+    METRICS_CONTENT_TYPE,
+    ODOO_RPC_BUDGET_PER_REQUEST,
+    _nearest_dealer_by_distance,
+    admit_nearest_dealer,
+    admit_nearest_dealer_miss,
+    claim_submission,
+    dealer_lookup_authorized,
+    handle_form,
+    iter_nearest_dealer_batch,
+    metrics_authorized,
+    nearest_dealer_cache_headers,
+    nearest_dealer_cache_key,
+    nearest_dealer_cacheable,
+    nearest_dealer_client,
+    nearest_dealer_result,
+    nearest_dealer_ttl,
+    ndjson_line,
+    parse_nearest_dealer_batch,
+    parse_nearest_dealer_request,
+)
+
+ODOO_SYNC_THREADS = int(os.getenv("ODOO_SYNC_THREADS", "16"))
+MAX_BODY_BYTES = 1024 * 1024
+
+CORS_HEADERS = [
+    (b"access-control-allow-origin", b"*"),
+    (b"access-control-allow-headers", b"Content-Type, X-API-Key, If-None-Match"),
+    (b"access-control-allow-methods", b"GET, POST, OPTIONS"),
+    (b"access-control-expose-headers", b"Retry-After, X-Request-ID"),
+]
+
+_ODOO_POOL: Optional[ThreadPoolExecutor] = None
+_ODOO_SYNC_RUNNING = metrics.InFlight()
+_ODOO_SYNC_QUEUED = metrics.InFlight()  # handed to the pool, not started yet
+_NEAREST_DEALER_FLIGHTS = AsyncSingleFlight()
+
+
+def _odoo_pool() -> ThreadPoolExecutor:
+    global _ODOO_POOL
+    if _ODOO_POOL is None:
+        _ODOO_POOL = ThreadPoolExecutor(max_workers=ODOO_SYNC_THREADS, thread_name_prefix="odoo-sync")
+    return _ODOO_POOL
+
+
+# --------------------------------------------------------------------
+# ASGI plumbing
+# --------------------------------------------------------------------
+async def _read_body(receive) -> bytes:
+    chunks, size = [], 0
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            break
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if size > MAX_BODY_BYTES:
+            raise ValueError("Request body too large")
+        chunks.append(chunk)
+        if not message.get("more_body"):
+            break
+    return b"".join(chunks)
+
+
+def _encode_headers(extra: Optional[dict]) -> list:
+    return [(k.lower().encode("latin-1"), str(v).encode("latin-1")) for k, v in (extra or {}).items()]
+
+
+async def _send_json(send, body, status: int = 200, headers: Optional[dict] = None) -> None:
+    data = json.dumps(body).encode("utf-8")
+    base = [(b"content-type", b"application/json"), (b"content-length", str(len(data)).encode())]
+    await send({"type": "http.response.start", "status": status, "headers": base + _encode_headers(headers) + CORS_HEADERS})
+    await send({"type": "http.response.body", "body": data})
+
+
+async def _send_empty(send, status: int, headers: Optional[dict] = None) -> None:
+    await send({"type": "http.response.start", "status": status, "headers": _encode_headers(headers) + CORS_HEADERS})
+    await send({"type": "http.response.body", "body": b""})
+
+
+def _header(scope, name: bytes) -> Optional[str]:
+    for k, v in scope.get("headers") or []:
+        if k.lower() == name:
+            return v.decode("latin-1")
+    return None
+
+
+# --------------------------------------------------------------------
+# Endpoints
+# --------------------------------------------------------------------
+async def _lookup_nearest_dealer(key, city, province):
+    hit = _NEAREST_DEALER_CACHE.peek(key) if nearest_dealer_cacheable(key) else None
+    if hit is not None:
+        (lat, lon, closest), max_age = hit
+        return lat, lon, closest, max_age
+    coords = await async_clients.geocode_async(city, province)
+    lat, lon = coords if coords else (None, None)
+    closest = None
+    if coords:
+        closest = await async_clients.find_closest_dealer_async(lat, lon) or _nearest_dealer_by_distance(lat, lon)
+    ttl = nearest_dealer_ttl(lat, closest)
+    if nearest_dealer_cacheable(key):
+        _NEAREST_DEALER_CACHE.put(key, (lat, lon, closest), ttl)
+    return lat, lon, closest, ttl
+
+
+async def cached_nearest_dealer(city, province, client=None):
+    """webhook_server.cached_nearest_dealer for the event loop (same cache, limits, async single-flight)."""
+    key = nearest_dealer_cache_key(city, province)
+    if not nearest_dealer_cacheable(key):
+        if client is not None:
+            admit_nearest_dealer_miss(client, key)
+        return await _lookup_nearest_dealer(key, city, province)
+    hit = _NEAREST_DEALER_CACHE.lookup(key)
+    if hit is not None:
+        (lat, lon, closest), max_age = hit
+        return lat, lon, closest, max_age
+    if client is not None and not _NEAREST_DEALER_FLIGHTS.in_flight(key):  # joining a running lookup costs nothing
+        admit_nearest_dealer_miss(client, key)
+    return await _NEAREST_DEALER_FLIGHTS.do(key, lambda: _lookup_nearest_dealer(key, city, province))
+
+
+async def nearest_dealer(scope, receive, send) -> None:
+    """Same contract as webhook_server.nearest_dealer."""
+    if scope["method"] == "OPTIONS":
+        await _send_empty(send, 204)
+        return
+    try:
+        sent_key = _header(scope, b"x-api-key")
+        if not dealer_lookup_authorized(sent_key):
+            await _send_json(send, {"status": "error", "message": "Unauthorized"}, 401)
+            return
+        remote = (scope.get("client") or (None, None))[0]
+        client = nearest_dealer_client(remote, _header(scope, b"x-forwarded-for"), sent_key)
+        admit_nearest_dealer(client)
+
+        if scope["method"] == "GET":
+            payload = dict(urllib.parse.parse_qsl(scope.get("query_string", b"").decode("latin-1")))
+        else:
+            try:
+                payload = json.loads(await _read_body(receive) or b"null") or {}
+            except ValueError:
+                payload = {}
+        if not isinstance(payload, dict):
+            payload = {}
+        city, province, error = parse_nearest_dealer_request(payload)
+        if error:
+            await _send_json(send, *error)
+            return
+
+        lat, lon, closest, max_age = await cached_nearest_dealer(city, province, client)
+        body, status = nearest_dealer_result(city, province, lat, lon, closest)
+        headers = nearest_dealer_cache_headers(body, max_age)
+        if etag_matches(_header(scope, b"if-none-match"), headers["ETag"]):
+            await _send_empty(send, 304, headers)
+            return
+        await _send_json(send, body, status, headers)
+    except RateLimited as e:
+        print(f"⚠️ nearest_dealer limited ({e.status}): {e.message}", flush=True)
+        await _send_json(send, *e.response())
+    except Exception as e:
+        print(f"ERROR nearest_dealer: {e}", flush=True)
+        traceback.print_exc()
+        await _send_json(send, {"status": "error", "message": str(e)}, 500)
+
+
+async def nearest_dealer_batch(scope, receive, send) -> None:
+    """
+    Same contract as webhook_server.nearest_dealer_batch. The batch pipeline (one geocoding
+    pass, shared OSRM table requests) runs in a worker thread; lines stream as they are ready.
+    """
+    if scope["method"] == "OPTIONS":
+        await _send_empty(send, 204)
+        return
+    try:
+        sent_key = _header(scope, b"x-api-key")
+        if not dealer_lookup_authorized(sent_key):
+            await _send_json(send, {"status": "error", "message": "Unauthorized"}, 401)
+            return
+        remote = (scope.get("client") or (None, None))[0]
+        client = nearest_dealer_client(remote, _header(scope, b"x-forwarded-for"), sent_key)
+        admit_nearest_dealer(client)
+        try:
+            payload = json.loads(await _read_body(receive) or b"null")
+        except ValueError:
+            payload = None
+        items = parse_nearest_dealer_batch(payload)
+    except RateLimited as e:
+        print(f"⚠️ nearest_dealer batch limited ({e.status}): {e.message}", flush=True)
+        await _send_json(send, *e.response())
+        return
+    except ValueError as e:
+        await _send_json(send, {"status": "error", "message": str(e)}, 400)
+        return
+
+    print(f"📦 nearest_dealer batch: {len(items)} locations", flush=True)
+    headers = [(b"content-type", b"application/x-ndjson"), (b"cache-control", b"no-store")]
+    await send({"type": "http.response.start", "status": 200, "headers": headers + CORS_HEADERS})
+    results = iter_nearest_dealer_batch(items, client)
+    done = object()
+    try:
+        while True:
+            result = await asyncio.to_thread(next, results, done)
+            if result is done:
+                break
+            await send({"type": "http.response.body", "body": ndjson_line(result), "more_body": True})
+    except Exception as e:
+        print(f"ERROR nearest_dealer batch: {e}", flush=True)
+        traceback.print_exc()
+        await send({"type": "http.response.body", "body": ndjson_line({"status": "error", "message": str(e)}), "more_body": True})
+    await send({"type": "http.response.body", "body": b""})
+
+
+async def wix_form_webhook(scope, receive, send) -> None:
+    """Same contract as webhook_server.wix_form_webhook; the Odoo sync runs in the thread pool."""
+    print("🔔 Received webhook request", flush=True)
+    try:
+        payload = json.loads(await _read_body(receive))
+        if not claim_submission(payload):
+            await _send_json(send, {"status": "duplicate_ignored"})
+            return
+        # copy_context: spans recorded in the pool thread belong to this request's trace
+        ticket = {"queued": True}
+        sync = functools.partial(contextvars.copy_context().run, _run_odoo_sync, payload, ticket)
+        _ODOO_SYNC_QUEUED.inc()
+        try:
+            result, status = await asyncio.get_running_loop().run_in_executor(_odoo_pool(), sync)
+        finally:
+            _leave_queue(ticket)  # no-op unless the job was cancelled before it started
+        await _send_json(send, result, status)
+    except Exception as e:
+        print(f"❌ Error processing webhook: {e}", flush=True)
+        traceback.print_exc()
+        await _send_json(send, {"status": "error", "message": str(e)}, 500)
+
+
+def _leave_queue(ticket: dict) -> None:
+    """Take one submission out of odoo_sync_queued, once: when its job starts (or never will)."""
+    if ticket.pop("queued", False):
+        _ODOO_SYNC_QUEUED.dec()
+
+
+def _run_odoo_sync(payload, ticket):
+    _leave_queue(ticket)
+    with _ODOO_SYNC_RUNNING:
+        return handle_form(payload)
+
+
+async def metrics_endpoint(scope, receive, send) -> None:
+    """Same contract as webhook_server.metrics_endpoint."""
+    if not metrics_authorized(_header(scope, b"authorization")):
+        await _send_json(send, {"status": "error", "message": "Unauthorized"}, 401)
+        return
+    data = metrics.render().encode("utf-8")
+    headers = [(b"content-type", METRICS_CONTENT_TYPE.encode()), (b"content-length", str(len(data)).encode()), (b"cache-control", b"no-store")]
+    await send({"type": "http.response.start", "status": 200, "headers": headers})
+    await send({"type": "http.response.body", "body": data})
+
+
+metrics.register("odoo_sync_running", "Form submissions being synced to Odoo by the pool.", lambda: _ODOO_SYNC_RUNNING.value)
+# queued = submitted to the pool but waiting for a free thread
+metrics.register("odoo_sync_queued", "Form submissions waiting for an Odoo sync thread.", lambda: _ODOO_SYNC_QUEUED.value)
+
+
+ROUTES = {
+    "/nearest_dealer": (nearest_dealer, {"GET", "POST", "OPTIONS"}),
+    "/nearest_dealer/batch": (nearest_dealer_batch, {"POST", "OPTIONS"}),
+    "/wix_form_webhook": (wix_form_webhook, {"POST"}),
+    "/metrics": (metrics_endpoint, {"GET"}),
+}
+
+
+async def _lifespan(receive, send) -> None:
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            try:
+                async_clients.open_client()
+                _odoo_pool()
+                await asyncio.to_thread(webhook_server.prewarm)
+            except Exception as e:
+                await send({"type": "lifespan.startup.failed", "message": str(e)})
+                return
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await async_clients.close_client()
+            if _ODOO_POOL is not None:
+                _ODOO_POOL.shutdown(wait=True)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send) -> None:
+    """ASGI entry point (uvicorn webhook_asgi:app)."""
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+    route = ROUTES.get(scope["path"])
+    if route is None:
+        await _send_json(send, {"status": "error", "message": "Not found"}, 404)
+        return
+    handler, methods = route
+    if scope["method"] not in methods:
+        await _send_json(send, {"status": "error", "message": "Method not allowed"}, 405)
+        return
+    if handler is metrics_endpoint:  # scrapes stay out of the traces and in-flight count
+        await handler(scope, receive, send)
+        return
+    name = handler.__name__
+    with _HTTP_IN_FLIGHT, request_trace(name, _header(scope, b"x-request-id"), method=scope["method"]) as trace:
+
+        async def send_traced(message):
+            if message["type"] == "http.response.start":
+                trace.attrs["status"] = message["status"]
+                message = {**message, "headers": list(message.get("headers") or []) + [(b"x-request-id", trace.request_id.encode())]}
+            await send(message)
+
+        with rpc_budget(name, ODOO_RPC_BUDGET_PER_REQUEST) as rpc:
+            await handler(scope, receive, send_traced)
+        if rpc.calls:
+            trace.attrs["odoo_rpc"] = rpc.report()
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    print("🚀 Async webhook server starting...", flush=True)
+    uvicorn.run("webhook_asgi:app", host="0.0.0.0", port=int(os.getenv("PORT", "8080")))
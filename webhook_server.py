@@ -1,49 +1,63 @@
-from flask import Flask, request, jsonify
-import json, traceback, time
+from flask import Flask, Response, request, jsonify, stream_with_context
+import json, traceback, time, threading, functools
 import re
 import os
+import sqlite3
 from pathlib import Path
 from email.utils import parseaddr
 from datetime import datetime, timezone, timedelta
-from geopy.geocoders import ArcGIS, Nominatim
-from geopy.exc import GeocoderTimedOut, GeocoderServiceError
 from datetime import datetime, timedelta
 from odoo_connector import (
     create_odoo_contact, update_odoo_contact, find_existing_contact,
     create_odoo_opportunity, connect_odoo, get_or_create_opportunity_tags,
     find_odoo_user_id, get_model_id, add_follower_to_lead,
-    find_closest_dealer, find_existing_opportunity, update_odoo_opportunity,
+    find_closest_dealer, find_closest_dealers, find_existing_opportunity, update_odoo_opportunity,
     post_internal_note_to_opportunity, ODOO_URL, normalize_state, schedule_activity_for_lead,
-    set_dealer_property_on_lead, DEALER_LOCATIONS, haversine_distance, CANONICAL_CODES,
+    set_dealer_property_on_lead, build_dealer_property_vals, haversine_distance,
+    lead_create_team, lead_unmodified_since,
+    CANONICAL_CODES, dealer_points, warm_odoo_session, _load_route_cache,
 )
+import geocoding
+import metrics
+from cache_db import get_cache_db
+from odoo_rpc import rpc_budget
+from rate_limit import RateLimited, SlidingWindowLimiter, client_id
+from response_cache import SingleFlight, TTLCache, etag_for, etag_matches
+from tracing import new_request_id, request_trace, traced
 
 app = Flask(__name__)
-geolocator = Nominatim(user_agent="WavcorWebhook")
-arcgis_geolocator = ArcGIS(timeout=10)
 DEALER_LOOKUP_API_KEY = (os.getenv("DEALER_LOOKUP_API_KEY") or "").strip()
-GEO_CACHE_PATH = Path("geo_city_cache.json")
 BLOCKED_EMAIL_DOMAINS_PATH = Path("blocked_email_domains.txt")
 BLOCKED_EMAIL_DOMAINS_ENV = "BLOCKED_EMAIL_DOMAINS"
-GEOCODE_CACHE = {}
-LAST_GEOCODE_REQUEST_TS = 0.0
-GEOCODE_RATE_LIMIT_SECONDS = 1.2
-GEOCODE_429_COOLDOWN_SECONDS = 60.0
-GEOCODE_COOLDOWN_UNTIL = 0.0
-GEOCODE_PROVINCE_NAMES = {
-    "AB": "Alberta",
-    "BC": "British Columbia",
-    "MB": "Manitoba",
-    "NB": "New Brunswick",
-    "NL": "Newfoundland and Labrador",
-    "NS": "Nova Scotia",
-    "NT": "Northwest Territories",
-    "NU": "Nunavut",
-    "ON": "Ontario",
-    "PE": "Prince Edward Island",
-    "QC": "Quebec",
-    "SK": "Saskatchewan",
-    "YT": "Yukon",
-}
+
+# /nearest_dealer response cache (per process), keyed by canonical city|province
+NEAREST_DEALER_CACHE_TTL_S = int(os.getenv("NEAREST_DEALER_CACHE_TTL_S", "3600"))
+NEAREST_DEALER_RETRY_TTL_S = 60  # geocode misses / OSRM-down fallbacks: retry soon
+NEAREST_DEALER_CACHE_SIZE = 4096
+_NEAREST_DEALER_CACHE = TTLCache(NEAREST_DEALER_CACHE_SIZE, NEAREST_DEALER_CACHE_TTL_S)
+_NEAREST_DEALER_FLIGHTS = SingleFlight()
+
+# /nearest_dealer abuse protection (per process). Form webhooks are never limited, and
+# anonymous lookups stop geocoding before they would queue behind a provider backlog, so
+# real submissions keep the geocoding quota.
+NEAREST_DEALER_RATE_PER_MIN = int(os.getenv("NEAREST_DEALER_RATE_PER_MIN", "60"))  # per client, all lookups
+NEAREST_DEALER_MISS_RATE_PER_MIN = int(os.getenv("NEAREST_DEALER_MISS_RATE_PER_MIN", "12"))  # per client, cache misses
+NEAREST_DEALER_GLOBAL_MISS_RATE_PER_MIN = int(os.getenv("NEAREST_DEALER_GLOBAL_MISS_RATE_PER_MIN", "120"))
+NEAREST_DEALER_MAX_GEOCODE_WAIT_S = 2.0  # shed new-city lookups when every geocoder is this backed up
+NEAREST_DEALER_BATCH_MAX = int(os.getenv("NEAREST_DEALER_BATCH_MAX", "500"))  # locations per batch request
+TRUSTED_PROXY_HOPS = int(os.getenv("TRUSTED_PROXY_HOPS", "0"))  # proxies in front of us that set X-Forwarded-For
+_LOOKUP_LIMITER = SlidingWindowLimiter(NEAREST_DEALER_RATE_PER_MIN, 60.0)
+_MISS_LIMITER = SlidingWindowLimiter(NEAREST_DEALER_MISS_RATE_PER_MIN, 60.0)
+_GLOBAL_MISS_LIMITER = SlidingWindowLimiter(NEAREST_DEALER_GLOBAL_MISS_RATE_PER_MIN, 60.0)
+
+# GET /metrics (Prometheus text format, per process); Bearer token required when set
+METRICS_TOKEN = (os.getenv("METRICS_TOKEN") or "").strip()
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+_HTTP_IN_FLIGHT = metrics.InFlight()
+
+# Odoo calls one request may make (odoo_rpc.rpc_budget); 0 = count and report only.
+# A cold worker's first submission also loads reference data, so leave headroom.
+ODOO_RPC_BUDGET_PER_REQUEST = int(os.getenv("ODOO_RPC_BUDGET_PER_REQUEST", "0"))
 
 
 def _normalize_email_domain(domain: str) -> str:
@@ -111,144 +125,11 @@ def _blocked_domain_result(data: dict, form_name: str):
     }
 
 
-def _geo_key(city: str, prov: str, country: str = "Canada") -> str:
-    return f"{city.strip().lower()}|{prov.strip().lower()}|{country.strip().lower()}"
-
-
-def _normalize_city_text(city: str) -> str:
-    text = re.sub(r"[^\w\s-]", " ", str(city or "").strip().lower())
-    text = re.sub(r"[\s_-]+", " ", text).strip()
-    return text
-
-
-def _compact_city_text(city: str) -> str:
-    return _normalize_city_text(city).replace(" ", "")
-
-
-def _geo_cache_keys(city: str, province_state: str, country: str = "Canada"):
-    province_raw = str(province_state or "").strip()
-    province_norm = normalize_state(province_raw)
-    province_for_geocode = GEOCODE_PROVINCE_NAMES.get(province_norm, province_raw)
-    city_variants = {
-        str(city or "").strip(),
-        _normalize_city_text(city),
-        _compact_city_text(city),
-    }
-    prov_variants = {
-        province_raw,
-        province_norm,
-        province_for_geocode,
-        f"{province_for_geocode} CA",
-    }
-    return {
-        _geo_key(city_variant, prov_variant, country)
-        for city_variant in city_variants
-        for prov_variant in prov_variants
-        if city_variant and prov_variant
-    }
-
-
-def _load_geo_cache() -> dict:
-    if not GEO_CACHE_PATH.exists():
-        return {}
-    try:
-        raw = json.loads(GEO_CACHE_PATH.read_text(encoding="utf-8"))
-        return raw if isinstance(raw, dict) else {}
-    except Exception:
-        return {}
-
-
-def _save_geo_cache(cache: dict) -> None:
-    try:
-        GEO_CACHE_PATH.write_text(json.dumps(cache, indent=2, ensure_ascii=False), encoding="utf-8")
-    except Exception as e:
-        print(f"WARNING: Failed to save geo cache: {e}", flush=True)
-
-
-def _get_cached_coords(city: str, province_state: str, country: str = "Canada"):
-    cache = GEOCODE_CACHE
-    for key in _geo_cache_keys(city, province_state, country):
-        val = cache.get(key)
-        if isinstance(val, (list, tuple)) and len(val) == 2:
-            try:
-                return float(val[0]), float(val[1])
-            except Exception:
-                continue
-
-    target_city_norm = _normalize_city_text(city)
-    target_city_compact = _compact_city_text(city)
-    target_prov_norm = normalize_state(str(province_state or "").strip())
-    for key, val in cache.items():
-        if not (isinstance(val, (list, tuple)) and len(val) == 2):
-            continue
-        try:
-            cached_city, cached_prov, cached_country = key.split("|", 2)
-        except ValueError:
-            continue
-        if cached_country.strip().lower() != str(country or "").strip().lower():
-            continue
-        cached_city_norm = _normalize_city_text(cached_city)
-        cached_city_compact = _compact_city_text(cached_city)
-        cached_prov_norm = normalize_state(cached_prov)
-        if (
-            cached_prov_norm == target_prov_norm
-            and (
-                cached_city_norm == target_city_norm
-                or cached_city_compact == target_city_compact
-            )
-        ):
-            try:
-                coords = (float(val[0]), float(val[1]))
-                _store_cached_coords(city, province_state, country, coords)
-                return coords
-            except Exception:
-                continue
-    return None
-
-
-def _store_cached_coords(city: str, province_state: str, country: str, coords) -> None:
-    for key in _geo_cache_keys(city, province_state, country):
-        GEOCODE_CACHE[key] = coords
-    _save_geo_cache(GEOCODE_CACHE)
-
-
-def _extract_location_coords(location):
-    if not location:
-        return None
-    try:
-        return float(location.latitude), float(location.longitude)
-    except Exception:
-        return None
-
-
-def _try_arcgis_geocode(full_address: str, city: str, province_state: str, country: str):
-    try:
-        print(f"DEBUG: ArcGIS geocoding '{full_address}'", flush=True)
-        location = arcgis_geolocator.geocode(full_address, timeout=10)
-        coords = _extract_location_coords(location)
-        if coords:
-            print(f"DEBUG: ArcGIS success → {coords[0]}, {coords[1]}", flush=True)
-            _store_cached_coords(city, province_state, country, coords)
-            return coords
-        print(f"WARNING: ArcGIS could not geocode '{full_address}'", flush=True)
-        return None, None
-    except Exception as e:
-        print(f"ERROR: ArcGIS geocoding error: {e}", flush=True)
-        return None, None
-
-
-GEOCODE_CACHE = _load_geo_cache()
-
-
 def _nearest_dealer_by_distance(customer_lat, customer_lon):
     """Fallback for public lookup page when routing API is unavailable."""
     best = None
-    for dealer in DEALER_LOCATIONS:
-        dlat = dealer.get("Latitude")
-        dlon = dealer.get("Longitude")
-        if dlat is None or dlon is None:
-            continue
-        km = haversine_distance(float(customer_lat), float(customer_lon), float(dlat), float(dlon))
+    for _idx, dealer, dlat, dlon in dealer_points():
+        km = haversine_distance(float(customer_lat), float(customer_lon), dlat, dlon)
         if best is None or km < best[0]:
             best = (km, dealer)
     if not best:
@@ -258,13 +139,15 @@ def _nearest_dealer_by_distance(customer_lat, customer_lon):
     result["Distance_km"] = round(km, 2)
     result["Drive_time_hr"] = round(km / 80.0, 2)
     result["route_mode"] = "distance_fallback"
+    metrics.inc("dealer_lookups_total", mode="nearest_direct")
     return result
 
 
 def _set_cors_headers(resp):
     resp.headers["Access-Control-Allow-Origin"] = "*"
-    resp.headers["Access-Control-Allow-Headers"] = "Content-Type, X-API-Key"
-    resp.headers["Access-Control-Allow-Methods"] = "POST, OPTIONS"
+    resp.headers["Access-Control-Allow-Headers"] = "Content-Type, X-API-Key, If-None-Match"
+    resp.headers["Access-Control-Allow-Methods"] = "GET, POST, OPTIONS"
+    resp.headers["Access-Control-Expose-Headers"] = "Retry-After, X-Request-ID"
     return resp
 
 
@@ -272,99 +155,442 @@ def _set_cors_headers(resp):
 def _after_request(resp):
     return _set_cors_headers(resp)
 
+
+def _traced_request(name):
+    """
+    Run a view inside a request trace (tracing.py) and Odoo RPC budget (odoo_rpc.py);
+    echoes the request id as X-Request-ID. The trace line carries the RPC report.
+    """
+
+    def decorate(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            with _HTTP_IN_FLIGHT, request_trace(name, request.headers.get("X-Request-ID"), method=request.method) as trace:
+                with rpc_budget(name, ODOO_RPC_BUDGET_PER_REQUEST) as rpc:
+                    resp = app.make_response(view(*args, **kwargs))
+                trace.attrs["status"] = resp.status_code
+                if rpc.calls:
+                    trace.attrs["odoo_rpc"] = rpc.report()
+            resp.headers["X-Request-ID"] = trace.request_id
+            return resp
+
+        return wrapper
+
+    return decorate
+
 # --------------------------------------------------------------------
 # 1️⃣  Flask entrypoint with duplicate protection
 # --------------------------------------------------------------------
 
-# Store submissionId + timestamp (instead of plain set)
+# Claimed submissionIds live in the cache DB so every worker process sees them; the in-process
+# dict (submissionId -> timestamp) only takes over while the DB can't be written.
+DEDUP_WINDOW_S = 600
 processed_submissions = {}
+_processed_lock = threading.Lock()
+
+
+def dealer_lookup_authorized(sent_key) -> bool:
+    """X-API-Key check for /nearest_dealer (open when DEALER_LOOKUP_API_KEY is unset)."""
+    if not DEALER_LOOKUP_API_KEY:
+        return True
+    return (sent_key or "").strip() == DEALER_LOOKUP_API_KEY
 
 
-@app.route("/nearest_dealer", methods=["POST", "OPTIONS"])
+def parse_nearest_dealer_request(payload: dict):
+    """
+    Validate a /nearest_dealer body. Returns (city, province, None) or (None, None, (error_body, status)).
+    Shared by the Flask view and webhook_asgi.
+    """
+    city = str(payload.get("city") or payload.get("City") or "").strip()
+    province_raw = (
+        payload.get("province")
+        or payload.get("prov")
+        or payload.get("state")
+        or payload.get("Prov/State")
+        or ""
+    )
+    province = normalize_state(str(province_raw).strip())
+
+    if not city or not province:
+        return None, None, ({
+            "status": "error",
+            "message": "Both city and province/state are required.",
+        }, 400)
+    if province not in CANONICAL_CODES:
+        return None, None, ({
+            "status": "error",
+            "message": (
+                f"Invalid province/state value '{province_raw}'. "
+                "Use a 2-letter code like SK, MB, AB."
+            ),
+        }, 400)
+    return city, province, None
+
+
+def nearest_dealer_result(city, province, lat, lon, closest):
+    """Response body + status for a /nearest_dealer lookup (lat/lon None = geocoding failed)."""
+    if lat is None or lon is None:
+        return {
+            "status": "no_match",
+            "message": "Could not geocode location.",
+            "city": city,
+            "province": province,
+        }, 200
+    if not closest:
+        return {
+            "status": "no_match",
+            "message": "No dealer found within configured driving range.",
+            "city": city,
+            "province": province,
+            "latitude": lat,
+            "longitude": lon,
+        }, 200
+    return {
+        "status": "ok",
+        "city": city,
+        "province": province,
+        "latitude": lat,
+        "longitude": lon,
+        "dealer": {
+            "location": closest.get("Location"),
+            "contact": closest.get("Contact"),
+            "phone": closest.get("Phone"),
+            "email": closest.get("Email"),
+            "distance_km": closest.get("Distance_km"),
+            "drive_time_hr": closest.get("Drive_time_hr"),
+            "route_mode": closest.get("route_mode", "osrm"),
+        },
+    }, 200
+
+
+def nearest_dealer_cache_key(city, province) -> str:
+    return geocoding.canonical_key(city, province)
+
+
+def nearest_dealer_cacheable(key) -> bool:
+    """An empty key (e.g. a punctuation-only city) would put unrelated places in one entry."""
+    return isinstance(key, str) and bool(key)
+
+
+def nearest_dealer_ttl(lat, closest) -> int:
+    """Full TTL for real routing answers; short TTL for misses and direct-distance fallbacks."""
+    if lat is None or not closest or closest.get("route_mode", "osrm") != "osrm":
+        return NEAREST_DEALER_RETRY_TTL_S
+    return NEAREST_DEALER_CACHE_TTL_S
+
+
+def _lookup_nearest_dealer(key, city, province):
+    hit = _NEAREST_DEALER_CACHE.peek(key) if nearest_dealer_cacheable(key) else None
+    if hit is not None:  # filled by the flight that finished just before ours started
+        (lat, lon, closest), max_age = hit
+        return lat, lon, closest, max_age
+    lat, lon = get_lat_lon_from_address(city, province)
+    closest = None
+    if lat is not None and lon is not None:
+        closest = find_closest_dealer(lat, lon) or _nearest_dealer_by_distance(lat, lon)
+    ttl = nearest_dealer_ttl(lat, closest)
+    if nearest_dealer_cacheable(key):
+        _NEAREST_DEALER_CACHE.put(key, (lat, lon, closest), ttl)
+    return lat, lon, closest, ttl
+
+
+def nearest_dealer_client(remote_addr, forwarded_for, api_key) -> str:
+    return client_id(remote_addr, forwarded_for, api_key, TRUSTED_PROXY_HOPS)
+
+
+def admit_nearest_dealer(client) -> None:
+    """Per-client budget for every lookup; raises RateLimited (429)."""
+    wait_s = _LOOKUP_LIMITER.try_acquire(client)
+    if wait_s:
+        metrics.inc("nearest_dealer_limited_total", reason="client")
+        raise RateLimited("Too many requests", wait_s)
+
+
+def admit_nearest_dealer_miss(client, key) -> None:
+    """
+    Extra checks before a lookup that will go out to OSRM / the geocoders: per-client and
+    process-wide miss budgets (429), and load shedding (503) when the place still needs
+    geocoding and every provider is cooling down or backed up.
+    """
+    wait_s = _MISS_LIMITER.try_acquire(client)
+    if wait_s:
+        metrics.inc("nearest_dealer_limited_total", reason="client_miss")
+        raise RateLimited("Too many new-location lookups", wait_s)
+    wait_s = _GLOBAL_MISS_LIMITER.try_acquire("*")
+    if wait_s:
+        metrics.inc("nearest_dealer_limited_total", reason="global_miss")
+        raise RateLimited("Dealer lookup is busy; try again shortly.", wait_s, status=503)
+    if geocoding.get_geo_cache().get(key) is None:
+        providers = geocoding.shared_providers()
+        busy_s = [max(p.cooling_down(), p.backlog_s()) for p in providers]
+        if providers and min(busy_s) > NEAREST_DEALER_MAX_GEOCODE_WAIT_S:
+            metrics.inc("nearest_dealer_limited_total", reason="geocoder_busy")
+            raise RateLimited("Dealer lookup is busy; try again shortly.", min(busy_s), status=503)
+
+
+def cached_nearest_dealer(city, province, client=None):
+    """
+    (lat, lon, closest_dealer, max_age_s) for a validated city/province: from the response
+    cache, else computed once per key however many threads ask at the same time.
+    With client set, a miss must pass admit_nearest_dealer_miss() first.
+    Places without a cache key are looked up every time.
+    """
+    key = nearest_dealer_cache_key(city, province)
+    if not nearest_dealer_cacheable(key):
+        if client is not None:
+            admit_nearest_dealer_miss(client, key)
+        return _lookup_nearest_dealer(key, city, province)
+    hit = _NEAREST_DEALER_CACHE.lookup(key)
+    if hit is not None:
+        (lat, lon, closest), max_age = hit
+        return lat, lon, closest, max_age
+    if client is not None and not _NEAREST_DEALER_FLIGHTS.in_flight(key):  # joining a running lookup costs nothing
+        admit_nearest_dealer_miss(client, key)
+    return _NEAREST_DEALER_FLIGHTS.do(key, lambda: _lookup_nearest_dealer(key, city, province))
+
+
+def nearest_dealer_cache_headers(body, max_age) -> dict:
+    """ETag + Cache-Control for a /nearest_dealer answer (private when an API key is required)."""
+    visibility = "private" if DEALER_LOOKUP_API_KEY else "public"
+    return {"ETag": etag_for(body), "Cache-Control": f"{visibility}, max-age={max(0, int(max_age))}"}
+
+
+@app.route("/nearest_dealer", methods=["GET", "POST", "OPTIONS"])
+@_traced_request("nearest_dealer")
 def nearest_dealer():
     """
     Public lookup endpoint for Wix dealer-search page.
     Body JSON:
       {"city":"Lumsden","province":"SK"}
+    or GET /nearest_dealer?city=Lumsden&province=SK (cacheable by browsers/CDNs).
     """
     if request.method == "OPTIONS":
         return _set_cors_headers(app.response_class(status=204))
 
     try:
-        if DEALER_LOOKUP_API_KEY:
-            sent_key = (request.headers.get("X-API-Key") or "").strip()
-            if sent_key != DEALER_LOOKUP_API_KEY:
-                return jsonify({"status": "error", "message": "Unauthorized"}), 401
-
-        payload = request.get_json(silent=True) or {}
-        city = str(payload.get("city") or payload.get("City") or "").strip()
-        province_raw = (
-            payload.get("province")
-            or payload.get("prov")
-            or payload.get("state")
-            or payload.get("Prov/State")
-            or ""
-        )
-        province = normalize_state(str(province_raw).strip())
-
-        if not city or not province:
-            return jsonify({
-                "status": "error",
-                "message": "Both city and province/state are required.",
-            }), 400
-        if province not in CANONICAL_CODES:
-            return jsonify({
-                "status": "error",
-                "message": (
-                    f"Invalid province/state value '{province_raw}'. "
-                    "Use a 2-letter code like SK, MB, AB."
-                ),
-            }), 400
-
-        lat, lon = get_lat_lon_from_address(city, province)
-        if lat is None or lon is None:
-            return jsonify({
-                "status": "no_match",
-                "message": "Could not geocode location.",
-                "city": city,
-                "province": province,
-            }), 200
-
-        closest = find_closest_dealer(lat, lon)
-        if not closest:
-            closest = _nearest_dealer_by_distance(lat, lon)
-            if not closest:
-                return jsonify({
-                    "status": "no_match",
-                    "message": "No dealer found within configured driving range.",
-                    "city": city,
-                    "province": province,
-                    "latitude": lat,
-                    "longitude": lon,
-                }), 200
-
-        return jsonify({
-            "status": "ok",
-            "city": city,
-            "province": province,
-            "latitude": lat,
-            "longitude": lon,
-            "dealer": {
-                "location": closest.get("Location"),
-                "contact": closest.get("Contact"),
-                "phone": closest.get("Phone"),
-                "email": closest.get("Email"),
-                "distance_km": closest.get("Distance_km"),
-                "drive_time_hr": closest.get("Drive_time_hr"),
-                "route_mode": closest.get("route_mode", "osrm"),
-            },
-        }), 200
+        sent_key = request.headers.get("X-API-Key")
+        if not dealer_lookup_authorized(sent_key):
+            return jsonify({"status": "error", "message": "Unauthorized"}), 401
+        client = nearest_dealer_client(request.remote_addr, request.headers.get("X-Forwarded-For"), sent_key)
+        admit_nearest_dealer(client)
+
+        if request.method == "GET":
+            payload = request.args.to_dict()
+        else:
+            payload = request.get_json(silent=True) or {}
+        city, province, error = parse_nearest_dealer_request(payload)
+        if error:
+            return jsonify(error[0]), error[1]
+
+        lat, lon, closest, max_age = cached_nearest_dealer(city, province, client)
+        body, status = nearest_dealer_result(city, province, lat, lon, closest)
+        headers = nearest_dealer_cache_headers(body, max_age)
+        if etag_matches(request.headers.get("If-None-Match"), headers["ETag"]):
+            return app.response_class(status=304, headers=headers)
+        return jsonify(body), status, headers
+    except RateLimited as e:
+        print(f"⚠️ nearest_dealer limited ({e.status}): {e.message}", flush=True)
+        body, status, headers = e.response()
+        return jsonify(body), status, headers
     except Exception as e:
         print(f"ERROR nearest_dealer: {e}", flush=True)
         traceback.print_exc()
         return jsonify({"status": "error", "message": str(e)}), 500
 
+
+def parse_nearest_dealer_batch(payload):
+    """Locations list from a batch body ({"locations": [...]} or a bare list); raises ValueError."""
+    items = payload.get("locations") if isinstance(payload, dict) else payload
+    if not isinstance(items, list) or not items:
+        raise ValueError('Body must be {"locations": [{"city": "...", "province": "..."}, ...]}.')
+    if len(items) > NEAREST_DEALER_BATCH_MAX:
+        raise ValueError(f"At most {NEAREST_DEALER_BATCH_MAX} locations per request.")
+    return items
+
+
+def iter_nearest_dealer_batch(items, client=None):
+    """
+    Resolve many locations in one pass; yields one result dict per input item (with its
+    "index"), in completion order:
+      1) validate and dedupe by cache key; response-cache hits are yielded straight away
+      2) geocode the rest (geo cache first); with client set, every response-cache miss is
+         charged to the same miss budgets / load shedding as a single lookup
+      3) route every remaining point with shared OSRM table requests (find_closest_dealers)
+    Results are stored in the /nearest_dealer response cache.
+    """
+    pending = {}  # cache key -> [(index, city, province)]
+    for i, item in enumerate(items):
+        city, province, error = parse_nearest_dealer_request(item if isinstance(item, dict) else {})
+        if error:
+            yield {"index": i, **error[0]}
+            continue
+        key = nearest_dealer_cache_key(city, province)
+        # Places without a cache key are not merged with each other or cached.
+        pending.setdefault(key if nearest_dealer_cacheable(key) else ("", i), []).append((i, city, province))
+
+    def results(refs, lat, lon, closest):
+        for i, city, province in refs:
+            body, _status = nearest_dealer_result(city, province, lat, lon, closest)
+            yield {"index": i, **body}
+
+    for key in list(pending):
+        hit = _NEAREST_DEALER_CACHE.lookup(key) if nearest_dealer_cacheable(key) else None
+        if hit is not None:
+            (lat, lon, closest), _max_age = hit
+            yield from results(pending.pop(key), lat, lon, closest)
+
+    points = {}
+    for key, refs in pending.items():
+        _i, city, province = refs[0]
+        if client is not None:
+            try:
+                admit_nearest_dealer_miss(client, key if nearest_dealer_cacheable(key) else "")
+            except RateLimited as e:
+                body, _status, _headers = e.response()
+                for i, _city, _province in refs:
+                    yield {"index": i, **body, "retry_after": e.retry_after_s}
+                continue
+        lat, lon = get_lat_lon_from_address(city, province)
+        if lat is None or lon is None:
+            if nearest_dealer_cacheable(key):
+                _NEAREST_DEALER_CACHE.put(key, (None, None, None), nearest_dealer_ttl(None, None))
+            yield from results(refs, None, None, None)
+            continue
+        points[key] = (float(lat), float(lon))
+
+    closest_by_point = find_closest_dealers(points.values()) if points else {}
+    for key, (lat, lon) in points.items():
+        closest = closest_by_point.get((lat, lon)) or _nearest_dealer_by_distance(lat, lon)
+        if nearest_dealer_cacheable(key):
+            _NEAREST_DEALER_CACHE.put(key, (lat, lon, closest), nearest_dealer_ttl(lat, closest))
+        yield from results(pending[key], lat, lon, closest)
+
+
+def ndjson_line(obj) -> bytes:
+    return (json.dumps(obj, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+@app.route("/nearest_dealer/batch", methods=["POST", "OPTIONS"])
+def nearest_dealer_batch():
+    """
+    Many /nearest_dealer lookups in one request.
+    Body JSON:
+      {"locations": [{"city":"Lumsden","province":"SK"}, {"city":"Brandon","province":"MB"}]}
+    Streams NDJSON (application/x-ndjson): one /nearest_dealer result per location plus its
+    "index" in the request, in completion order (cached answers first).
+    """
+    if request.method == "OPTIONS":
+        return _set_cors_headers(app.response_class(status=204))
+
+    try:
+        sent_key = request.headers.get("X-API-Key")
+        if not dealer_lookup_authorized(sent_key):
+            return jsonify({"status": "error", "message": "Unauthorized"}), 401
+        client = nearest_dealer_client(request.remote_addr, request.headers.get("X-Forwarded-For"), sent_key)
+        admit_nearest_dealer(client)
+        items = parse_nearest_dealer_batch(request.get_json(silent=True))
+    except RateLimited as e:
+        print(f"⚠️ nearest_dealer batch limited ({e.status}): {e.message}", flush=True)
+        body, status, headers = e.response()
+        return jsonify(body), status, headers
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    request_id = new_request_id(request.headers.get("X-Request-ID"))
+
+    def generate():
+        # Traced here rather than around the view: the work happens while the body streams.
+        with request_trace("nearest_dealer_batch", request_id, locations=len(items)):
+            try:
+                for result in iter_nearest_dealer_batch(items, client):
+                    yield ndjson_line(result)
+            except Exception as e:
+                print(f"ERROR nearest_dealer batch: {e}", flush=True)
+                traceback.print_exc()
+                yield ndjson_line({"status": "error", "message": str(e)})
+
+    print(f"📦 nearest_dealer batch: {len(items)} locations", flush=True)
+    return Response(
+        stream_with_context(generate()),
+        mimetype="application/x-ndjson",
+        headers={"Cache-Control": "no-store", "X-Request-ID": request_id},
+    )
+
+
+def claim_submission(payload) -> bool:
+    """
+    Duplicate protection: record payload's submissionId for DEDUP_WINDOW_S (shared by all worker
+    processes through the cache DB). Returns False when the same submission was already seen
+    (caller should ignore it).
+    """
+    submission_id = payload.get("data", {}).get("submissionId")
+    if not submission_id:
+        print("⚠️ No submissionId found — skipping dedup check", flush=True)
+        metrics.inc("webhook_submissions_total", result="no_id")
+        return True
+
+    try:
+        new = get_cache_db().claim_submission(str(submission_id), DEDUP_WINDOW_S)
+    except sqlite3.Error as e:
+        print(f"⚠️ Dedup DB unavailable ({e}); checking this process only", flush=True)
+        new = _claim_in_process(submission_id)
+    if not new:
+        print(f"⚠️ Duplicate submission ignored: {submission_id}", flush=True)
+        metrics.inc("webhook_submissions_total", result="duplicate")
+        return False
+    metrics.inc("webhook_submissions_total", result="new")
+    return True
+
+
+def _claim_in_process(submission_id) -> bool:
+    now = datetime.now(timezone.utc)
+    cutoff = now - timedelta(seconds=DEDUP_WINDOW_S)
+    with _processed_lock:
+        # 🧹 Clean out old entries
+        for sid, ts in list(processed_submissions.items()):
+            if ts < cutoff:
+                del processed_submissions[sid]
+        if submission_id in processed_submissions:
+            return False
+        processed_submissions[submission_id] = now
+    return True
+
+
+def metrics_authorized(auth_header) -> bool:
+    """Authorization check for /metrics (open when METRICS_TOKEN is unset)."""
+    if not METRICS_TOKEN:
+        return True
+    return (auth_header or "").strip() == f"Bearer {METRICS_TOKEN}"
+
+
+def _per_geocoder(fn) -> dict:
+    # only providers already in use: a scrape must not build geocoder clients
+    return {(("provider", p.name),): fn(p) for p in geocoding._PROVIDERS or []}
+
+
+metrics.register("http_requests_in_flight", "HTTP requests being handled by this process.", lambda: _HTTP_IN_FLIGHT.value)
+metrics.register("geocoder_cooldown_seconds", "Seconds left in each geocoder's 429 cooldown (0 = usable).",
+                 lambda: _per_geocoder(lambda p: p.cooling_down()))
+metrics.register("geocoder_backlog_seconds", "How long a new request to each geocoder would wait for its slot.",
+                 lambda: _per_geocoder(lambda p: p.backlog_s()))
+metrics.register("nearest_dealer_cache_total", "/nearest_dealer response cache lookups by result (hit/miss).",
+                 lambda: {(("result", "hit"),): _NEAREST_DEALER_CACHE.hits, (("result", "miss"),): _NEAREST_DEALER_CACHE.misses},
+                 kind="counter")
+metrics.register("nearest_dealer_cache_entries", "Entries in the /nearest_dealer response cache.", lambda: len(_NEAREST_DEALER_CACHE))
+metrics.register("dedup_tracked_submissions", "Submission ids remembered for duplicate protection (10 min window, all workers).",
+                 lambda: get_cache_db().submission_count())
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    """Prometheus scrape endpoint (counters, gauges and latency histograms of this worker)."""
+    if not metrics_authorized(request.headers.get("Authorization")):
+        return jsonify({"status": "error", "message": "Unauthorized"}), 401
+    return Response(metrics.render(), content_type=METRICS_CONTENT_TYPE, headers={"Cache-Control": "no-store"})
+
+
 @app.route("/wix_form_webhook", methods=["POST"])
+@_traced_request("wix_form_webhook")
 def wix_form_webhook():
     """Main webhook entrypoint for Wix forms"""
     print("🔔 Received webhook request", flush=True)
@@ -373,25 +599,12 @@ def wix_form_webhook():
         #print("✅ Raw incoming JSON:", json.dumps(payload, indent=2), flush=True)
 
         # --- Extract submissionId for deduplication ---
-        submission_id = payload.get("data", {}).get("submissionId")
-        now = datetime.now(timezone.utc)
-        cutoff = now - timedelta(minutes=10)
-
-        # 🧹 Clean out old entries (>10 minutes old)
-        for sid, ts in list(processed_submissions.items()):
-            if ts < cutoff:
-                del processed_submissions[sid]
-
-        if submission_id:
-            if submission_id in processed_submissions:
-                print(f"⚠️ Duplicate submission ignored: {submission_id}", flush=True)
-                return jsonify({"status": "duplicate_ignored"}), 200
-            processed_submissions[submission_id] = now
-        else:
-            print("⚠️ No submissionId found — skipping dedup check", flush=True)
+        if not claim_submission(payload):
+            return jsonify({"status": "duplicate_ignored"}), 200
 
         # --- Process the form ---
-        return handle_form(payload)
+        result, status = handle_form(payload)
+        return jsonify(result), status
 
     except Exception as e:
         print(f"❌ Error processing webhook: {e}", flush=True)
@@ -403,8 +616,9 @@ def wix_form_webhook():
 # --------------------------------------------------------------------
 # 2️⃣  Central form dispatcher
 # --------------------------------------------------------------------
+@traced()
 def handle_form(payload):
-    """Handles routing based on formName field in Wix payload"""
+    """Handles routing based on formName field in Wix payload; returns (result dict, HTTP status)"""
     try:
         data = payload.get("data", {})
         form_name = data.get("formName", "Unknown Form")
@@ -425,12 +639,12 @@ def handle_form(payload):
             print(f"⚠️ Unknown form type: {form_name}", flush=True)
             result = {"status": "ignored", "reason": f"Unhandled form '{form_name}'"}
 
-        return jsonify(result), 200
+        return result, 200
 
     except Exception as e:
         print("❌ Exception occurred in handle_form:", flush=True)
         traceback.print_exc()
-        return jsonify({"status": "error", "message": str(e)}), 500
+        return {"status": "error", "message": str(e)}, 500
 
 # --------------------------------------------------------------------
 # 2️⃣  Form Handlers
@@ -607,6 +821,7 @@ def format_north_american_phone(phone_value):
     return raw
 
 
+@traced()
 def build_common_data(fields):
     """Flatten Wix fields into your normalized data dict"""
     data = {
@@ -637,6 +852,7 @@ def build_common_data(fields):
 # --------------------------------------------------------------------
 # 4️⃣  Dealer lookup and geocoding
 # --------------------------------------------------------------------
+@traced()
 def build_dealer_info(data):
     """Find nearest dealer (driving <=2h) and return formatted string."""
     if not data["City"] or not data["Prov/State"]:
@@ -654,62 +870,20 @@ def build_dealer_info(data):
     )
 
 
-def get_lat_lon_from_address(city, province_state, country="Canada", attempt=1):
-    """Geocode city+province to latitude/longitude, with retries"""
-    global LAST_GEOCODE_REQUEST_TS, GEOCODE_COOLDOWN_UNTIL
-
-    province_norm = str(province_state or "").strip().upper()
-    province_for_geocode = GEOCODE_PROVINCE_NAMES.get(province_norm, province_state)
-    full_address = f"{city}, {province_for_geocode}, {country}"
-    cached = _get_cached_coords(city, province_state, country)
-    if cached:
-        return cached
-
-    now = time.time()
-    if now < GEOCODE_COOLDOWN_UNTIL:
-        remaining = round(GEOCODE_COOLDOWN_UNTIL - now, 1)
-        print(
-            f"WARNING: Skipping geocode for '{full_address}' during 429 cooldown ({remaining}s remaining)",
-            flush=True,
-        )
+@traced()
+def get_lat_lon_from_address(city, province_state, country="Canada"):
+    """Geocode city+province to latitude/longitude via the shared geo cache and provider chain"""
+    # During a provider's 429 cooldown we skip it instead of holding the request open.
+    coords = geocoding.geocode(city, province_state, country, wait_on_cooldown=False)
+    if coords is None:
         return None, None
-
-    wait_s = GEOCODE_RATE_LIMIT_SECONDS - (now - LAST_GEOCODE_REQUEST_TS)
-    if wait_s > 0:
-        time.sleep(wait_s)
-
-    print(f"DEBUG: Geocoding '{full_address}' (attempt {attempt})", flush=True)
-    try:
-        LAST_GEOCODE_REQUEST_TS = time.time()
-        location = geolocator.geocode(full_address, timeout=10)
-        coords = _extract_location_coords(location)
-        if coords:
-            print(f"DEBUG: Success → {coords[0]}, {coords[1]}", flush=True)
-            _store_cached_coords(city, province_state, country, coords)
-            return coords
-        print(f"WARNING: Could not geocode '{full_address}'", flush=True)
-        return _try_arcgis_geocode(full_address, city, province_state, country)
-    except GeocoderTimedOut:
-        if attempt < 3:
-            print("Retrying geocode after timeout...", flush=True)
-            time.sleep(2)
-            return get_lat_lon_from_address(city, province_state, country, attempt + 1)
-        print("ERROR: Geocoding permanently failed after retries", flush=True)
-        return _try_arcgis_geocode(full_address, city, province_state, country)
-    except Exception as e:
-        print(f"ERROR: Geocoding error: {e}", flush=True)
-        if "429" in str(e):
-            GEOCODE_COOLDOWN_UNTIL = time.time() + GEOCODE_429_COOLDOWN_SECONDS
-            print(
-                f"WARNING: Entering geocode cooldown for {int(GEOCODE_429_COOLDOWN_SECONDS)}s after 429 response",
-                flush=True,
-            )
-        return _try_arcgis_geocode(full_address, city, province_state, country)
+    return coords
 
 
 # --------------------------------------------------------------------
 # 5️⃣  Central Odoo Sync Logic
 # --------------------------------------------------------------------
+@traced()
 def sync_to_odoo(data):
     """Core logic for creating/updating contacts and opportunities in Odoo"""
     try:
@@ -771,6 +945,18 @@ def sync_to_odoo(data):
         else:
             description_html = message_html
 
+        # A new lead gets the Dealer value in its create when Odoo will put it on the Dealer
+        # property's team (the team it gave our previous create). An existing lead gets it in a write
+        # of its own after the update, so a rejected Dealer value can't fail the update, and is left
+        # alone when it was modified after find_existing_opportunity read it.
+        dealer_vals = None
+        lead_unchanged = True
+        if closest and closest.get("Location"):
+            if existing_opp:
+                lead_unchanged = lead_unmodified_since(existing_opp["id"], existing_opp.get("write_date"))
+            else:
+                dealer_vals = build_dealer_property_vals(closest["Location"], lead_create_team())
+
         if existing_opp:
             print(f"📂 Updating existing opportunity {existing_opp['id']}", flush=True)
             update_data = {
@@ -790,8 +976,18 @@ def sync_to_odoo(data):
                 "city": data.get("City") or False,
                 "Prov/State": data.get("Prov/State") or "",
             }
+            if dealer_vals:
+                opp_data.update(dealer_vals)
             #print(f"DEBUG: About to call create_odoo_opportunity with data: {json.dumps(opp_data, indent=2)}", flush=True)
             opportunity_id = create_odoo_opportunity(opp_data)
+            if opportunity_id is False and dealer_vals:
+                # Rejected, e.g. a Dealer option deleted in Odoo since it was cached: create the lead
+                # without it; the Dealer value is then set below as for a lead on another team.
+                print("⚠️ Opportunity create rejected with the Dealer property; retrying without it", flush=True)
+                for key in dealer_vals:
+                    opp_data.pop(key, None)
+                dealer_vals = None
+                opportunity_id = create_odoo_opportunity(opp_data)
             #print(f"DEBUG: create_odoo_opportunity() returned: {opportunity_id}", flush=True)            
 
         if not opportunity_id:
@@ -803,8 +999,20 @@ def sync_to_odoo(data):
                 f"DEBUG dealer_sync: evaluating dealer for lead {opportunity_id} city='{city}' prov='{prov}'",
                 flush=True,
             )
-            if closest and closest.get("Location"):
-                set_ok = set_dealer_property_on_lead(models, uid, opportunity_id, closest["Location"])
+            if closest and closest.get("Location") and not lead_unchanged:
+                print(
+                    f"⚠️ Lead {opportunity_id} was modified after it was read; "
+                    f"Dealer property left as is (closest dealer: {closest['Location']})",
+                    flush=True,
+                )
+            elif closest and closest.get("Location"):
+                if dealer_vals:
+                    set_ok = True
+                else:
+                    set_ok = set_dealer_property_on_lead(
+                        models, uid, opportunity_id, closest["Location"],
+                        lead_team=existing_opp.get("team_id") if existing_opp else None,
+                    )
                 if set_ok:
                     print(
                         f"🏷️ Set Dealer property on lead {opportunity_id} "
@@ -869,6 +1077,47 @@ def sync_to_odoo(data):
 
 
 # --------------------------------------------------------------------
+# 6️⃣  Serving: pre-warm + app factory
+# --------------------------------------------------------------------
+def prewarm():
+    """
+    Load everything the first request would otherwise pay for: geo cache, route cache,
+    dealer index, geocoder clients, Odoo session + reference data.
+    Failures are logged and left to the lazy paths; they never stop the worker from starting.
+    """
+    t0 = time.time()
+    steps = [
+        ("geo cache", lambda: f"{len(geocoding.get_geo_cache())} entries"),
+        ("route cache", lambda: f"{len(_load_route_cache())} entries"),
+        ("dealer index", lambda: f"{len(dealer_points())} dealers"),
+        ("geocoders", lambda: ", ".join(p.name for p in geocoding.shared_providers())),
+        ("odoo session", lambda: "ok" if warm_odoo_session() else "unavailable"),
+    ]
+    for name, step in steps:
+        try:
+            print(f"🔥 Pre-warm {name}: {step()}", flush=True)
+        except Exception as e:
+            print(f"⚠️ Pre-warm {name} failed: {e}", flush=True)
+    print(f"🔥 Pre-warm done in {time.time() - t0:.1f}s", flush=True)
+
+
+def create_app(warm: bool = True):
+    """
+    WSGI entry point: gunicorn -c gunicorn.conf.py (loads "webhook_server:create_app()").
+    Each worker runs this before it accepts traffic, so it is warm when the first request lands.
+    """
+    if warm:
+        prewarm()
+    return app
+
+
 if __name__ == "__main__":
-    print("🚀 Flask webhook server starting...", flush=True)
-    app.run(host="0.0.0.0", port=8080, debug=True)
+    # Local development only; production runs under gunicorn (see gunicorn.conf.py).
+    print("🚀 Flask webhook server starting (development server)...", flush=True)
+    create_app()
+    app.run(
+        host="0.0.0.0",
+        port=int(os.getenv("PORT", "8080")),
+        debug=os.getenv("FLASK_DEBUG") == "1",
+        threaded=True,
+    )
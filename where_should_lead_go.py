@@ -5,8 +5,8 @@ Find which dealer a lead should be sent to, using existing routing code.
 Default query: Vegreville, Alberta, Canada.
 
 Routing order:
-1) Use cached city coordinates from geo_city_cache.json when available.
-2) Otherwise geocode with Nominatim (if installed/available).
+1) Use cached city coordinates from the shared geocode cache when available.
+2) Otherwise geocode with the shared provider chain in geocoding.py (if geopy is installed).
 3) Use odoo_connector.find_closest_dealer (OSRM driving <= 2h logic).
 4) If OSRM is unavailable, fall back to nearest straight-line dealer.
 """
@@ -14,8 +14,6 @@ Routing order:
 from __future__ import annotations
 
 import argparse
-import json
-from pathlib import Path
 from typing import Optional, Tuple
 
 from odoo_connector import (
@@ -23,62 +21,18 @@ from odoo_connector import (
     MAX_DEALER_DRIVE_HOURS,
     find_closest_dealer,
     haversine_distance,
-    normalize_state,
 )
-
-GEO_CACHE_PATH = Path("geo_city_cache.json")
-
-
-def _geo_key(city: str, prov: str, country: str) -> str:
-    return f"{city.strip().lower()}|{prov.strip().lower()}|{country.strip().lower()}"
-
-
-def _load_geo_cache() -> dict:
-    if not GEO_CACHE_PATH.exists():
-        return {}
-    try:
-        raw = json.loads(GEO_CACHE_PATH.read_text(encoding="utf-8"))
-        return raw if isinstance(raw, dict) else {}
-    except Exception:
-        return {}
-
+import geocoding
 
 def _coords_from_cache(city: str, province: str, country: str) -> Optional[Tuple[float, float]]:
-    cache = _load_geo_cache()
-    prov = province.strip()
-    country_clean = country.strip() or "Canada"
-
-    candidates = [
-        _geo_key(city, prov, country_clean),
-        _geo_key(city, f"{prov} CA", country_clean),
-        _geo_key(city, normalize_state(prov), country_clean),
-    ]
-
-    for key in candidates:
-        val = cache.get(key)
-        if isinstance(val, (list, tuple)) and len(val) == 2:
-            try:
-                return float(val[0]), float(val[1])
-            except Exception:
-                continue
-    return None
+    return geocoding.get_geo_cache().lookup(city, province, country.strip() or "Canada")
 
 
 def _coords_from_geocode(city: str, province: str, country: str) -> Optional[Tuple[float, float]]:
     try:
-        from geopy.geocoders import Nominatim
-    except Exception:
-        return None
-
-    geolocator = Nominatim(user_agent="WavcorDealerLookup")
-    query = f"{city}, {province}, {country}"
-    try:
-        loc = geolocator.geocode(query, timeout=10)
-        if loc:
-            return float(loc.latitude), float(loc.longitude)
+        return geocoding.geocode(city, province, country.strip() or "Canada")
     except Exception:
         return None
-    return None
 
 
 def _nearest_dealer_haversine(lat: float, lon: float):
@@ -107,7 +61,7 @@ def main() -> int:
     country = args.country.strip()
 
     coords = _coords_from_cache(city, province, country)
-    source = "geo_city_cache.json"
+    source = "geocode cache"
     if not coords:
         coords = _coords_from_geocode(city, province, country)
         source = "geopy"